@@ -0,0 +1,208 @@
+import argparse
+import asyncio
+import random
+import time
+import networkx as nx
+import ByzantineAuth
+import ByzantineConsensus
+from ByzantineAuth import BANode, setup_network
+from ByzantineConsensus import State, build_nodes
+from SignatureSchemes import get_scheme
+
+# Sentinel put in an inbox to end the node's coroutine
+_STOP = object()
+
+
+class AsyncInbox:
+    """
+    Stand-in for a node's Queue backed by an asyncio.Queue.
+
+    put is synchronous and never blocks, so the unchanged node handlers broadcast with plain puts. Every put is
+    counted as a message in flight of the runner.
+
+    :param AsyncRunner runner: The runner counting the messages in flight.
+    """
+    __slots__ = ('runner', 'queue')
+
+    def __init__(self, runner):
+        self.runner = runner
+        self.queue = asyncio.Queue()
+
+    def put(self, item):
+        self.runner.in_flight += 1
+        self.queue.put_nowait(item)
+
+
+class AsyncRunner:
+    """
+    Runs every node as a coroutine of one event loop.
+
+    A node's coroutine awaits items of its inbox and hands them to a handler. The run is over as soon as no message
+    is in flight, i.e. every put item has been handled, so no sleep or timeout decides when nodes stop.
+
+    Attributes:
+        in_flight (int): Number of put items not handled yet.
+        handled (int): Number of handled items.
+    """
+    def __init__(self):
+        self.in_flight = 0
+        self.handled = 0
+        self._idle = None
+
+    def inbox(self):
+        """
+        Returns a new inbox counted by this runner.
+        """
+        return AsyncInbox(self)
+
+    async def serve(self, inbox, handle):
+        """
+        Hands the items of an inbox to handle until the stop sentinel arrives.
+
+        :param AsyncInbox inbox: The node's inbox.
+        :param handle: Callable receiving each item.
+        """
+        queue = inbox.queue
+        while True:
+            item = await queue.get()
+            if item is _STOP:
+                return
+            handle(item)
+            self.handled += 1
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self._idle.set()
+
+    async def run(self, inboxes, start):
+        """
+        Serves the inboxes, calls start and returns once no message is in flight.
+
+        :param dict inboxes: Handler of every inbox.
+        :param start: Callable sending the first messages.
+        :return: The number of handled items.
+        """
+        self._idle = asyncio.Event()
+        tasks = [asyncio.create_task(self.serve(inbox, handle)) for inbox, handle in inboxes.items()]
+        start()
+        if self.in_flight > 0:
+            await self._idle.wait()
+        for inbox in inboxes:
+            inbox.queue.put_nowait(_STOP)
+        await asyncio.gather(*tasks)
+        return self.handled
+
+
+class AsyncBANode(BANode):
+    """
+    BANode whose inbox is an asyncio inbox instead of a thread-safe queue.
+
+    The node is never started as a thread, :func:`run_agreement` drives it through the inherited handle_delivery.
+
+    Attributes:
+        inbox (AsyncInbox): The node's inbox, set by :func:`run_agreement`.
+    """
+    def __init__(self, *args, **kwargs):
+        BANode.__init__(self, *args, **kwargs)
+        self.inbox = None
+
+
+async def run_consensus(nodes):
+    """
+    Runs ByzantineConsensus.BCNode nodes as coroutines until no message is in flight.
+
+    :param list nodes: The nodes, started in this order.
+    :return: The number of handled events.
+    """
+    runner = AsyncRunner()
+    inboxes = {}
+    for node in nodes:
+        node.queue = runner.inbox()
+        inboxes[node.queue] = node.handle_event
+
+    def start():
+        for node in nodes:
+            node.send_init()
+    return await runner.run(inboxes, start)
+
+
+async def run_agreement(nodes):
+    """
+    Runs AsyncBANode nodes as coroutines until no message is in flight.
+
+    :param list nodes: The nodes, the general is the first one.
+    :return: The number of handled messages.
+    """
+    runner = AsyncRunner()
+    inboxes = {}
+    for node in nodes:
+        node.inbox = runner.inbox()
+        inboxes[node.inbox] = node.handle_delivery
+
+    def start():
+        for node in nodes:
+            if node.is_general:
+                node.start_agreement()
+    handled = await runner.run(inboxes, start)
+    for node in nodes:
+        node.stop_event.set()
+    return handled
+
+
+def simulate_consensus(node_count, byzantine_ids=(), seed=None):
+    """
+    Runs one Bracha-style consensus on a complete graph in the asyncio backend.
+
+    :param int node_count: Number of nodes.
+    :param byzantine_ids: Ids of the Byzantine nodes.
+    :param int seed: Seed of the nodes' random choices (optional).
+    :return: A dict of node id to decided value, None for undecided nodes.
+    """
+    byzantine_ids = set(byzantine_ids)
+    ByzantineConsensus.node_count = node_count
+    ByzantineConsensus.byzantine_count = len(byzantine_ids)
+    rng = random.Random(seed) if seed is not None else None
+    nodes = build_nodes(nx.complete_graph(node_count), byzantine_ids, rng)
+    asyncio.run(run_consensus(list(nodes.values())))
+    return {node_id: node.decided_value if node.state == State.DECIDED else None for node_id, node in nodes.items()}
+
+
+def simulate_agreement(num_nodes, k, byzantine_nodes, signature_scheme=None, chain_format=None):
+    """
+    Runs one authenticated agreement in the asyncio backend.
+
+    :param int num_nodes: Number of nodes, node 0 is the general.
+    :param int k: Number of pulses.
+    :param byzantine_nodes: Ids of the Byzantine nodes.
+    :param SignatureScheme signature_scheme: Scheme of the nodes (optional).
+    :param str chain_format: Chain format of the nodes (optional).
+    :return: A dict of node id to final decision.
+    """
+    ByzantineAuth.num_nodes = num_nodes
+    nodes = setup_network(num_nodes, k, byzantine_nodes, signature_scheme, chain_format, node_class=AsyncBANode)
+    asyncio.run(run_agreement(nodes))
+    return {node.node_id: node.final_decision for node in nodes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the standalone nodes as asyncio coroutines.")
+    parser.add_argument('protocol', choices=['consensus', 'agreement'])
+    parser.add_argument('-n', '--nodes', type=int, default=5)
+    parser.add_argument('-b', '--byzantine', type=int, nargs='*', default=[2], help="ids of the Byzantine nodes")
+    parser.add_argument('-k', '--pulses', type=int, default=1, help="number of pulses of the agreement")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--scheme', help="signature scheme of the agreement, e.g. simulated")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.protocol == 'consensus':
+        decisions = simulate_consensus(args.nodes, args.byzantine, args.seed)
+    else:
+        scheme = get_scheme(args.scheme) if args.scheme else None
+        decisions = simulate_agreement(args.nodes, args.pulses, set(args.byzantine), scheme)
+    elapsed = time.perf_counter() - start
+    undecided = sum(1 for value in decisions.values() if value is None)
+    print(f"{len(decisions)} nodes finished in {elapsed:.3f}s, {undecided} without a decision")
+
+
+if __name__ == "__main__":
+    main()
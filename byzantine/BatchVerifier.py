@@ -0,0 +1,180 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Environment variable that makes the auth nodes verify incoming messages in batches by default
+BATCH_VERIFY_ENV = 'BYZANTINE_BATCH_VERIFY'
+# Below this many distinct signature checks a batch is verified in the calling thread
+PARALLEL_THRESHOLD = 16
+# Number of chunks handed to each worker process per batch
+CHUNKS_PER_WORKER = 4
+
+_worker_verifiers = None
+
+
+def _init_worker(scheme, public_keys):
+    global _worker_verifiers
+    _worker_verifiers = {node_id: scheme.verifier(scheme.import_public_key(data))
+                         for node_id, data in public_keys.items()}
+
+
+def _verify_checks(checks):
+    return [_worker_verifiers[node_id](data, signature) for node_id, data, signature in checks]
+
+
+def _encode(value):
+    return value.encode('utf-8') if isinstance(value, str) else value
+
+
+def default_batch_verification():
+    """
+    Returns whether BYZANTINE_BATCH_VERIFY is set to anything but "" or "0", False if unset.
+    """
+    return os.environ.get(BATCH_VERIFY_ENV, '') not in ('', '0')
+
+
+class BatchVerifier:
+    """
+    Verifies the signature chains of many messages at once on a process pool.
+
+    Every chain is first checked for distinct, known signers. The remaining (signer, value, signature) checks of the
+    batch are deduplicated, looked up in the receiving node's :class:`CryptoCache` and the rest is fanned out to
+    worker processes, since pycryptodome holds the GIL while verifying. The verifier is shared by the nodes of a run,
+    so batches may be verified from several node threads at once.
+
+    :param SignatureScheme scheme: The signature scheme of the nodes.
+    :param dict public_keys: Public key of every node id.
+    :param int max_workers: Number of worker processes, defaults to the number of cores.
+    :param int parallel_threshold: Minimum number of signature checks for which the pool is used.
+
+    Attributes:
+        batches (int): Number of verified batches.
+        checks (int): Number of signature checks computed by this verifier.
+    """
+    def __init__(self, scheme, public_keys, max_workers=None, parallel_threshold=PARALLEL_THRESHOLD):
+        self.scheme = scheme
+        self.public_keys = dict(public_keys)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.parallel_threshold = parallel_threshold
+        self.batches = 0
+        self.checks = 0
+        self._verifiers = {}
+        self._executor = None
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def _executor_for_batch(self):
+        with self._lock:
+            if self._executor is None:
+                exported = {node_id: self.scheme.export_public_key(key) for node_id, key in self.public_keys.items()}
+                self._executor = ProcessPoolExecutor(self.max_workers, initializer=_init_worker,
+                                                     initargs=(self.scheme, exported))
+            return self._executor
+
+    def _verifier(self, node_id):
+        with self._lock:
+            verifier = self._verifiers.get(node_id)
+            if verifier is None:
+                verifier = self._verifiers[node_id] = self.scheme.verifier(self.public_keys[node_id])
+            return verifier
+
+    def _verify_serial(self, checks):
+        return [self._verifier(node_id)(data, signature) for node_id, data, signature in checks]
+
+    def submit(self, value, signature_chain):
+        """
+        Queues a message for the next :meth:`verify_pending` call.
+
+        :param str value: The message value.
+        :param list signature_chain: The chain of (node_id, signature) tuples.
+        :return: The index of the message in the pending batch.
+        """
+        self._pending.append((value, signature_chain))
+        return len(self._pending) - 1
+
+    def verify_pending(self, cache=None):
+        """
+        Verifies every queued message and clears the queue.
+
+        :param CryptoCache cache: Cache consulted before and filled after verifying (optional).
+        :return: One bool per queued message, in arrival order.
+        """
+        pending, self._pending = self._pending, []
+        return self.verify_batch(pending, cache)
+
+    def verify_batch(self, messages, cache=None):
+        """
+        Verifies a batch of messages.
+
+        :param list messages: (value, signature_chain) pairs.
+        :param CryptoCache cache: Cache consulted before and filled after verifying (optional).
+        :return: One bool per message, True if its chain has distinct signers and only valid signatures.
+        """
+        known = {}
+        unknown = {}
+        well_formed = []
+        for value, signature_chain in messages:
+            signers = [node_id for node_id, signature in signature_chain]
+            well_formed.append(len(set(signers)) == len(signers)
+                               and all(node_id in self.public_keys for node_id in signers))
+            if not well_formed[-1]:
+                continue
+            for node_id, signature in signature_chain:
+                triple = (node_id, value, signature)
+                if triple in known or triple in unknown:
+                    continue
+                valid = cache.lookup(node_id, value, signature) if cache is not None else None
+                if valid is None:
+                    unknown[triple] = (node_id, _encode(value), signature)
+                else:
+                    known[triple] = valid
+
+        if unknown:
+            triples = list(unknown.keys())
+            checks = list(unknown.values())
+            if len(checks) < self.parallel_threshold:
+                results = self._verify_serial(checks)
+            else:
+                size = -(-len(checks) // (self.max_workers * CHUNKS_PER_WORKER))
+                chunks = [checks[start:start + size] for start in range(0, len(checks), size)]
+                results = [valid for chunk in self._executor_for_batch().map(_verify_checks, chunks) for valid in chunk]
+            for triple, valid in zip(triples, results):
+                known[triple] = valid
+                if cache is not None:
+                    cache.remember(*triple, valid)
+        with self._lock:
+            self.checks += len(unknown)
+            self.batches += 1
+
+        verdicts = []
+        for (value, signature_chain), ok in zip(messages, well_formed):
+            verdicts.append(ok and all(known[(node_id, value, signature)] for node_id, signature in signature_chain))
+        return verdicts
+
+    def shutdown(self):
+        """
+        Stops the worker processes.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+def attach_batch_verifier(nodes, **options):
+    """
+    Builds the one batch verifier of a run and hands it to every node that verifies in batches.
+
+    Called once when the nodes of a run are set up, after all of them generated their keys.
+
+    :param list nodes: The auth nodes, each with node_id, scheme, public_key and batch_verification attributes.
+    :param options: Keyword arguments of the :class:`BatchVerifier`.
+    :return: The :class:`BatchVerifier`, None if no node verifies in batches.
+    """
+    batch_nodes = [node for node in nodes if node.batch_verification]
+    if not batch_nodes:
+        return None
+    verifier = BatchVerifier(nodes[0].scheme, {node.node_id: node.public_key for node in nodes}, **options)
+    for node in batch_nodes:
+        node.batch_verifier = verifier
+    return verifier
@@ -0,0 +1,218 @@
+import hashlib
+import struct
+import threading
+from collections import namedtuple
+from functools import partial
+from adhoccomputing.Generics import Event
+
+# Most values in one batch
+DEFAULT_BATCH_SIZE = 32
+# Seconds the first value of a batch may wait for more values
+DEFAULT_BATCH_TIMEOUT = 0.05
+# Consensus instance of the first batch, instance 0 is the one every node starts on its own
+FIRST_BATCH_INSTANCE = 1
+# Event type a batch reaches the inbox of a node with
+_BATCH = 'consensusbatch'
+
+Batch = namedtuple('Batch', ['sequence', 'values', 'digest'])
+Batch.__doc__ = """
+Values agreed on together: the sequence number of the batch, the tuple of client values and their batch_digest.
+"""
+
+
+def batch_digest(values):
+    """
+    Returns the digest of the values of a batch, the one thing the nodes agree on per batch.
+
+    :param values: The values, each hashed by its repr.
+    :return: The SHA256 digest.
+    """
+    digest = hashlib.sha256(b'batch:')
+    for value in values:
+        data = repr(value).encode('utf-8')
+        digest.update(struct.pack('<I', len(data)))
+        digest.update(data)
+    return digest.digest()
+
+
+class Batcher:
+    """
+    Accumulates client values into batches.
+
+    A batch is sealed once it holds max_batch values or timeout seconds after its first value arrived, whichever
+    comes first. Sealed batches get consecutive sequence numbers and are handed to propose in that order.
+
+    :param propose: Callable taking every sealed Batch.
+    :param int max_batch: Most values in one batch.
+    :param float timeout: Seconds the first value of a batch may wait for more values, None to only seal full batches.
+
+    Attributes:
+        pending (list): Values of the batch being filled.
+        sequence (int): Sequence number of the next batch.
+    """
+    def __init__(self, propose, max_batch=DEFAULT_BATCH_SIZE, timeout=DEFAULT_BATCH_TIMEOUT):
+        self.propose = propose
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.pending = []
+        self.sequence = 0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def submit(self, value):
+        """
+        Adds a client value to the current batch, from any thread.
+        """
+        with self._lock:
+            self.pending.append(value)
+            if len(self.pending) >= self.max_batch:
+                self._seal()
+            elif self._timer is None and self.timeout is not None:
+                self._timer = threading.Timer(self.timeout, self._expire, [self.sequence])
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """
+        Seals the current batch now, if it holds any value.
+        """
+        with self._lock:
+            self._seal()
+
+    def _expire(self, sequence):
+        with self._lock:
+            # The batch the timer was started for may already be sealed by size
+            if self.sequence == sequence:
+                self._seal()
+
+    def _seal(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self.pending:
+            return
+        values = tuple(self.pending)
+        self.pending = []
+        batch = Batch(self.sequence, values, batch_digest(values))
+        self.sequence += 1
+        self.propose(batch)
+
+
+class OrderedDelivery:
+    """
+    Delivers decided batches in sequence order, holding back those decided ahead of an earlier batch.
+
+    :param deliver: Callable taking every accepted Batch in order.
+    :param int first: Sequence number of the first batch.
+
+    Attributes:
+        next_sequence (int): Sequence number of the next batch to deliver.
+        held (dict): Outcomes of the batches decided ahead of next_sequence, the Batch or None if rejected.
+        rejected (int): Number of batches skipped since the nodes did not accept them.
+    """
+    def __init__(self, deliver, first=0):
+        self.deliver = deliver
+        self.next_sequence = first
+        self.held = {}
+        self.rejected = 0
+
+    def decided(self, sequence, batch):
+        """
+        Records the outcome of a batch and delivers every batch that is next in order.
+
+        :param int sequence: Sequence number of the batch.
+        :param Batch batch: The batch, None if the nodes rejected it.
+        """
+        if sequence < self.next_sequence:
+            return
+        self.held[sequence] = batch
+        while self.next_sequence in self.held:
+            batch = self.held.pop(self.next_sequence)
+            self.next_sequence += 1
+            if batch is None:
+                self.rejected += 1
+            else:
+                self.deliver(batch)
+
+
+class BatchedConsensus:
+    """
+    Batching front-end of ConveniantByzantineConsensus: one consensus instance per batch instead of per value.
+
+    Client values go to a Batcher. Every sealed batch is sent to the inbox of every node, as a client multicasting it
+    to the replicas would, and gets the consensus instance FIRST_BATCH_INSTANCE + sequence. A node extends its
+    instances to that one only when it handles the batch, so it never votes on a batch it has not received, and the
+    VOTE, ECHO and DECIDE messages of peers that got the batch first wait until then. A node votes 1 if its own copy
+    of the values matches the digest it received and 0 if they do not match. A batch decided 1 is accepted, and every
+    node delivers its copies of the accepted batches in sequence order. The VOTE, ECHO and DECIDE messages of an
+    instance are thus shared by all values of its batch.
+
+    The nodes must be built, with instance_count left at 1, before the front-end is attached to them.
+
+    :param list nodes: The BCNodes.
+    :param deliver: Callable taking a node and each Batch it delivers.
+    :param int max_batch: Most values in one batch.
+    :param float timeout: Seconds the first value of a batch may wait for more values.
+
+    Attributes:
+        batcher (Batcher): The batcher client values are submitted to.
+        received (dict): Per node name, the batches the node received and has not finished, by sequence number.
+        zero_votes (dict): Per node name, the number of batch instances the node proposed 0 in.
+        deliveries (dict): OrderedDelivery per node name.
+    """
+    def __init__(self, nodes, deliver, max_batch=DEFAULT_BATCH_SIZE, timeout=DEFAULT_BATCH_TIMEOUT):
+        self.nodes = nodes
+        self.received = {}
+        self.zero_votes = {}
+        self.deliveries = {}
+        for node in nodes:
+            self.received[node.name] = {}
+            self.zero_votes[node.name] = 0
+            self.deliveries[node.name] = OrderedDelivery(partial(deliver, node))
+            node.eventhandlers[_BATCH] = partial(self.on_batch, node)
+            node.proposal = partial(self.proposal, node)
+            node.on_decision = partial(self.on_decision, node)
+        self.batcher = Batcher(self.propose, max_batch, timeout)
+
+    def submit(self, value):
+        """
+        Submits a client value, from any thread.
+        """
+        self.batcher.submit(value)
+
+    def propose(self, batch):
+        """
+        Sends a copy of a sealed batch to the inbox of every node.
+
+        :param Batch batch: The batch.
+        """
+        for node in self.nodes:
+            node.send_self(Event(node, _BATCH, Batch(batch.sequence, list(batch.values), batch.digest)))
+
+    def on_batch(self, node, eventobj):
+        """
+        Keeps the copy of a batch a node received in its inbox and lets the node open the instance of the batch.
+        """
+        batch = eventobj.eventcontent
+        self.received[node.name][batch.sequence] = batch
+        node.extend_instances(FIRST_BATCH_INSTANCE + batch.sequence + 1)
+
+    def proposal(self, node, instance):
+        """
+        Returns the vote of a node in the instance of a batch, 1 if its copy of the values matches the batch digest.
+        """
+        batch = self.received[node.name].get(instance - FIRST_BATCH_INSTANCE)
+        vote = int(batch is not None and batch_digest(batch.values) == batch.digest)
+        if not vote:
+            self.zero_votes[node.name] += 1
+        return vote
+
+    def on_decision(self, node, instance, decision):
+        """
+        Passes the outcome of a batch instance, with the node's copy of the batch, on to its ordered delivery.
+        """
+        if instance < FIRST_BATCH_INSTANCE:
+            return
+        sequence = instance - FIRST_BATCH_INSTANCE
+        batch = self.received[node.name].pop(sequence, None)
+        self.deliveries[node.name].decided(sequence, batch if decision == 1 else None)
@@ -0,0 +1,482 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import networkx as nx
+
+SUITES = ('threads', 'consensus', 'coalesced', 'instances', 'batched', 'auth', 'awerbuch')
+# Node counts of every suite, the AHC consensus needs minutes beyond 20 nodes
+DEFAULT_SIZES = {
+    'threads': (5, 10, 20, 40),
+    'consensus': (5, 10, 20),
+    'coalesced': (5, 10, 20),
+    'instances': (5, 10),
+    'batched': (5, 10),
+    'auth': (5, 10, 20, 40),
+    'awerbuch': (10, 20, 40),
+}
+# Metrics compared against a baseline, True where a higher value is better
+METRICS = {
+    'time_to_decision': False,
+    'messages_per_second': True,
+    'decisions_per_second': True,
+    'values_per_second': True,
+    'messages_per_value': False,
+    'handler_p50_us': False,
+    'handler_p99_us': False,
+    'peak_rss_kb': False,
+    'threads': False,
+}
+# Relative change of a metric reported as a regression
+DEFAULT_TOLERANCE = 0.10
+# Seconds between two samples of the thread count and two checks for completion
+POLL_INTERVAL = 0.01
+# A run that stops deciding ends once no handler ran for this many seconds
+QUIET_PERIOD = 3.0
+# Seconds a case gets beyond its timeout to report before it is killed
+KILL_GRACE = 5.0
+# Number of pulses of the auth suite
+AUTH_PULSES = 2
+# Consensus instances of the instances suite and the most of them a node runs at once
+INSTANCES = 50
+INSTANCE_WINDOW = 8
+# Client values of the batched suite and the most of them in one batch
+BATCHED_VALUES = 1000
+BATCH_SIZE = 50
+
+
+class HandlerTimer:
+    """
+    Measures the latency of message handlers by wrapping them on their class.
+
+    Handlers have to be wrapped before the nodes are built, since AHC binds them into eventhandlers on construction.
+
+    Attributes:
+        samples (list): Latency of every handler call in nanoseconds.
+        calls (dict): Number of calls per handler name.
+    """
+    def __init__(self):
+        self.samples = []
+        self.calls = {}
+
+    def instrument(self, cls, names):
+        """
+        Replaces methods of a class with timed wrappers.
+
+        :param type cls: The class to instrument.
+        :param names: Names of the handler methods.
+        """
+        for name in names:
+            setattr(cls, name, self._wrap(getattr(cls, name), name))
+            self.calls[name] = 0
+
+    def _wrap(self, handler, name):
+        samples, calls, clock = self.samples, self.calls, time.perf_counter_ns
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                samples.append(clock() - start)
+                calls[name] += 1
+        return timed
+
+    def percentiles(self):
+        """
+        Returns the p50, p90, p99 and maximum latency in microseconds, None if no handler ran.
+        """
+        if not self.samples:
+            return {f"handler_{label}_us": None for label in ('p50', 'p90', 'p99', 'max')}
+        ordered = sorted(self.samples)
+        last = len(ordered) - 1
+        return {f"handler_{label}_us": ordered[min(last, int(fraction * len(ordered)))] / 1000
+                for label, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0))}
+
+
+class ThreadSampler(threading.Thread):
+    """
+    Daemon thread recording the highest number of live threads of the process.
+
+    Attributes:
+        peak (int): The highest thread count seen, this thread included.
+    """
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = threading.active_count()
+
+    def run(self):
+        while True:
+            self.peak = max(self.peak, threading.active_count())
+            time.sleep(POLL_INTERVAL)
+
+
+def wait_until(done, progress, timeout, start=None):
+    """
+    Polls until done() holds, progress() stops changing for QUIET_PERIOD seconds or the timeout passes.
+
+    :param float start: perf_counter() value the run started at, now by default.
+    :return: Seconds from start until done() held, None otherwise.
+    """
+    start = time.perf_counter() if start is None else start
+    last_progress, last_change = None, start
+    while True:
+        now = time.perf_counter()
+        if done():
+            return now - start
+        current = progress()
+        if current != last_progress:
+            last_progress, last_change = current, now
+        if now - start >= timeout or now - last_change >= QUIET_PERIOD:
+            return None
+        time.sleep(POLL_INTERVAL)
+
+
+def byzantine_ids(suite, nodes):
+    """
+    Returns the Byzantine ids a suite runs with, one per five nodes and at least one, never the general 0 of auth.
+    """
+    if suite == 'awerbuch':
+        return ()
+    return tuple(range(1, max(1, nodes // 5) + 1))
+
+
+def _bench_threads(nodes, seed, timeout, timer):
+    import ByzantineConsensus
+    from ByzantineConsensus import build_nodes
+    from Termination import TerminationDetector, DECIDED
+    timer.instrument(ByzantineConsensus.BCNode, ['handle_event'])
+    random.seed(seed)
+    ids = byzantine_ids('threads', nodes)
+    ByzantineConsensus.byzantine_count = len(ids)
+    ByzantineConsensus.node_count = nodes
+    bc_nodes = list(build_nodes(nx.complete_graph(nodes), ids).values())
+    detector = TerminationDetector()
+    detector.attach(bc_nodes)
+    start = time.perf_counter()
+    for node in bc_nodes:
+        node.start()
+    reason = detector.wait(timeout)
+    time_to_decision = time.perf_counter() - start if reason == DECIDED else None
+    for node in bc_nodes:
+        node.join()
+    return {'time_to_decision': time_to_decision, 'wall_time': time.perf_counter() - start,
+            'messages': timer.calls['handle_event']}
+
+
+def _bench_consensus(suite, nodes, seed, timeout, timer):
+    import ConveniantByzantineConsensus
+    import ByzantineConsensusTest as driver
+    from SweepRunner import build_graph
+    from TraceSink import get_trace_sink
+    timer.instrument(ConveniantByzantineConsensus.BCNode, ['on_message_from_bottom'])
+    random.seed(seed)
+    ids = byzantine_ids(suite, nodes)
+    ConveniantByzantineConsensus.byzantine_count = len(ids)
+    trace_filename = ConveniantByzantineConsensus.TRACE_FILENAME
+    driver.setup_csv_logger(trace_filename)
+    bc_nodes = driver.setup_experiment(build_graph('complete', nodes, seed), ids,
+                                       {} if suite == 'coalesced' else None)
+    sink = get_trace_sink(trace_filename)
+    start = time.perf_counter()
+    driver._topology.start()
+    time_to_decision = wait_until(lambda: all(node.flag for node in bc_nodes),
+                                  lambda: sink.rows_written, timeout, start)
+    elapsed = time.perf_counter() - start
+    driver.end_experiment(trace_filename)
+    return {'time_to_decision': time_to_decision, 'wall_time': elapsed, 'messages': sink.rows_written}
+
+
+def _bench_auth(nodes, seed, timeout, timer):
+    from SweepRunner import SweepCell, run_cell
+    import ConveniantByzantineAuth
+    timer.instrument(ConveniantByzantineAuth.BANode, ['on_message_from_bottom'])
+    cell = SweepCell('auth', nodes, byzantine_ids('auth', nodes), 0, AUTH_PULSES, 'complete', seed)
+    result = run_cell(cell, timeout)
+    return {'time_to_decision': float(result['time_to_decision']) if result['time_to_decision'] else None,
+            'wall_time': float(result['wall_time']), 'messages': result['messages']}
+
+
+def _bench_instances(nodes, seed, timeout, timer):
+    import ConveniantByzantineConsensus
+    import ByzantineConsensusTest as driver
+    from SweepRunner import build_graph
+    timer.instrument(ConveniantByzantineConsensus.BCNode, ['on_message_from_bottom'])
+    random.seed(seed)
+    ids = byzantine_ids('instances', nodes)
+    ConveniantByzantineConsensus.byzantine_count = len(ids)
+    driver.setup_csv_logger(ConveniantByzantineConsensus.TRACE_FILENAME)
+    bc_nodes = driver.setup_experiment(build_graph('complete', nodes, seed), ids, {}, INSTANCES, INSTANCE_WINDOW)
+    honest = [node for node in bc_nodes if not node.is_byzantine]
+    start = time.perf_counter()
+    driver._topology.start()
+    time_to_decision = wait_until(lambda: all(node.decided_count >= INSTANCES for node in honest),
+                                  lambda: sum(node.decided_count for node in honest), timeout, start)
+    elapsed = time.perf_counter() - start
+    driver.end_experiment(ConveniantByzantineConsensus.TRACE_FILENAME)
+    return {'time_to_decision': time_to_decision, 'wall_time': elapsed,
+            'messages': timer.calls['on_message_from_bottom'],
+            'decisions_per_second': driver.decisions_per_second(bc_nodes, time_to_decision or elapsed)}
+
+
+def _bench_batched(nodes, seed, timeout, timer):
+    import ConveniantByzantineConsensus
+    import ByzantineConsensusTest as driver
+    from Batching import BatchedConsensus
+    from SweepRunner import build_graph
+    timer.instrument(ConveniantByzantineConsensus.BCNode, ['on_message_from_bottom'])
+    random.seed(seed)
+    ids = byzantine_ids('batched', nodes)
+    ConveniantByzantineConsensus.byzantine_count = len(ids)
+    driver.setup_csv_logger(ConveniantByzantineConsensus.TRACE_FILENAME)
+    bc_nodes = driver.setup_experiment(build_graph('complete', nodes, seed), ids, {}, 1, INSTANCE_WINDOW)
+    honest = [node for node in bc_nodes if not node.is_byzantine]
+    delivered = {node.name: 0 for node in bc_nodes}
+
+    def deliver(node, batch):
+        delivered[node.name] += len(batch.values)
+    front_end = BatchedConsensus(bc_nodes, deliver, BATCH_SIZE)
+    start = time.perf_counter()
+    driver._topology.start()
+    for value in range(BATCHED_VALUES):
+        front_end.submit(value)
+    front_end.batcher.flush()
+    batches = front_end.batcher.sequence
+    time_to_decision = wait_until(
+        lambda: all(front_end.deliveries[node.name].next_sequence >= batches for node in honest),
+        lambda: sum(front_end.deliveries[node.name].next_sequence for node in honest), timeout, start)
+    elapsed = time.perf_counter() - start
+    driver.end_experiment(ConveniantByzantineConsensus.TRACE_FILENAME)
+    messages = timer.calls['on_message_from_bottom']
+    return {'time_to_decision': time_to_decision, 'wall_time': elapsed, 'messages': messages,
+            'values_per_second': min(delivered[node.name] for node in honest) / (time_to_decision or elapsed),
+            'messages_per_value': messages / BATCHED_VALUES}
+
+
+def _bench_awerbuch(nodes, seed, timeout, timer):
+    # main.py lives next to the byzantine package
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from adhoccomputing.DistributedAlgorithms.Waves.AwerbuchDFS import WaveAwerbuchComponent
+    from adhoccomputing.Networking.LogicalChannels.GenericChannel import GenericChannel
+    finished = threading.Event()
+    on_return = WaveAwerbuchComponent.on_return
+
+    def on_return_of_initiator(self, eventobj):
+        on_return(self, eventobj)
+        if not self.Unvisited and self.father == self.componentinstancenumber:
+            finished.set()
+    WaveAwerbuchComponent.on_return = on_return_of_initiator
+    timer.instrument(WaveAwerbuchComponent,
+                     ['on_message_from_bottom', 'on_discover', 'on_visited', 'on_return', 'on_ack'])
+    import main as awerbuch
+    rng = random.Random(seed)
+    radius = min(1.0, 2.5 / nodes ** 0.5)
+    while True:
+        graph = nx.random_geometric_graph(nodes, radius, seed=rng.randrange(1 << 30))
+        if nx.is_connected(graph):
+            break
+    random.seed(seed)
+    awerbuch.topo.construct_from_graph(graph, awerbuch.AdHocNode, GenericChannel)
+    start = time.perf_counter()
+    awerbuch.topo.start()
+    time_to_decision = wait_until(finished.is_set, lambda: len(timer.samples), timeout, start)
+    return {'time_to_decision': time_to_decision, 'wall_time': time.perf_counter() - start,
+            'messages': timer.calls['on_message_from_bottom']}
+
+
+def run_case(suite, nodes, seed=0, timeout=120.0):
+    """
+    Runs one benchmark case in the current process.
+
+    The drivers keep their topology in globals, so this must run in a fresh process.
+
+    :param str suite: A suite of :data:`SUITES`.
+    :param int nodes: Number of nodes.
+    :param int seed: Seed of the run.
+    :param float timeout: Seconds to wait for every node to decide.
+    :return: A dict of the measured metrics.
+    """
+    timer = HandlerTimer()
+    sampler = ThreadSampler()
+    sampler.start()
+    if suite == 'threads':
+        result = _bench_threads(nodes, seed, timeout, timer)
+    elif suite in ('consensus', 'coalesced'):
+        result = _bench_consensus(suite, nodes, seed, timeout, timer)
+    elif suite == 'auth':
+        result = _bench_auth(nodes, seed, timeout, timer)
+    elif suite == 'instances':
+        result = _bench_instances(nodes, seed, timeout, timer)
+    elif suite == 'batched':
+        result = _bench_batched(nodes, seed, timeout, timer)
+    elif suite == 'awerbuch':
+        result = _bench_awerbuch(nodes, seed, timeout, timer)
+    else:
+        raise ValueError(f"Unknown suite {suite}, expected one of {SUITES}")
+    elapsed = result['time_to_decision'] or result['wall_time']
+    result.update(timer.percentiles())
+    result.update({
+        'status': 'ok' if result['time_to_decision'] is not None else 'undecided',
+        'handler_calls': len(timer.samples),
+        'messages_per_second': result['messages'] / elapsed if elapsed else None,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'threads': sampler.peak,
+    })
+    return result
+
+
+def _case_worker(suite, nodes, seed, timeout, directory, connection):
+    os.chdir(directory)
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        result = run_case(suite, nodes, seed, timeout)
+    except Exception:
+        result = {'status': 'error', 'error': traceback.format_exc(limit=3).strip().splitlines()[-1]}
+    connection.send(result)
+    connection.close()
+    from TraceSink import close_trace_sinks
+    close_trace_sinks()
+    os._exit(0)
+
+
+def run_isolated(suite, nodes, seed=0, timeout=120.0):
+    """
+    Runs one case in a spawned process, killing it if it does not report within timeout + KILL_GRACE seconds.
+
+    :return: The dict of :func:`run_case`, with status "timeout" or "error" if the case failed.
+    """
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory(prefix='benchmark-') as directory:
+        receiver, sender = context.Pipe(duplex=False)
+        worker = context.Process(target=_case_worker, args=(suite, nodes, seed, timeout, directory, sender),
+                                 daemon=True)
+        worker.start()
+        sender.close()
+        result = {'status': 'timeout'}
+        if receiver.poll(timeout + KILL_GRACE):
+            try:
+                result = receiver.recv()
+            except EOFError:
+                result = {'status': 'error', 'error': f"worker exited with code {worker.exitcode}"}
+        worker.kill()
+        worker.join()
+        receiver.close()
+    return result
+
+
+def _median(values):
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def case_key(suite, nodes):
+    return f"{suite}:n{nodes}"
+
+
+def run_benchmarks(suites=SUITES, sizes=None, repeat=3, timeout=120.0):
+    """
+    Runs every suite at growing node counts, one process per run and one run at a time.
+
+    :param suites: Suites of :data:`SUITES`.
+    :param sizes: Node counts used for every suite, DEFAULT_SIZES by default.
+    :param int repeat: Runs per case with the seeds 0 to repeat - 1, the report keeps the median of every metric.
+    :param float timeout: Seconds each run may take to decide.
+    :return: The report, a dict with the keys "meta", "cases" and "runs".
+    """
+    runs = []
+    cases = {}
+    for suite in suites:
+        for nodes in (sizes or DEFAULT_SIZES[suite]):
+            case_runs = []
+            for seed in range(repeat):
+                result = run_isolated(suite, nodes, seed, timeout)
+                result.update({'suite': suite, 'nodes': nodes, 'seed': seed})
+                case_runs.append(result)
+                print(f"{case_key(suite, nodes)} seed {seed}: {result['status']}")
+            runs.extend(case_runs)
+            finished = [run for run in case_runs if run['status'] in ('ok', 'undecided')]
+            case = {'suite': suite, 'nodes': nodes, 'byzantine': len(byzantine_ids(suite, nodes)),
+                    'runs': len(case_runs), 'ok': sum(1 for run in case_runs if run['status'] == 'ok')}
+            for metric in ('time_to_decision', 'wall_time', 'messages', 'messages_per_second', 'decisions_per_second',
+                           'values_per_second', 'messages_per_value', 'handler_p50_us',
+                           'handler_p90_us', 'handler_p99_us', 'handler_max_us', 'peak_rss_kb', 'threads'):
+                case[metric] = _median(run.get(metric) for run in finished)
+            cases[case_key(suite, nodes)] = case
+    meta = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'repeat': repeat,
+    }
+    return {'meta': meta, 'cases': cases, 'runs': runs}
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compares the cases of a report with those of a baseline report.
+
+    :param dict report: The current report of :func:`run_benchmarks`.
+    :param dict baseline: The baseline report.
+    :param float tolerance: Relative change beyond which a worse metric counts as a regression.
+    :return: A list of (case, metric, baseline value, current value, relative change, regressed) tuples.
+    """
+    rows = []
+    for key, case in report['cases'].items():
+        base = baseline['cases'].get(key)
+        if base is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = base.get(metric), case.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            rows.append((key, metric, old, new, change, worse > tolerance))
+    return rows
+
+
+def print_comparison(rows):
+    print(f"{'case':<16}{'metric':<22}{'baseline':>14}{'current':>14}{'change':>10}")
+    for key, metric, old, new, change, regressed in rows:
+        print(f"{key:<16}{metric:<22}{old:>14.2f}{new:>14.2f}{change:>+10.1%}{'  REGRESSION' if regressed else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the consensus, auth and Awerbuch stacks.")
+    parser.add_argument('-s', '--suite', nargs='+', choices=SUITES, default=list(SUITES))
+    parser.add_argument('-n', '--nodes', type=int, nargs='+', default=None,
+                        help="node counts of every suite, defaults to the suite's own sizes")
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('-o', '--output', default='benchmark.json')
+    parser.add_argument('--baseline', default=None, help="report to compare the results with")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.suite, args.nodes, args.repeat, args.timeout)
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results in {args.output}")
+    if args.baseline:
+        with open(args.baseline) as file:
+            rows = compare(report, json.load(file), args.tolerance)
+        print_comparison(rows)
+        if args.fail_on_regression and any(row[-1] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import argparse
+import csv
+import gzip
+import lzma
+import re
+import struct
+from collections import namedtuple
+
+# File magic followed by the format version
+MAGIC = b'BZT2'
+# kind, value, source, delivered, pulse, number of signers, consensus instance
+RECORD_HEADER = struct.Struct('<BbIIHHI')
+SIGNER = struct.Struct('<I')
+NO_NODE = 0xFFFFFFFF
+NO_VALUE = -1
+
+MESSAGE_TYPE_CODES = {
+    'VOTE': 1,
+    'ECHO': 2,
+    'DECIDE': 3,
+    'INIT': 4,
+    'AUTH': 5,
+}
+MESSAGE_TYPE_NAMES = {code: name for name, code in MESSAGE_TYPE_CODES.items()}
+
+VALUE_CODES = {
+    'REJECT': 0,
+    'ACCEPT': 1,
+}
+VALUE_NAMES = {code: name for name, code in VALUE_CODES.items()}
+
+COMPRESSIONS = {
+    None: open,
+    'gzip': gzip.open,
+    'lzma': lzma.open,
+}
+
+_READ_BLOCK = 1 << 16
+_EVENT_PATTERN = re.compile(r"Event Type: (?:\w+\.)?(\w+) \| Vote: (\w+)(?: \| Instance: (\d+))?")
+
+TraceRecord = namedtuple('TraceRecord', ['message_type', 'source', 'delivered', 'value', 'pulse', 'signers',
+                                         'instance'])
+TraceRecord.__doc__ = """
+One decoded trace record, message_type and value are the integer codes of the binary format.
+"""
+
+
+def message_type_code(message_type):
+    """
+    Returns the integer code of a message type.
+
+    :param message_type: An EventType/ApplicationLayerMessageTypes member or its name.
+    :return: The integer code.
+    """
+    name = getattr(message_type, 'value', message_type)
+    return MESSAGE_TYPE_CODES[name]
+
+
+def value_code(value):
+    """
+    Returns the integer code of a vote (0/1) or an authenticated value ("ACCEPT"/"REJECT").
+
+    :param value: The value to encode, None or unknown values are encoded as NO_VALUE.
+    :return: The integer code.
+    """
+    if value is None:
+        return NO_VALUE
+    if isinstance(value, int):
+        return value
+    if value in VALUE_CODES:
+        return VALUE_CODES[value]
+    if value.isdigit():
+        return int(value)
+    return NO_VALUE
+
+
+def _node_id(node):
+    if node is None or node == 'Unknown' or node == '':
+        return NO_NODE
+    return int(node)
+
+
+def _open(filename, mode, compression=None):
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression}, expected one of {list(COMPRESSIONS)}")
+    return COMPRESSIONS[compression](filename, mode)
+
+
+def _detect_compression(filename):
+    with open(filename, 'rb') as file:
+        head = file.read(6)
+    if head.startswith(b'\x1f\x8b'):
+        return 'gzip'
+    if head.startswith(b'\xfd7zXZ\x00'):
+        return 'lzma'
+    return None
+
+
+class BinaryTraceWriter:
+    """
+    Writes message traces as binary records.
+
+    Every record is a fixed 18 byte header (message type, value, source node, delivered node, pulse, number of
+    signers and consensus instance) followed by one 4 byte node id per signer of the signature chain.
+
+    :param str filename: The output file.
+    :param str compression: None, "gzip" or "lzma".
+
+    Attributes:
+        records (int): Number of records written.
+    """
+    def __init__(self, filename, compression=None):
+        self.filename = filename
+        self.compression = compression
+        self.records = 0
+        self._file = _open(filename, 'wb', compression)
+        self._file.write(MAGIC)
+
+    def write(self, message_type, source, delivered, value=None, pulse=0, signers=(), instance=0):
+        """
+        Appends one record.
+
+        :param message_type: The message type, see :func:`message_type_code`.
+        :param int source: Id of the node that sent the message.
+        :param int delivered: Id of the node the message was delivered to.
+        :param value: The vote or authenticated value, see :func:`value_code`.
+        :param int pulse: The pulse of the message.
+        :param list signers: Ids of the nodes in the signature chain.
+        :param int instance: The consensus instance of the message.
+        """
+        signers = list(signers)
+        self._file.write(RECORD_HEADER.pack(message_type_code(message_type), value_code(value), _node_id(source),
+                                            _node_id(delivered), pulse, len(signers), instance))
+        if signers:
+            self._file.write(struct.pack(f'<{len(signers)}I', *signers))
+        self.records += 1
+
+    def close(self):
+        """
+        Closes the underlying file.
+        """
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_binary_trace(filename, compression='auto'):
+    """
+    Streams the records of a binary trace without loading the whole file.
+
+    :param str filename: The binary trace file.
+    :param str compression: None, "gzip", "lzma" or "auto" to detect it from the file.
+    :return: A generator of :class:`TraceRecord`.
+    """
+    if compression == 'auto':
+        compression = _detect_compression(filename)
+    header_size = RECORD_HEADER.size
+    unpack_header = RECORD_HEADER.unpack_from
+    with _open(filename, 'rb', compression) as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{filename} is not a binary trace")
+        buffer = b''
+        offset = 0
+        while True:
+            block = file.read(_READ_BLOCK)
+            if not block:
+                break
+            buffer = buffer[offset:] + block
+            offset = 0
+            end = len(buffer)
+            while offset + header_size <= end:
+                kind, value, source, delivered, pulse, count, instance = unpack_header(buffer, offset)
+                record_end = offset + header_size + count * SIGNER.size
+                if record_end > end:
+                    break
+                signers = struct.unpack_from(f'<{count}I', buffer, offset + header_size) if count else ()
+                yield TraceRecord(kind, source, delivered, value, pulse, signers, instance)
+                offset = record_end
+        if offset != len(buffer):
+            raise ValueError(f"{filename} ends with a truncated record")
+
+
+def parse_event_message(message):
+    """
+    Parses the Message column of a consensus CSV trace, e.g. "Event Type: ApplicationLayerMessageTypes.VOTE | Vote: 0"
+    or "Event Type: ApplicationLayerMessageTypes.VOTE | Vote: 0 | Instance: 3".
+
+    :param str message: The Message column.
+    :return: The message type name, the vote string and the instance id, 0 if the message names none, or None if
+        message is not in that form.
+    """
+    match = _EVENT_PATTERN.search(message)
+    if match is None:
+        return None
+    event_type, vote, instance = match.groups()
+    return event_type, vote, int(instance) if instance is not None else 0
+
+
+def _parse_signers(text):
+    text = text.strip().strip('[]')
+    if not text:
+        return []
+    return [int(part) for part in text.split(',')]
+
+
+def convert_csv_trace(input_filename, output_filename, compression=None):
+    """
+    Converts a CSV trace written by ConveniantByzantineConsensus or ConveniantByzantineAuth to the binary format.
+
+    :param str input_filename: The CSV trace, its header row selects the layout.
+    :param str output_filename: The binary trace to write.
+    :param str compression: None, "gzip" or "lzma".
+    :return: The number of converted records.
+    """
+    with open(input_filename, newline='') as file, BinaryTraceWriter(output_filename, compression) as writer:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if header is None:
+            return 0
+        columns = {name: index for index, name in enumerate(header)}
+        if 'Signature_chain' in columns:
+            source, message, chain = columns['Source Node'], columns['Message'], columns['Signature_chain']
+            delivered, pulse = columns['Delivered Node'], columns['Pulse']
+            for row in reader:
+                writer.write('AUTH', row[source], row[delivered], row[message], int(row[pulse]),
+                             _parse_signers(row[chain]))
+        else:
+            source, message, delivered = columns['Source Node'], columns['Message'], columns['Delivered Node']
+            for row in reader:
+                parsed = parse_event_message(row[message])
+                if parsed is None:
+                    raise ValueError(f"Cannot parse message {row[message]!r}")
+                event_type, vote, instance = parsed
+                writer.write(event_type, row[source], row[delivered], None if vote == 'None' else vote,
+                             instance=instance)
+        return writer.records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert and inspect binary Byzantine message traces.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert = commands.add_parser('convert', help="convert a CSV trace to the binary format")
+    convert.add_argument('input')
+    convert.add_argument('output')
+    convert.add_argument('--compression', choices=['gzip', 'lzma'], default=None)
+    dump = commands.add_parser('dump', help="print the records of a binary trace")
+    dump.add_argument('input')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        count = convert_csv_trace(args.input, args.output, args.compression)
+        print(f"Converted {count} records to {args.output}")
+    else:
+        for record in read_binary_trace(args.input):
+            value = VALUE_NAMES.get(record.value, record.value) if record.message_type == MESSAGE_TYPE_CODES['AUTH'] \
+                else record.value
+            instance = f" instance={record.instance}" if record.instance else ''
+            print(f"{MESSAGE_TYPE_NAMES[record.message_type]} {record.source} -> {record.delivered} "
+                  f"value={value} pulse={record.pulse} signers={list(record.signers)}{instance}")
+
+
+if __name__ == "__main__":
+    main()
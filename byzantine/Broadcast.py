@@ -0,0 +1,59 @@
+class Envelope:
+    """
+    Per-destination wrapper of a payload that all destinations of a broadcast share.
+
+    Takes the place of the GenericMessageHeader and GenericMessage pair the AHC nodes built for every destination.
+    The envelope is its own header, so the network layer routes it by messageto and the receiver reads
+    header.messagetype and payload as before.
+
+    :param messagetype: The message type.
+    :param messagefrom: Id of the sender.
+    :param messageto: Id of the destination.
+    :param payload: The shared payload, which no receiver may modify.
+    """
+    __slots__ = ('messagetype', 'messagefrom', 'messageto', 'payload')
+
+    def __init__(self, messagetype, messagefrom, messageto, payload):
+        self.messagetype = messagetype
+        self.messagefrom = messagefrom
+        self.messageto = messageto
+        self.payload = payload
+
+    @property
+    def header(self):
+        return self
+
+    def __repr__(self):
+        return f"Envelope({self.messagetype}, {self.messagefrom} -> {self.messageto})"
+
+
+def multicast(destinations, payload, deliver):
+    """
+    Delivers one payload to every destination. All of them receive the same object.
+
+    :param destinations: The destinations.
+    :param payload: The payload, which no receiver may modify.
+    :param deliver: Callable taking a destination and the payload.
+    :return: The number of deliveries.
+    """
+    count = 0
+    for destination in destinations:
+        deliver(destination, payload)
+        count += 1
+    return count
+
+
+def equivocate(destinations, payload_for, deliver):
+    """
+    Delivers a separate payload to every destination, for Byzantine senders telling each node something else.
+
+    :param destinations: The destinations.
+    :param payload_for: Callable taking a destination and returning its payload.
+    :param deliver: Callable taking a destination and the payload.
+    :return: The number of deliveries.
+    """
+    count = 0
+    for destination in destinations:
+        deliver(destination, payload_for(destination))
+        count += 1
+    return count
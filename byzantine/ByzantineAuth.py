@@ -1,26 +1,41 @@
 import threading
-import time
-from Crypto.PublicKey import RSA
-from Crypto.Signature import pkcs1_15
-from Crypto.Hash import SHA256
+from CryptoCache import CryptoCache
+from SignatureSchemes import get_scheme
+from NodeMetrics import node_metrics, time_handlers
+from Profiling import profile_dispatch
+from SignatureChain import LINKED, LinkedSignatureChain, ChainVerifier, default_chain_format
+from Termination import TerminationDetector
 from collections import defaultdict, Counter
+from queue import Queue
 import random
 
 global_lock = threading.Lock()
 global_node_count = 0
 num_nodes = 0
+# Sentinel put in a node's inbox to stop its thread
+_STOP = object()
 
 class BANode(threading.Thread):
     """
     Represents a node in a Byzantine fault-tolerant network simulation.
 
+    Messages sent to the node are queued in its inbox and handled one by one on the node's own thread.
+
     :param int node_id: Unique identifier for the node.
     :param list nodes: List of all nodes in the network.
     :param int k: Maximum number of communication pulses.
     :param bool is_general: True if the node is the general, otherwise False.
     :param bool is_byzantine: True if the node exhibits Byzantine behavior.
+    :param SignatureScheme signature_scheme: Scheme used to sign and verify messages, defaults to get_scheme().
+    :param str chain_format: "flat" lists of (node_id, signature) or hash-linked "linked" chains, defaults to BYZANTINE_CHAIN_FORMAT.
+
+    Attributes:
+        inbox (Queue): (message, pulse, is_init) items delivered to the node and not handled yet.
+        start_barrier (threading.Barrier): Barrier all node threads pass before the general broadcasts, set by setup_network (optional).
+        detector (TerminationDetector): Detector the node reports its messages to, set by its attach() (optional).
+        metrics (NodeMetrics): Message counters, handler times and signature operations of the node, None unless metrics are enabled.
     """
-    def __init__(self, node_id, nodes, k, is_general=False, is_byzantine= False):
+    def __init__(self, node_id, nodes, k, is_general=False, is_byzantine= False, signature_scheme=None, chain_format=None):
         threading.Thread.__init__(self)
         self.node_id = node_id
         self.nodes = nodes
@@ -28,39 +43,72 @@ class BANode(threading.Thread):
         self.is_general = is_general
         self.is_byzantine = is_byzantine
         self.values_q = defaultdict(list)
-        self.key = RSA.generate(2048)
+        self.scheme = signature_scheme if signature_scheme is not None else get_scheme()
+        self.key = self.scheme.generate_key(node_id)
+        self.public_key = self.scheme.public_key(self.key)
+        self.crypto = CryptoCache(self.scheme, self.key, lambda node_id: self.nodes[node_id].public_key)
+        self.chain_format = chain_format or default_chain_format()
+        self.chain_verifier = ChainVerifier(self.crypto)
         self.received_signatures = defaultdict(set)
         self.final_decision = None  # Attribute to store the final decision
+        self.metrics = node_metrics(node_id)
+        if self.metrics is not None:
+            self.metrics.crypto = self.crypto
+        time_handlers(self, ('receive_message',))
+        profile_dispatch(self, node_id, 'receive_message', lambda message, pulse, is_init=False: "INIT" if is_init else "AUTH")
         self.stop_event = threading.Event()
+        self.inbox = Queue()
+        self.start_barrier = None
+        self.detector = None
 
 
 
     def run(self):
         """
         Entry point for thread execution.
-        Initializes the broadcast if the node is the general.
+        Waits until every node thread runs, initializes the broadcast if the node is the general, then handles the
+        messages of the inbox until the node is stopped.
         """
 
+        if self.metrics is not None:
+            self.metrics.mark_started()
+        if self.start_barrier is not None:
+            self.start_barrier.wait()
         if self.is_general:
-            time.sleep(1)  
-            if self.is_byzantine:
-                self.broadcast_initial_value(random.choice(["ACCEPT","REJECT"]), 0)
-            else:
-                self.broadcast_initial_value("ACCEPT", 0)
-        while not self.stop_event.is_set():
-            time.sleep(0.1)  
+            self.start_agreement()
+        detector = self.detector
+        if detector is not None:
+            detector.message_processed()
+        while True:
+            item = self.inbox.get()
+            if item is _STOP:
+                break
+            if self.metrics is not None:
+                self.metrics.observe_queue(self.inbox.qsize() + 1)
+            try:
+                self.handle_delivery(item)
+            finally:
+                if detector is not None:
+                    detector.message_processed()
         
 
+    def start_agreement(self):
+        """
+        Broadcasts the general's initial value, a random one if the general is Byzantine.
+        """
+        if self.is_byzantine:
+            self.broadcast_initial_value(random.choice(["ACCEPT","REJECT"]), 0)
+        else:
+            self.broadcast_initial_value("ACCEPT", 0)
+
     def sign(self, data):
         """
-        Signs data using the node's private RSA key.
+        Signs data using the node's private key.
 
-        :param str data: The data to sign.
+        :param data: The data to sign, a value string or a chain digest.
         :return: The digital signature.
         """
-        hasher = SHA256.new(data.encode('utf-8'))
-        signature = pkcs1_15.new(self.key).sign(hasher)
-        return signature
+        return self.crypto.sign(data)
 
     def verify_signature(self, data, signature, public_key):
         """
@@ -71,12 +119,21 @@ class BANode(threading.Thread):
         :param public_key: The public key to use for verification.
         :return: True if the signature is valid, False otherwise.
         """
-        hasher = SHA256.new(data.encode('utf-8'))
-        try:
-            pkcs1_15.new(public_key).verify(hasher, signature)
-            return True
-        except ValueError:
-            return False
+        return self.scheme.verify(public_key, data.encode('utf-8'), signature)
+
+    def extend_chain(self, value, signature_chain=None):
+        """
+        Returns a signature chain extended with this node's signature.
+
+        :param str value: The value being relayed.
+        :param signature_chain: The received chain, None to start a new one.
+        :return: The extended chain, in the node's chain format.
+        """
+        if self.chain_format == LINKED:
+            if signature_chain is None:
+                signature_chain = LinkedSignatureChain(value)
+            return signature_chain.extend(self.node_id, self.sign(signature_chain.digest))
+        return (signature_chain or []) + [(self.node_id, self.sign(value))]
 
     def broadcast_initial_value(self, value, pulse):
         """
@@ -85,7 +142,7 @@ class BANode(threading.Thread):
         :param str value: The value to broadcast.
         :param int pulse: The pulse number for this broadcast.
         """
-        message = (value, [(self.node_id, self.sign(value))])
+        message = (value, self.extend_chain(value))
         self.broadcast_message(message, pulse , True)
 
     def broadcast_message(self, message, pulse, is_init = False):
@@ -96,12 +153,33 @@ class BANode(threading.Thread):
         :param int pulse: The current pulse number.
         """ 
         global global_node_count
+        if self.detector is not None:
+            self.detector.message_sent(len(self.nodes) - 1)
         for node in self.nodes:
             if node.node_id != self.node_id:
-                node.receive_message(message, pulse, is_init)
+                node.deliver(message, pulse, is_init)
                 global_node_count += 1
+        if self.metrics is not None:
+            self.metrics.count_sent("INIT" if is_init else "AUTH", len(self.nodes) - 1)
                     
             #print("\n")
+
+    def deliver(self, message, pulse, is_init = False):
+        """
+        Queues a message sent by another node in this node's inbox.
+
+        :param tuple message: The message.
+        :param int pulse: The pulse number when the message was sent.
+        """
+        self.inbox.put((message, pulse, is_init))
+
+    def handle_delivery(self, item):
+        """
+        Handles a (message, pulse, is_init) item of the inbox.
+        """
+        message, pulse, is_init = item
+        self.receive_message(message, pulse, is_init)
+
     def receive_message(self, message, pulse, is_init = False):
         """
         Receives a message from another node.
@@ -110,6 +188,8 @@ class BANode(threading.Thread):
         :param int pulse: The pulse number when the message was sent.
         """
         value, signature_chain = message
+        if self.metrics is not None:
+            self.metrics.count_received("INIT" if is_init else "AUTH")
         if self.validate_message(value, signature_chain) and pulse <= self.k:
             # Store the value if valid
             received_value = value if not self.is_byzantine else random.choice(["ACCEPT","REJECT"])
@@ -118,13 +198,13 @@ class BANode(threading.Thread):
                 # Propagate the message to the next pulse with added signature
 
                 next_pulse = pulse + 1
-                new_signature_chain = signature_chain + [(self.node_id, self.sign(received_value))]
+                new_signature_chain = self.extend_chain(received_value, signature_chain)
                 new_message = (received_value, new_signature_chain)
                 self.broadcast_message(new_message,next_pulse)
             elif pulse == (self.k ):
 
+                # Every further message of the last pulse can still change the decision
                 self.decide()
-                self.stop_event.set()  # Signal the run loop to stop
 
 
     def validate_message(self, value, signature_chain):
@@ -136,12 +216,14 @@ class BANode(threading.Thread):
         :return: True if the message is valid, False otherwise.
         """
         # Check all signatures are valid and from distinct nodes
+        if self.chain_format == LINKED:
+            return self.chain_verifier.validate(value, signature_chain)
 
         seen_nodes = set()
         for node_id, signature in signature_chain:
             if node_id in seen_nodes:
                 return False  # Prevents the same node from signing multiple times in a single chain
-            if not self.verify_signature(value, signature, self.nodes[node_id].key.publickey()):
+            if not self.crypto.verify(node_id, value, signature):
                 return False  # Verification failed
             seen_nodes.add(node_id)
         return True  # All signatures are valid and from distinct nodes
@@ -169,37 +251,62 @@ class BANode(threading.Thread):
             else:
                 temp_final_decision = decision if not self.is_byzantine else random.choice(["ACCEPT", "REJECT"])
             self.final_decision = temp_final_decision
+            if self.metrics is not None:
+                self.metrics.mark_decided()
+            if self.detector is not None:
+                self.detector.node_decided(self)
 
 
     def stop(self):
         """
-        Stops the node's thread.
+        Stops the node's thread once it reaches this request in its inbox.
         """
         self.stop_event.set()
+        self.inbox.put(_STOP)
 
-def setup_network(num_nodes, k, byzantine_nodes):
+def setup_network(num_nodes, k, byzantine_nodes, signature_scheme=None, chain_format=None, node_class=None):
+    start_barrier = threading.Barrier(num_nodes)
     nodes = []
     for i in range(num_nodes):
         is_general = (i == 0)
         is_byzantine = (i in byzantine_nodes)
-        node = BANode(i, [], k, is_general, is_byzantine)
+        node = (node_class or BANode)(i, [], k, is_general, is_byzantine, signature_scheme, chain_format)
+        node.start_barrier = start_barrier
         nodes.append(node)
     for node in nodes:
         node.nodes = nodes  # Ensuring each node knows about all other nodes
     return nodes
 
+def run_network(nodes, timeout=None):
+    """
+    Starts the node threads and stops them once no message is in flight.
+
+    Decisions change with every message of the last pulse, so the run ends at quiescence rather than at the first
+    decisions.
+
+    :param list nodes: The nodes of setup_network.
+    :param float timeout: Seconds after which the nodes are stopped anyway (optional).
+    :return: The reason the run ended, see Termination.
+    """
+    detector = TerminationDetector(stop_when_decided=False)
+    detector.attach(nodes, [node for node in nodes if not node.is_byzantine and not node.is_general])
+    for node in nodes:
+        node.start()
+    reason = detector.wait(timeout)
+    if reason is None:
+        detector.terminate()
+        reason = detector.reason
+    for node in nodes:
+        node.join()
+    return reason
+
 def main():
     global num_nodes
     num_nodes = 4
     k = 1  # Number of pulses
     byzantine_nodes = {1}
     network = setup_network(num_nodes, k, byzantine_nodes)
-
-    for node in network:
-        node.start()
-
-    for node in network:
-        node.join()
+    run_network(network)
     
     for node in network:
         print(f"Node {node.node_id} final decision: {node.final_decision}")
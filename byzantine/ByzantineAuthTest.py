@@ -1,5 +1,6 @@
 import matplotlib.pyplot as plt
 import networkx as nx
+import time
 from adhoccomputing.GenericModel import GenericModel
 from adhoccomputing.Generics import Event, EventTypes, ConnectorTypes
 from adhoccomputing.Experimentation.Topology import Topology
@@ -7,7 +8,9 @@ from adhoccomputing.Networking.LinkLayer.GenericLinkLayer import GenericLinkLaye
 from adhoccomputing.Networking.NetworkLayer.GenericNetworkLayer import GenericNetworkLayer
 from adhoccomputing.Networking.LogicalChannels.GenericChannel import GenericChannel
 import csv
+from TraceSink import get_trace_sink, close_trace_sink
 from ConveniantByzantineAuth import BANode
+from BatchVerifier import attach_batch_verifier
 
 _topology = Topology()
 global_nodes = []
@@ -15,11 +18,17 @@ global_byzantine_count = 0
 is_general = False
 is_byzantine = False
 global_bc_nodes = []
+# Seconds the nodes get to handle their EXIT event at the end of a run
+EXIT_TIMEOUT = 5.0
+# Seconds main waits for every node to decide
+MAIN_TIMEOUT = 60.0
 
-def setup_csv_logger(filename='ByzantineAuth.csv'):
+def setup_csv_logger(filename='ByzantineAuth.csv', flush_size=None, flush_interval=None):
+    close_trace_sink(filename)
     with open(filename, mode='w', newline='') as file:
         writer = csv.writer(file)
         writer.writerow(['Source Node', 'Message', 'Signature_chain','Delivered Node', 'Pulse'])
+    get_trace_sink(filename, flush_size, flush_interval)
 
 class AdHocNode(GenericModel):
 
@@ -59,6 +68,51 @@ class AdHocNode(GenericModel):
         self.connect_me_to_component(ConnectorTypes.UP, self.linklayer)
 
 
+def setup_experiment(G, byzantine_ids, general_id, k, batch_verification=None):
+    """
+    Builds the topology of a graph with one BANode per node and assigns the general and the Byzantine nodes.
+
+    :param nx.Graph G: The topology.
+    :param byzantine_ids: Ids of the Byzantine nodes.
+    :param int general_id: Id of the general.
+    :param int k: Number of pulses.
+    :param bool batch_verification: Whether the nodes verify incoming messages in batches, BYZANTINE_BATCH_VERIFY if
+        None.
+    :return: The list of BANodes.
+    """
+    global global_byzantine_count
+    _topology.construct_from_graph(G, AdHocNode, GenericChannel)
+    global_nodes = _topology.nodes
+
+    for i in range(len(global_nodes)):
+        for component in global_nodes[i].components:
+            if isinstance(component,BANode):
+                global_bc_nodes.append(component)
+
+    global_byzantine_count = k
+    for component in global_bc_nodes:
+        component.nodes = global_bc_nodes
+        component.k = global_byzantine_count
+        component.is_byzantine = component.componentinstancenumber in byzantine_ids
+        component.is_general = component.componentinstancenumber == general_id
+        if batch_verification is not None:
+            component.batch_verification = batch_verification
+    attach_batch_verifier(global_bc_nodes)
+    return global_bc_nodes
+
+def end_experiment(filename='ByzantineAuth.csv', timeout=EXIT_TIMEOUT):
+    """
+    Stops the nodes of the run and writes the rest of its trace to the file.
+
+    :param str filename: The trace file of the run.
+    :param float timeout: Seconds the nodes get to handle their EXIT event.
+    """
+    _topology.exit()
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline and not all(node.terminated for node in global_bc_nodes):
+        time.sleep(0.01)
+    close_trace_sink(filename)
+
 def main():
 
     n = 10
@@ -78,43 +132,13 @@ def main():
     labels = nx.get_edge_attributes(G, 'weight')
     nx.draw_networkx_edge_labels(G, pos, edge_labels=labels, **options)
 
-    _topology.construct_from_graph(G, AdHocNode, GenericChannel)
-
-
-    global_nodes = _topology.nodes
-
-
-    for i in range(len(global_nodes)):
-        for component in global_nodes[i].components:
-            if isinstance(component,BANode):
-                global_bc_nodes.append(component)
-
-    global_byzantine_count = 3
-    for i in range(len(global_nodes)):
-        for component in _topology.nodes[i].components:
-            if isinstance(component,BANode):
-                component.nodes = global_bc_nodes
-                component.k = global_byzantine_count
-  
-
-    for component in _topology.nodes[1].components:
-        if isinstance(component,BANode):
-            component.is_byzantine = True
-    for component in _topology.nodes[0].components:
-        if isinstance(component,BANode):
-            component.is_byzantine = True
-    for component in _topology.nodes[2].components:
-        if isinstance(component,BANode):
-            component.is_byzantine = True
-    # for component in _topology.nodes[3].components:
-    #     if isinstance(component,BANode):
-    #         component.is_byzantine = True
-    for component in _topology.nodes[4].components:
-        if isinstance(component,BANode):
-            component.is_general = True
-
+    nodes = [node for node in setup_experiment(G, [0, 1, 2], 4, 3) if not node.is_general]
     _topology.start()
     plt.savefig("graph.png")
+    deadline = time.perf_counter() + MAIN_TIMEOUT
+    while time.perf_counter() < deadline and not all(node.is_decided for node in nodes):
+        time.sleep(0.01)
+    end_experiment()
 
 
 if __name__ == "__main__":
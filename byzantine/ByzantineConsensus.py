@@ -7,6 +7,13 @@ from threading import Lock
 import networkx as nx
 import matplotlib.pyplot as plt
 import sys
+import time
+from NodeMetrics import node_metrics, time_handlers
+from Profiling import profile_dispatch
+from Termination import TerminationDetector
+from Broadcast import multicast, equivocate
+from Messages import ConsensusMessage, VOTE, ECHO, DECIDE, INIT, MESSAGE_TYPE_CODES
+from Tally import SenderTally
 
 
 global_lock = Lock()
@@ -14,6 +21,10 @@ global_lock = Lock()
 byzantine_count = 0
 node_count = 0
 global_inited_count = 0
+# Seconds a node without a TerminationDetector waits for a message before it stops
+IDLE_TIMEOUT = 3
+# Sentinel put in a node's queue to stop its thread
+_STOP = object()
 
 
 class EventType(Enum):
@@ -33,19 +44,22 @@ class State(Enum):
     DECIDED = "DECIDED"
 
 # Base event data structure
-class Event:
+class Event(ConsensusMessage):
     """
     Represents an event in the Byzantine consensus process.
 
     :param EventType event_type: The type of the event.
-    :param source: The node that originated the event.
+    :param source: The name of the node that originated the event.
     :param int vote: The vote associated with the event, if applicable.
     """
+    __slots__ = ()
+
     def __init__(self, event_type, source, vote=None):
-        self.event_type = event_type
-        self.source = source
-        self.vote = vote
-        #self.echo_votes = []
+        ConsensusMessage.__init__(self, MESSAGE_TYPE_CODES[event_type.value], source, vote)
+
+    @property
+    def event_type(self):
+        return EventType(self.message_type)
 
 # ByzantineConsensusNode
 class BCNode(Thread):
@@ -55,17 +69,25 @@ class BCNode(Thread):
 
     :param name: The name of the node.
     :param is_byzantine: A flag to indicate if the node is Byzantine (i.e., it can perform malicious actions).
+    :param rng: Source of the node's random choices, the random module by default. Pass a seeded random.Random for reproducible runs.
+
+    Attributes:
+        echo_tally (SenderTally): Senders of the received echoes per vote, each counted once per vote.
+        metrics (NodeMetrics): Message counters and handler times of the node, None unless metrics are enabled.
+        detector (TerminationDetector): Detector the node reports its messages and decision to, set by its attach().
+            Without one the node stops after IDLE_TIMEOUT seconds without messages.
     """
-    def __init__(self, name, nodes, is_byzantine=False):
+    def __init__(self, name, nodes, is_byzantine=False, rng=None):
         Thread.__init__(self)
         self.name = name
         self.queue = Queue()
         self.is_byzantine = is_byzantine
+        self.rng = rng if rng is not None else random
         self.state = State.UNDECIDED
         ### randomized voting procedure
-        self.vote = random.choice([0, 1])
+        self.vote = self.rng.choice([0, 1])
         self.nodes = nodes
-        self.echo_counts = {0: 0, 1: 0}
+        self.echo_tally = SenderTally()
         self.event_handlers = {
             ####
             EventType.VOTE: self.on_vote,
@@ -75,23 +97,45 @@ class BCNode(Thread):
             ####
         }
         self.decided_value = None
+        self.detector = None
+        self.metrics = node_metrics(name)
+        time_handlers(self, ('on_vote', 'on_echo', 'on_decide'))
+        profile_dispatch(self, name, 'handle_event', lambda event: event.message_type)
 
 
     
     def run(self):
         """
-        Main execution loop of the node, processing incoming events until timeout.
+        Main execution loop of the node, processing incoming events until its detector stops it or, without a
+        detector, until timeout.
         """
         #with global_lock:
         self.send_init()
+        detector = self.detector
+        if detector is not None:
+            detector.message_processed()
         while True:
             try:
-                event = self.queue.get(timeout=3)  # Timeout for simulation
-                self.handle_event(event)
+                event = self.queue.get(timeout=None if detector is not None else IDLE_TIMEOUT)
             except Empty:
                 if self.state == State.UNDECIDED:
                     print(f"{self.name} timed out without deciding.")
                 break
+            if event is _STOP:
+                break
+            if self.metrics is not None:
+                self.metrics.observe_queue(self.queue.qsize() + 1)
+            try:
+                self.handle_event(event)
+            finally:
+                if detector is not None:
+                    detector.message_processed()
+
+    def stop(self):
+        """
+        Makes the node's thread stop once it reaches this request in its queue.
+        """
+        self.queue.put(_STOP)
 
 
     def handle_event(self, event):
@@ -100,18 +144,23 @@ class BCNode(Thread):
 
         :param event: The event to handle.
         """
-        if event.event_type == EventType.INIT:
+        if self.metrics is not None:
+            self.metrics.count_received(event.message_type)
+        kind = event.kind
+        if kind == INIT:
             self.broadcast_vote()
-        elif event.event_type == EventType.VOTE:
+        elif kind == VOTE:
             self.on_vote(event)
-        elif event.event_type == EventType.ECHO:
+        elif kind == ECHO:
             self.on_echo(event)
-        elif event.event_type == EventType.DECIDE:
+        elif kind == DECIDE:
             self.on_decide(event)
 
     def send_init(self):
         """ Broadcasts an INIT event to all nodes including itself to start the voting process. """
-        init_event = Event(EventType.INIT, self)
+        init_event = Event(EventType.INIT, self.name)
+        if self.metrics is not None:
+            self.metrics.mark_started()
         global global_inited_count
         global_inited_count += 1
         self.broadcast(EventType.INIT, self.vote)
@@ -124,8 +173,8 @@ class BCNode(Thread):
         :param Event event: The event instance.
         """
         # with global_lock:
-        if event.source != self:
-            print(f"{self.name} acknowledges the initialization of {event.source.name}.")
+        if event.source != self.name:
+            print(f"{self.name} acknowledges the initialization of {event.source}.")
         self.broadcast_vote()
 
     def on_vote(self, event):
@@ -139,10 +188,12 @@ class BCNode(Thread):
 
         if self.is_byzantine:
             # send different votes to different processes randomly from byzantine node
-            for component in self.nodes.values():
-                vote = random.choice([0, 1])
-                event = Event(EventType.ECHO, self, vote=vote)
-                component.queue.put(event)
+            if self.detector is not None:
+                self.detector.message_sent(len(self.nodes))
+            equivocate(self.nodes.values(), lambda component: Event(EventType.ECHO, self.name, vote=self.rng.choice([0, 1])),
+                       _deliver)
+            if self.metrics is not None:
+                self.metrics.count_sent(EventType.ECHO.value, len(self.nodes))
         else:
             # Echo the current node's vote to other processes
             self.broadcast(EventType.ECHO, vote=event.vote)
@@ -159,12 +210,11 @@ class BCNode(Thread):
         if self.state == State.DECIDED:
             return
 
-        # Count the echoes come from other nodes and decide if there is a majority
+        # Count the nodes that echoed the vote and decide if there is a majority
         # with global_lock:
-        self.echo_counts[event.vote] += 1
-        for vote, count in self.echo_counts.items():
-            if count > (len(self.nodes.keys()) + byzantine_count) / 2:
-                self.decide(vote)
+        count = self.echo_tally.add(event.source, event.vote)
+        if count > (len(self.nodes.keys()) + byzantine_count) / 2:
+            self.decide(event.vote)
 
     def on_decide(self,msg):
         #print(msg.event_type,msg.vote,msg.source)
@@ -178,8 +228,12 @@ class BCNode(Thread):
         """
         self.state = State.DECIDED
         self.decided_value = vote
+        if self.metrics is not None:
+            self.metrics.mark_decided()
         self.broadcast(EventType.DECIDE, vote=vote)
         print(f'{self.name} decided on value {self.decided_value}')
+        if self.detector is not None and not self.is_byzantine:
+            self.detector.node_decided(self)
         return
 
     def broadcast_vote(self):
@@ -195,15 +249,41 @@ class BCNode(Thread):
 
     def broadcast(self, event_type, vote):
         """
-        Sends an event to all other nodes.
+        Sends an event to all other nodes. They all receive the same Event object.
 
         :param EventType event_type: The type of the event to broadcast.
         :param int vote: The vote to be included in the broadcast, if applicable.
         """
-        for component in  self.nodes.values():
-            if component.name != self.name:
-                event = Event(event_type, self, vote=vote)
-                component.queue.put(event)
+        if self.detector is not None:
+            self.detector.message_sent(len(self.nodes) - 1)
+        multicast([component for component in self.nodes.values() if component.name != self.name],
+                  Event(event_type, self.name, vote=vote), _deliver)
+        if self.metrics is not None:
+            self.metrics.count_sent(event_type.value, len(self.nodes) - 1)
+
+def _deliver(component, event):
+    component.queue.put(event)
+
+def build_nodes(graph, byzantine_ids, rng=None):
+    """
+    Creates one BCNode per graph node, each knowing itself and its neighbours.
+
+    :param nx.Graph graph: The topology.
+    :param byzantine_ids: Ids of the Byzantine nodes.
+    :param rng: Random generator shared by the nodes (optional).
+    :return: A dict of node id to BCNode.
+    """
+    nodes = {node_id: BCNode(node_id, None, is_byzantine=(node_id in byzantine_ids), rng=rng)
+             for node_id in sorted(graph.nodes)}
+    n = graph.number_of_nodes()
+    if graph.number_of_edges() == n * (n - 1) // 2:
+        for node in nodes.values():
+            node.nodes = nodes
+    else:
+        for node_id, node in nodes.items():
+            node.nodes = {neighbour: nodes[neighbour] for neighbour in graph.neighbors(node_id)}
+            node.nodes[node_id] = node
+    return nodes
 
 def setup_simulation():
     """
@@ -212,11 +292,18 @@ def setup_simulation():
     global byzantine_count, node_count
     nodes = {name: BCNode(name, None, is_byzantine=(name == 'Node3')) for name in ['Node1', 'Node2', 'Node3', 'Node4','Node5']}
     node_count = len(nodes.keys())
-    byzantine_count += 3
+    byzantine_count += sum(node.is_byzantine for node in nodes.values())
     for node in nodes.values():
         node.nodes = nodes  # Set the reference to all nodes for each node
+    detector = TerminationDetector()
+    detector.attach(nodes.values())
+    start = time.perf_counter()
     for node in nodes.values():
         node.start()  # Starting the node thread will trigger its own initialization
+    reason = detector.wait()
+    for node in nodes.values():
+        node.join()
+    print(f"Terminated ({reason}) after {time.perf_counter() - start:.3f}s and {detector.processed} handled messages")
 
 if __name__ == '__main__':
     setup_simulation()
@@ -1,3 +1,7 @@
+import argparse
+import os
+import random
+import sys
 import matplotlib.pyplot as plt
 import networkx as nx
 import time
@@ -7,17 +11,30 @@ from adhoccomputing.Experimentation.Topology import Topology
 from adhoccomputing.Networking.LinkLayer.GenericLinkLayer import GenericLinkLayer
 from adhoccomputing.Networking.NetworkLayer.GenericNetworkLayer import GenericNetworkLayer
 from adhoccomputing.Networking.LogicalChannels.GenericChannel import GenericChannel
+import ConveniantByzantineConsensus
 from ConveniantByzantineConsensus import BCNode
+from Batching import BatchedConsensus
+from CoalescingLayer import CoalescingLayer
 import csv
+from TraceSink import get_trace_sink, close_trace_sink
+from Profiling import profiler
 
 _topology = Topology()
 global_nodes = []
 global_bc_nodes = []
+# Keyword arguments of the CoalescingLayer put between BCNode and the network layer, None for no coalescing
+coalescing = None
+# Seconds the nodes get to handle their EXIT event at the end of a run
+EXIT_TIMEOUT = 5.0
+# Seconds main waits for every node to decide
+MAIN_TIMEOUT = 60.0
 
-def setup_csv_logger(filename='ByzantineConsensus.csv'):
+def setup_csv_logger(filename='ByzantineConsensus.csv', flush_size=None, flush_interval=None):
+    close_trace_sink(filename)
     with open(filename, mode='w', newline='') as file:
         writer = csv.writer(file)
         writer.writerow(['Source Node', 'Message','Delivered Node'])
+    get_trace_sink(filename, flush_size, flush_interval)
 
 
 class AdHocNode(GenericModel):
@@ -45,9 +62,18 @@ class AdHocNode(GenericModel):
         self.components.append(self.linklayer)
 
         # CONNECTIONS AMONG SUBCOMPONENTS
+        below_appllayer = self.netlayer
+        if coalescing is not None:
+            self.coalescinglayer = CoalescingLayer("CoalescingLayer", componentid, **coalescing)
+            self.components.append(self.coalescinglayer)
+            self.coalescinglayer.connect_me_to_component(
+                ConnectorTypes.DOWN, self.netlayer)
+            self.netlayer.connect_me_to_component(
+                ConnectorTypes.UP, self.coalescinglayer)
+            below_appllayer = self.coalescinglayer
         self.appllayer.connect_me_to_component(
-            ConnectorTypes.DOWN, self.netlayer)
-        self.netlayer.connect_me_to_component(
+            ConnectorTypes.DOWN, below_appllayer)
+        below_appllayer.connect_me_to_component(
             ConnectorTypes.UP, self.appllayer)
         self.netlayer.connect_me_to_component(
             ConnectorTypes.DOWN, self.linklayer)
@@ -58,6 +84,59 @@ class AdHocNode(GenericModel):
         self.connect_me_to_component(ConnectorTypes.UP, self.linklayer)
 
 
+def setup_experiment(G, byzantine_ids, coalescing_options=None, instances=1, window=None):
+    """
+    Builds the topology of a graph with one BCNode per node and marks the Byzantine nodes.
+
+    :param nx.Graph G: The topology.
+    :param byzantine_ids: Ids of the Byzantine nodes.
+    :param dict coalescing_options: Keyword arguments of a CoalescingLayer below every BCNode, e.g. {} for the
+        defaults, None for no coalescing.
+    :param int instances: Number of consensus instances the nodes run.
+    :param int window: Most instances a node has open at once, the module default if None.
+    :return: The list of BCNodes.
+    """
+    global coalescing
+    coalescing = coalescing_options
+    ConveniantByzantineConsensus.instance_count = instances
+    if window is not None:
+        ConveniantByzantineConsensus.instance_window = window
+    _topology.construct_from_graph(G, AdHocNode, GenericChannel)
+    global_nodes = _topology.nodes
+
+    for i in range(len(global_nodes)):
+        for component in global_nodes[i].components:
+            if isinstance(component,BCNode):
+                global_bc_nodes.append(component)
+    for component in global_bc_nodes:
+        component.nodes = global_bc_nodes
+        component.is_byzantine = component.componentinstancenumber in byzantine_ids
+    return global_bc_nodes
+
+def end_experiment(filename='ByzantineConsensus.csv', timeout=EXIT_TIMEOUT):
+    """
+    Stops the nodes of the run and writes the rest of its trace to the file.
+
+    :param str filename: The trace file of the run.
+    :param float timeout: Seconds the nodes get to handle their EXIT event.
+    """
+    _topology.exit()
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline and not all(node.terminated for node in global_bc_nodes):
+        time.sleep(0.01)
+    close_trace_sink(filename)
+
+def decisions_per_second(nodes, elapsed):
+    """
+    Returns the rate at which the honest nodes finished consensus instances.
+
+    :param list nodes: The BCNodes.
+    :param float elapsed: Seconds since the topology started.
+    :return: Instances finished by every honest node per second.
+    """
+    honest = [node for node in nodes if not node.is_byzantine]
+    return min(node.decided_count for node in honest) / elapsed if honest and elapsed else 0.0
+
 def main():
 
     n = 12
@@ -77,50 +156,108 @@ def main():
     labels = nx.get_edge_attributes(G, 'weight')
     nx.draw_networkx_edge_labels(G, pos, edge_labels=labels, **options)
 
-    _topology.construct_from_graph(G, AdHocNode, GenericChannel)
-
+    nodes = setup_experiment(G, [1, 2, 3, 4])
+    _topology.start()
+    plt.savefig("graph.png")
+    deadline = time.perf_counter() + MAIN_TIMEOUT
+    while time.perf_counter() < deadline and not all(node.flag for node in nodes):
+        time.sleep(0.01)
+    end_experiment()
 
-    global_nodes = _topology.nodes
 
-    for i in range(len(global_nodes)):
-        for component in global_nodes[i].components:
-            if isinstance(component,BCNode):
-                global_bc_nodes.append(component)
-    for i in range(len(global_nodes)):
-        for component in _topology.nodes[i].components:
-            if isinstance(component,BCNode):
-                component.nodes = global_bc_nodes
-    # global_bc_nodes[1].is_byzantine = True
-    for component in _topology.nodes[1].components:
-        if isinstance(component,BCNode):
-            component.is_byzantine = True
-    for component in _topology.nodes[2].components:
-        if isinstance(component,BCNode):
-            component.is_byzantine = True
-    for component in _topology.nodes[3].components:
-        if isinstance(component,BCNode):
-            component.is_byzantine = True
-    for component in _topology.nodes[4].components:
-        if isinstance(component,BCNode):
-            component.is_byzantine = True
-    # for component in _topology.nodes[5].components:
-    #     if isinstance(component,BCNode):
-    #         component.is_byzantine = True
-    # for component in _topology.nodes[6].components:
-    #     if isinstance(component,BCNode):
-    #         component.is_byzantine = True
-    # for component in _topology.nodes[7].components:
-    #     if isinstance(component,BCNode):
-    #         component.is_byzantine = True
-    # for component in _topology.nodes[1].components:
-    #     if isinstance(component,BCNode):
-    #         component.is_byzantine = True
+def check_instances(n, byzantine_ids, instances, window=None, seed=0, timeout=60.0):
+    """
+    Runs many consensus instances on a complete graph and waits until every honest node finished all of them.
 
+    :param int n: Number of nodes.
+    :param byzantine_ids: Ids of the Byzantine nodes.
+    :param int instances: Number of consensus instances.
+    :param int window: Most instances a node has open at once, the module default if None.
+    :param int seed: Seed of the run.
+    :param float timeout: Seconds to wait.
+    :return: The honest nodes that did not finish every instance, empty if all did.
+    """
+    random.seed(seed)
+    ConveniantByzantineConsensus.byzantine_count = len(byzantine_ids)
+    nodes = setup_experiment(nx.complete_graph(n), byzantine_ids, instances=instances, window=window)
+    honest = [node for node in nodes if not node.is_byzantine]
+    deadline = time.perf_counter() + timeout
     _topology.start()
-    plt.savefig("graph.png")
+    while time.perf_counter() < deadline and any(node.decided_count < instances for node in honest):
+        time.sleep(0.01)
+    return [node for node in honest if node.decided_count < instances]
+
 
+def check_batches(n, byzantine_ids, values, batch_size, window=None, seed=0, timeout=60.0):
+    """
+    Agrees on client values in batches on a complete graph and waits until every honest node delivered every batch.
+
+    No batch is tampered with, so every honest node has to vote 1 in every batch instance. The Byzantine nodes may
+    still get a batch rejected, so the check only needs every batch to be decided.
+
+    :param int n: Number of nodes.
+    :param byzantine_ids: Ids of the Byzantine nodes.
+    :param int values: Number of client values.
+    :param int batch_size: Most values in one batch.
+    :param int window: Most instances a node has open at once, the module default if None.
+    :param int seed: Seed of the run.
+    :param float timeout: Seconds to wait.
+    :return: The BatchedConsensus and the honest nodes that voted 0 in a batch instance or did not get through
+        every batch, empty if none did.
+    """
+    random.seed(seed)
+    ConveniantByzantineConsensus.byzantine_count = len(byzantine_ids)
+    nodes = setup_experiment(nx.complete_graph(n), byzantine_ids, window=window)
+    honest = [node for node in nodes if not node.is_byzantine]
+    front_end = BatchedConsensus(nodes, lambda node, batch: None, batch_size)
+    deadline = time.perf_counter() + timeout
+    _topology.start()
+    for value in range(values):
+        front_end.submit(value)
+    front_end.batcher.flush()
+    batches = front_end.batcher.sequence
+    delivered = lambda node: front_end.deliveries[node.name].next_sequence >= batches
+    while time.perf_counter() < deadline and not all(delivered(node) for node in honest):
+        time.sleep(0.01)
+    return front_end, [node for node in honest if front_end.zero_votes[node.name] or not delivered(node)]
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the AHC consensus, or check that concurrent instances or "
+                                                 "batches all finish.")
+    parser.add_argument('--instances', type=int, default=None, help="check a run of this many instances instead")
+    parser.add_argument('--batched', type=int, default=None,
+                        help="check that this many client values are agreed on in batches instead")
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('-n', '--nodes', type=int, default=5)
+    parser.add_argument('-b', '--byzantine', type=int, nargs='*', default=[1])
+    parser.add_argument('--window', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    args = parser.parse_args()
     setup_csv_logger()
-    main()
\ No newline at end of file
+    if args.instances is None and args.batched is None:
+        main()
+    else:
+        if args.instances is not None:
+            stuck = check_instances(args.nodes, args.byzantine, args.instances, args.window, args.seed, args.timeout)
+            for node in stuck:
+                print(f"Node {node.name} finished {node.decided_count} of {args.instances} instances, "
+                      f"stuck at instance {node.low_watermark}")
+            run = f"{args.instances} instances"
+        else:
+            front_end, stuck = check_batches(args.nodes, args.byzantine, args.batched, args.batch_size, args.window,
+                                             args.seed, args.timeout)
+            for node in front_end.nodes:
+                delivery = front_end.deliveries[node.name]
+                print(f"Node {node.name} voted 0 in {front_end.zero_votes[node.name]} batch instances, rejected "
+                      f"{delivery.rejected} and delivered {delivery.next_sequence - delivery.rejected} of "
+                      f"{front_end.batcher.sequence} batches{' (Byzantine)' if node.is_byzantine else ''}")
+            run = f"{args.batched} values in batches of {args.batch_size}"
+        print(f"{'FAILED' if stuck else 'OK'}: {run} on {args.nodes} nodes, seed {args.seed}")
+        sys.stdout.flush()
+        # os._exit skips the atexit hooks, so write the trace and profiles first
+        end_experiment()
+        if profiler.mode is not None:
+            profiler.write()
+        os._exit(1 if stuck else 0)
@@ -0,0 +1,108 @@
+import threading
+from adhoccomputing.Generics import Event, EventTypes
+from adhoccomputing.GenericModel import GenericModel
+from Broadcast import Envelope
+
+# Message type of the envelopes carrying a frame of coalesced messages
+FRAME = 'FRAME'
+# Most messages put into one frame
+DEFAULT_MAX_BATCH = 64
+# Most seconds a message waits for more messages to the same destination, 0 to only wait while the inbox is not empty
+DEFAULT_WINDOW = 0.0
+# Event type the window timer, or a layer leaving messages pending on a busy inbox, wakes the layer with
+_FLUSH = 'coalescingflush'
+
+
+class CoalescingLayer(GenericModel):
+    """
+    Layer between an application layer and the network layer that sends the messages bound for the same destination
+    in one frame.
+
+    Messages from the top are kept per destination. The pending messages go down once a destination has max_batch of
+    them, or at the latest window seconds after the first of them was queued, busy inbox or not. With the default
+    window of 0 they go down once the layer got through the events that were in its inbox when they were queued, so
+    a frame holds whatever the application sent while the layer was busy and no delay is added. A frame is an
+    Envelope of type FRAME whose payload is the tuple of messages, a single message goes down as it is. The network,
+    link and channel hops are then taken once per frame. On receipt the frame is unpacked and every message goes up on its own.
+
+    :param str componentname: The name of the component.
+    :param int componentinstancenumber: Id of the node.
+    :param int max_batch: Most messages in one frame.
+    :param float window: Most seconds a message waits for more messages to the same destination.
+
+    Attributes:
+        pending (dict): Messages waiting to go down per destination.
+        frames_sent (int): Number of frames sent.
+        messages_sent (int): Number of messages sent, in frames or on their own.
+    """
+    def __init__(self, componentname, componentinstancenumber, context=None, configurationparameters=None, num_worker_threads=1, topology=None, max_batch=DEFAULT_MAX_BATCH, window=DEFAULT_WINDOW):
+        super().__init__(componentname, componentinstancenumber, context, configurationparameters, num_worker_threads, topology)
+        self.max_batch = max_batch
+        self.window = window
+        self.pending = {}
+        self.frames_sent = 0
+        self.messages_sent = 0
+        self._timer = None
+        self._flush_queued = False
+        self.eventhandlers[_FLUSH] = self.on_flush
+
+    def on_message_from_top(self, eventobj: Event):
+        message = eventobj.eventcontent
+        destination = message.header.messageto
+        batch = self.pending.get(destination)
+        if batch is None:
+            batch = self.pending[destination] = []
+        batch.append(message)
+        if len(batch) >= self.max_batch:
+            self.flush(destination)
+        self.schedule_flush()
+
+    def on_flush(self, eventobj: Event):
+        self._timer = None
+        self._flush_queued = False
+        self.flush()
+
+    def on_message_from_bottom(self, eventobj: Event):
+        message = eventobj.eventcontent
+        if message.header.messagetype == FRAME:
+            for inner in message.payload:
+                self.send_up(Event(self, EventTypes.MFRB, inner))
+        else:
+            self.send_up(Event(self, EventTypes.MFRB, message))
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        """
+        Flushes the pending messages right away if the inbox is empty and there is no window, otherwise queues a
+        flush behind the waiting events or starts the window timer if neither is pending yet, so no message waits
+        longer than the busy inbox or the window.
+        """
+        if not self.pending:
+            return
+        if self.window <= 0:
+            if self.inputqueue.empty():
+                self.flush()
+            elif not self._flush_queued:
+                self._flush_queued = True
+                self.send_self(Event(self, _FLUSH, None))
+        elif self._timer is None:
+            self._timer = threading.Timer(self.window, self.send_self, [Event(self, _FLUSH, None)])
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self, destination=None):
+        """
+        Sends the pending messages of a destination, or of every destination, down.
+        """
+        destinations = [destination] if destination is not None else list(self.pending)
+        for destination in destinations:
+            batch = self.pending.pop(destination, None)
+            if not batch:
+                continue
+            if len(batch) == 1:
+                self.send_down(Event(self, EventTypes.MFRT, batch[0]))
+            else:
+                frame = Envelope(FRAME, self.componentinstancenumber, destination, tuple(batch))
+                self.send_down(Event(self, EventTypes.MFRT, frame))
+                self.frames_sent += 1
+            self.messages_sent += len(batch)
@@ -4,10 +4,15 @@ from adhoccomputing.GenericModel import GenericModel, GenericMessageHeader, Gene
 import networkx as nx
 from time import sleep
 from collections import defaultdict, Counter
-from Crypto.PublicKey import RSA
-from Crypto.Signature import pkcs1_15
-import csv
-from Crypto.Hash import SHA256
+from TraceSink import get_trace_sink
+from CryptoCache import CryptoCache
+from SignatureSchemes import get_scheme
+from NodeMetrics import node_metrics, time_handlers
+from Profiling import profile_dispatch
+from Broadcast import Envelope, multicast
+from Messages import AuthMessage
+from SignatureChain import FLAT, LINKED, LinkedSignatureChain, ChainVerifier, default_chain_format
+from BatchVerifier import default_batch_verification
 import random
 
 BRIGHT_BLACK = "\033[0;90m"   # Black (Bright)
@@ -21,10 +26,13 @@ BRIGHT_WHITE = "\033[0;97m"   # White (Bright)
 # Reset Color
 RESET = "\033[0m"  # Reset to default terminal color
 
-def log_message_to_csv(source_node, message, signature_chain, delivered_node, pulse, filename='ByzantineAuth.csv'):
-    with open(filename, mode='a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([source_node, message, signature_chain ,delivered_node, pulse])
+# Maximum number of messages whose signature chains are verified together in batch verification mode
+VERIFY_BATCH_SIZE = 64
+
+TRACE_FILENAME = 'ByzantineAuth.csv'
+
+def log_message_to_csv(source_node, message, signature_chain, delivered_node, pulse, filename=TRACE_FILENAME):
+    get_trace_sink(filename).write([source_node, message, signature_chain ,delivered_node, pulse])
 
 
 class BANode(GenericModel):
@@ -41,6 +49,9 @@ class BANode(GenericModel):
     :param configurationparamters: Configuration parameters specific to the node's setup (optional).
     :param int num_worker_threads: The number of worker threads for this node (optional).
     :param nx.Graph topology: The network topology as a graph where nodes are processes and edges represent communication links (optional).
+    :param SignatureScheme signature_scheme: Scheme used to sign and verify messages, defaults to get_scheme() (optional).
+    :param bool batch_verification: Verify the chains of queued messages together on a process pool, defaults to BYZANTINE_BATCH_VERIFY (optional).
+    :param str chain_format: "flat" lists of (node_id, signature) or hash-linked "linked" chains, defaults to BYZANTINE_CHAIN_FORMAT (optional).
 
     Attributes:
         node_id (int): An identifier that matches the component instance number, used for addressing the node within the network.
@@ -48,11 +59,20 @@ class BANode(GenericModel):
         round_count (int): A counter to track the number of communication rounds that have been executed.
         values_q (defaultdict(list)): A dictionary to store values by rounds, collected from messages.
         is_decided (bool): Flag to check if the node has made a final decision.
-        key (RSA key): A generated RSA key for signing and verifying messages.
+        scheme (SignatureScheme): The signature scheme shared by all nodes.
+        key: The private key of the node for signing messages.
+        public_key: The public key other nodes use to verify the node's signatures.
+        crypto (CryptoCache): Memoized signatures, verifiers and verification results of this node.
+        batch_verification (bool): Whether incoming messages are verified in batches by the BatchVerifier of the run.
+        batch_verifier (BatchVerifier): The BatchVerifier of the run, set by attach_batch_verifier, None until then.
+        pending_messages (list): Messages waiting for the next batch verification.
+        chain_format (str): Format of the signature chains the node creates and accepts.
+        chain_verifier (ChainVerifier): Incremental validator of hash-linked chains.
         received_signatures (defaultdict(set)): Stores signatures received to prevent replay and ensure message integrity.
         final_decision (Any): Stores the final decision made after concluding the agreement process.
+        metrics (NodeMetrics): Message counters, handler times and signature operations of the node, None unless metrics are enabled.
     """
-    def __init__(self, componentname, componentinstancenumber, nodes, k , is_general, is_byzantine, context=None, configurationparamters=None, num_worker_threads=1, topology: nx.Graph = None):
+    def __init__(self, componentname, componentinstancenumber, nodes, k , is_general, is_byzantine, context=None, configurationparamters=None, num_worker_threads=1, topology: nx.Graph = None, signature_scheme=None, batch_verification=None, chain_format=None):
         
         super().__init__(componentname, componentinstancenumber,context,configurationparamters, num_worker_threads, topology)
         self.node_id = componentinstancenumber
@@ -64,9 +84,24 @@ class BANode(GenericModel):
         self.is_byzantine = is_byzantine
         self.values_q = defaultdict(list)
         self.is_decided = False
-        self.key = RSA.generate(2048)
+        self.scheme = signature_scheme if signature_scheme is not None else get_scheme()
+        self.key = self.scheme.generate_key(componentinstancenumber)
+        self.public_key = self.scheme.public_key(self.key)
+        self.crypto = CryptoCache(self.scheme, self.key, lambda node_id: self.nodes[node_id].public_key)
+        self.batch_verification = batch_verification if batch_verification is not None else default_batch_verification()
+        self.batch_verifier = None
+        self.pending_messages = []
+        self.chain_format = chain_format or default_chain_format()
+        self.chain_verifier = ChainVerifier(self.crypto)
         self.received_signatures = defaultdict(set)
         self.final_decision = None  # Attribute to store the final decision
+        self.metrics = node_metrics(componentinstancenumber)
+        if self.metrics is not None:
+            self.metrics.crypto = self.crypto
+        time_handlers(self, ('receive_message',))
+        if profile_dispatch(self, self.node_id, 'on_message_from_bottom',
+                            lambda eventobj: "INIT" if len(eventobj.eventcontent.payload[2]) == 1 else "AUTH"):
+            self.eventhandlers[EventTypes.MFRB] = self.on_message_from_bottom
 
     def prepare_payload(self, msg_type, destination, payload):
         """
@@ -82,23 +117,47 @@ class BANode(GenericModel):
         msg = GenericMessage(hdr,payload)
         return msg
 
+    def send_envelope(self, destination, payload):
+        """
+        Sends a message, possibly shared with other destinations, to one node in an Envelope.
+
+        :param BANode destination: The node.
+        :param AuthMessage payload: The message.
+        """
+        self.send_down(Event(self, EventTypes.MFRT, Envelope("temp", self.componentinstancenumber, destination.node_id, payload)))
+
     def on_message_from_bottom(self, eventobj: Event):
         message = eventobj.eventcontent
         inner_message = message.payload
         hdr = message.header
-        self.receive_message(inner_message)
+        if self.metrics is not None:
+            self.metrics.observe_queue(self.inputqueue.qsize() + 1)
+        if self.batch_verifier is not None and self.chain_format == FLAT:
+            self.pending_messages.append(inner_message)
+            # Everything that arrived while the last batch was processed is verified together
+            if len(self.pending_messages) >= VERIFY_BATCH_SIZE or self.inputqueue.empty():
+                self.receive_pending_messages()
+        else:
+            self.receive_message(inner_message)
         #COLOR = ''
 
+    def receive_pending_messages(self):
+        """
+        Verifies the signature chains of all pending messages as one batch, then handles them in arrival order.
+        """
+        messages, self.pending_messages = self.pending_messages, []
+        verdicts = self.batch_verifier.verify_batch([(value, signature_chain) for value, pulse, signature_chain in messages], self.crypto)
+        for message, valid in zip(messages, verdicts):
+            self.receive_message(message, valid=valid)
+
     def sign(self, data):
         """
-        Signs data using the node's private RSA key.
+        Signs data using the node's private key.
 
-        :param str data: The data to sign.
+        :param data: The data to sign, a value string or a chain digest.
         :return: The digital signature.
         """
-        hasher = SHA256.new(data.encode('utf-8'))
-        signature = pkcs1_15.new(self.key).sign(hasher)
-        return signature
+        return self.crypto.sign(data)
     
     def verify_signature(self, data, signature, public_key):
         """
@@ -109,13 +168,22 @@ class BANode(GenericModel):
         :param public_key: The public key to use for verification.
         :return: True if the signature is valid, False otherwise.
         """
-        hasher = SHA256.new(data.encode('utf-8'))
-        try:
-            pkcs1_15.new(public_key).verify(hasher, signature)
-            return True
-        except ValueError:
-            return False
+        return self.scheme.verify(public_key, data.encode('utf-8'), signature)
         
+    def extend_chain(self, value, signature_chain=None):
+        """
+        Returns a signature chain extended with this node's signature.
+
+        :param str value: The value being relayed.
+        :param signature_chain: The received chain, None to start a new one.
+        :return: The extended chain, in the node's chain format.
+        """
+        if self.chain_format == LINKED:
+            if signature_chain is None:
+                signature_chain = LinkedSignatureChain(value)
+            return signature_chain.extend(self.node_id, self.sign(signature_chain.digest))
+        return (signature_chain or []) + [(self.node_id, self.sign(value))]
+
     def on_init(self, eventobj: Event):
         """
         Broadcasts the initial value from the general.
@@ -123,45 +191,51 @@ class BANode(GenericModel):
         :param str value: The value to broadcast.
         :param int pulse: The pulse number for this broadcast.
         """
+        if self.metrics is not None:
+            self.metrics.mark_started()
         if self.is_general:
             if self.is_byzantine:
                 value = random.choice(["ACCEPT","REJECT"])
             else:
                 value = "ACCEPT"
             pulse = 0 
-            message = (value, pulse ,[(self.node_id, self.sign(value))])
+            message = AuthMessage(value, pulse, self.extend_chain(value))
             self.broadcast_message(message, True)
         else:
             pass
 
     def broadcast_message(self, message, is_init = False):
         """
-        Broadcasts a message to all other nodes.
+        Broadcasts a message to all other nodes, which share the message object.
 
         :param tuple message: The message to broadcast.
         :param int pulse: The current pulse number.
         """ 
        # global global_node_count
-        for node in self.nodes:
-            if is_init:
+        if is_init:
+            for node in self.nodes:
                 node.general_id = message[2][0][1]
-            if node.node_id != self.node_id:
-                msg = self.prepare_payload("temp", node.node_id, message )
-                # print(f"{BRIGHT_RED}{msg}{RESET}")
-                self.send_down(Event(self,EventTypes.MFRT,msg))
+        multicast([node for node in self.nodes if node.node_id != self.node_id], message, self.send_envelope)
+        if self.metrics is not None:
+            self.metrics.count_sent("INIT" if is_init else "AUTH", len(self.nodes) - 1)
                     
-    def receive_message(self, message, is_init = False):
+    def receive_message(self, message, is_init = False, valid=None):
         """
         Receives a message from another node.
 
         :param tuple message: The received message.
         :param int pulse: The pulse number when the message was sent.
+        :param bool valid: The result of an earlier batch verification of the signature chain, if any.
         """
         value, pulse,  signature_chain = message
+        if self.metrics is not None:
+            self.metrics.count_received("INIT" if len(signature_chain) == 1 else "AUTH")
         source_id = signature_chain[-1][0] if signature_chain else "Unknown"
         new_signature_chain = 0
         log_message_to_csv(source_id, value, [i[0] for i in signature_chain], self.node_id, pulse)
-        if self.validate_message(value, signature_chain):
+        if valid is None:
+            valid = self.validate_message(value, signature_chain)
+        if valid:
             
             # Store the value if valid
             received_value = value
@@ -172,8 +246,8 @@ class BANode(GenericModel):
                 next_pulse = self.round_count 
                 self.round_count += 1
                 received_value = value if not self.is_byzantine else random.choice(["ACCEPT","REJECT"])
-                new_signature_chain = signature_chain + [(self.node_id, self.sign(received_value))]
-                new_message = (received_value, next_pulse ,new_signature_chain)
+                new_signature_chain = self.extend_chain(received_value, signature_chain)
+                new_message = AuthMessage(received_value, next_pulse, new_signature_chain)
                 self.broadcast_message(new_message)
             elif  self.round_count == (self.k - 1):
                 #self.round_count += 1
@@ -197,13 +271,18 @@ class BANode(GenericModel):
         :return: True if the message is valid, False otherwise.
         """
         # Check all signatures are valid and from distinct nodes
+        if self.chain_format == LINKED:
+            if not self.chain_verifier.validate(value, signature_chain):
+                print(f"{BRIGHT_RED}VERIFICATION FAILED{RESET}\n")
+                return False
+            return True
 
         seen_nodes = set()
         for node_id, signature in signature_chain:
             if node_id in seen_nodes:
                 print(f"{BRIGHT_RED}DUPLICATE SIGN{RESET}\n")
                 return False  # Prevents the same node from signing multiple times in a single chain
-            if not self.verify_signature(value, signature, self.nodes[node_id].key.publickey()):
+            if not self.crypto.verify(node_id, value, signature):
                 print(f"{BRIGHT_RED}VERIFICATION FAILED{RESET}\n")
                 return False  # Verification failed
             seen_nodes.add(node_id)
@@ -232,6 +311,8 @@ class BANode(GenericModel):
             print("HERE FAILED")
         #sleep(0.5)
         self.is_decided = True
+        if self.metrics is not None:
+            self.metrics.mark_decided()
             
 
     
\ No newline at end of file
@@ -3,9 +3,28 @@ from adhoccomputing.Generics import EventTypes, Event
 from adhoccomputing.GenericModel import GenericModel, GenericMessageHeader, GenericMessage
 import networkx as nx
 import random
-import csv
+import threading
+from collections import OrderedDict
+from TraceSink import get_trace_sink
+from NodeMetrics import node_metrics, time_handlers
+from Profiling import profile_dispatch
+from Broadcast import Envelope, multicast, equivocate
+from Messages import InstanceMessage, MESSAGE_TYPE_CODES
+from Tally import SenderTally
 
 byzantine_count = 4
+# Number of consensus instances every node built from now on starts with, instance 0 is the one single-shot runs
+# decide
+instance_count = 1
+# Most instances a node has open past the lowest instance it has not finished
+instance_window = 8
+# Number of the latest decisions a node keeps in its decisions table
+DECISION_HISTORY = 1024
+# Seconds a node of a multi-instance run waits on its lowest unfinished instance before skipping it, None to wait
+# forever
+instance_timeout = 5.0
+# Event type the instance timer wakes a node with, carrying the instance it was started for
+_EXPIRE = 'consensusexpire'
 # Bright Colors
 BRIGHT_BLACK = "\033[0;90m"   # Black (Bright)
 BRIGHT_RED = "\033[0;91m"     # Red (Bright)
@@ -18,10 +37,10 @@ BRIGHT_WHITE = "\033[0;97m"   # White (Bright)
 # Reset Color
 RESET = "\033[0m"  # Reset to default terminal color
 
-def log_message_to_csv(source_node, message, delivered_node, filename='ByzantineConsensus.csv'):
-    with open(filename, mode='a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([source_node, message, delivered_node])
+TRACE_FILENAME = 'ByzantineConsensus.csv'
+
+def log_message_to_csv(source_node, message, delivered_node, filename=TRACE_FILENAME):
+    get_trace_sink(filename).write([source_node, message, delivered_node])
 
 class ApplicationLayerMessageTypes(Enum):
     """
@@ -33,18 +52,23 @@ class ApplicationLayerMessageTypes(Enum):
     INIT = "INIT"
 
 # Base event data structure
-class ModEvent:
+class ModEvent(InstanceMessage):
     """
     Represents an event in the Byzantine consensus process.
 
     :param EventType event_type: The type of the event.
-    :param source: The node that originated the event.
+    :param source: The name of the node that originated the event.
     :param int vote: The vote associated with the event, if applicable.
+    :param int instance: The consensus instance the event belongs to.
     """
-    def __init__(self, event_type, source, vote=None):
-        self.event_type = event_type
-        self.source = source
-        self.vote = vote
+    __slots__ = ()
+
+    def __init__(self, event_type, source, vote=None, instance=0):
+        InstanceMessage.__init__(self, MESSAGE_TYPE_CODES[event_type.value], source, vote, instance)
+
+    @property
+    def event_type(self):
+        return ApplicationLayerMessageTypes(self.message_type)
 
 class State(Enum):
     """
@@ -54,10 +78,52 @@ class State(Enum):
     DECIDED = "DECIDED"
 
 
+class ConsensusInstance:
+    """
+    State of a node in one consensus instance.
+
+    :param int instance: Id of the instance.
+    :param int vote: The node's own vote in the instance.
+
+    Attributes:
+        state (State): DECIDED once the node's echoes reached a majority and it sent its DECIDE.
+        echo_tally (SenderTally): The nodes that echoed each possible vote.
+        decide_tally (SenderTally): The nodes that decided each possible vote.
+        num_of_decided (int): Number of nodes whose DECIDE arrived.
+        flag (bool): Set once enough DECIDE messages arrived to finish the instance.
+        decided_value (Any): The value the node decided on from the echoes.
+        final_decision (Any): The majority of the DECIDE messages, None on a tie or before.
+    """
+    __slots__ = ('instance', 'vote', 'state', 'echo_tally', 'decide_tally', 'num_of_decided', 'flag',
+                 'decided_value', 'final_decision')
+
+    def __init__(self, instance, vote):
+        self.instance = instance
+        self.vote = vote
+        self.state = State.UNDECIDED
+        self.echo_tally = SenderTally()
+        self.decide_tally = SenderTally()
+        self.num_of_decided = 0
+        self.flag = False
+        self.decided_value = None
+        self.final_decision = None
+
+
 class BCNode(GenericModel):
     """
     Initializes a Byzantine Consensus node within a distributed network simulation based on the Byzantine Generals Problem.
 
+    A node runs instance_count consensus instances over the same nodes and channels, a front-end such as Batching may
+    extend them as it goes. Every message carries its instance id and the node keeps a ConsensusInstance per open
+    instance. It opens the instances from the lowest one it has not finished up to instance_window past it, so the
+    others run concurrently while the state stays bounded. Messages for instances past the window or past the node's
+    instance_count wait until it opens them, messages for finished instances are dropped. A finished instance leaves
+    its decision in the decisions table and its state is removed. A node that finishes an instance past 0 without
+    having decided it adopts the majority decision and sends its own DECIDE, so fewer peers wait for it. An instance
+    that still holds the window instance_timeout seconds after the window reached it is skipped with no decision, so
+    one instance whose DECIDE messages never reach a majority does not stall the others. Instance 0 is what a
+    single-shot run decides, as it always did, and its state stays readable through the attributes below.
+
     :param str componentname: The name of the component.
     :param int componentinstancenumber: A unique identifier for this instance of the component, used as the node's name.
     :param list nodes: A list of all nodes in the network.
@@ -70,32 +136,47 @@ class BCNode(GenericModel):
         queue (Queue): The queue used for message handling within the node.
         name (int): The identifier of the node, usually matches the component instance number.
         nodes (list): The list of all other nodes in the network this node can communicate with.
-        num_of_decided (int): A counter to track how many nodes have decided on a value.
-        state (State): The current state of the node, initially set to UNDECIDED.
-        vote (int): The initial vote of the node, randomly chosen between predefined options.
-        echo_counts (dict): A dictionary to count echoes for each possible vote.
-        decide_counts (dict): A dictionary to count decisions for each possible vote.
+        num_of_decided (int): A counter to track how many nodes have decided on a value in instance 0.
+        state (State): The state of the node in instance 0, initially UNDECIDED.
+        vote (int): The initial vote of the node in instance 0, randomly chosen between predefined options.
+        echo_tally (SenderTally): The nodes that echoed each possible vote in instance 0, each counted once per vote.
+        decide_tally (SenderTally): The nodes that decided each possible vote in instance 0, each counted once per vote.
         is_byzantine (bool): Indicates if the node can perform Byzantine (faulty) actions.
-        flag (bool): A general-purpose flag used for various checks and conditions within the node.
+        flag (bool): Set once instance 0 is finished.
         event_handlers (dict): Event handlers mapping event types to corresponding methods.
-        decided_value (Any): The final decision made by the node if it reaches a consensus.
+        decided_value (Any): The final decision made by the node in instance 0 if it reaches a consensus.
+        final_decision (Any): The majority of the DECIDE messages of instance 0 once enough arrived, None on a tie or before.
+        instances (dict): ConsensusInstance per open instance id.
+        low_watermark (int): The lowest instance id the node has not finished.
+        finished (set): Finished instance ids above low_watermark.
+        deferred (dict): Messages per instance id past the window, with their message types.
+        decisions (OrderedDict): final_decision per finished instance id, the latest DECISION_HISTORY of them.
+        instance_count (int): Number of consensus instances the node runs.
+        decided_count (int): Number of instances the node finished.
+        skipped_count (int): Number of the finished instances the node skipped on instance_timeout.
+        metrics (NodeMetrics): Message counters and handler times of the node, None unless metrics are enabled.
 
     This class represents a node capable of participating in Byzantine fault-tolerant consensus algorithms, handling different types of messages, and deciding on values based on majority rules or received commands.
     """
     def __init__(self, componentname, componentinstancenumber, nodes, context=None, configurationparamters=None, num_worker_threads=1, topology: nx.Graph = None):
-        
+
         super().__init__(componentname, componentinstancenumber,context,configurationparamters, num_worker_threads, topology)
 
         self.queue = None
         self.name = self.componentinstancenumber
         self.nodes = nodes
-        self.num_of_decided = 0
-        self.state = State.UNDECIDED
-        self.vote = random.choice([0, 1])
-        self.echo_counts = {0: 0, 1: 0}
-        self.decide_counts = {0: 0, 1: 0}
+        self.first_instance = ConsensusInstance(0, random.choice([0, 1]))
+        self.instances = {0: self.first_instance}
+        self.low_watermark = 0
+        self.finished = set()
+        self.deferred = {}
+        self.decisions = OrderedDict()
+        self.instance_count = instance_count
+        self.decided_count = 0
+        self.skipped_count = 0
+        self._expiry = None
+        self._expiry_instance = None
         self.is_byzantine = False
-        self.flag = False
         self.event_handlers = {
             ####
             ApplicationLayerMessageTypes.VOTE: self.on_vote,
@@ -104,7 +185,44 @@ class BCNode(GenericModel):
             ApplicationLayerMessageTypes.INIT: self.on_init,
             ####
         }
-        self.decided_value = None
+        self.eventhandlers[_EXPIRE] = self.on_expire
+        self.metrics = node_metrics(self.name)
+        time_handlers(self, ('on_vote', 'on_echo', 'on_decide'))
+        if profile_dispatch(self, self.name, 'on_message_from_bottom',
+                            lambda eventobj: eventobj.eventcontent.header.messagetype.value):
+            self.eventhandlers[EventTypes.MFRB] = self.on_message_from_bottom
+
+    @property
+    def vote(self):
+        return self.first_instance.vote
+
+    @property
+    def state(self):
+        return self.first_instance.state
+
+    @property
+    def echo_tally(self):
+        return self.first_instance.echo_tally
+
+    @property
+    def decide_tally(self):
+        return self.first_instance.decide_tally
+
+    @property
+    def num_of_decided(self):
+        return self.first_instance.num_of_decided
+
+    @property
+    def flag(self):
+        return self.first_instance.flag
+
+    @property
+    def decided_value(self):
+        return self.first_instance.decided_value
+
+    @property
+    def final_decision(self):
+        return self.first_instance.final_decision
 
     def on_message_from_bottom(self, eventobj: Event):
         message = eventobj.eventcontent
@@ -119,16 +237,27 @@ class BCNode(GenericModel):
             COLOR = BRIGHT_CYAN
         elif modMessage.event_type == ApplicationLayerMessageTypes.DECIDE:
             COLOR = BRIGHT_RED
-        #print(f"{COLOR}Message arrived to Node: {self.componentinstancenumber}\n\tMessage:\n\t\tModEvent Type: {modMessage.event_type}\n\t\tSource Node: {modMessage.source.componentinstancenumber}\n\t\tVote: {modMessage.vote}{RESET}\n")
-        log_message_to_csv(modMessage.source.name, f'Event Type: {modMessage.event_type} | Vote: {modMessage.vote} ', self.name)
+        #print(f"{COLOR}Message arrived to Node: {self.componentinstancenumber}\n\tMessage:\n\t\tModEvent Type: {modMessage.event_type}\n\t\tSource Node: {modMessage.source}\n\t\tVote: {modMessage.vote}{RESET}\n")
+        instance_note = f'| Instance: {modMessage.instance} ' if modMessage.instance else ''
+        log_message_to_csv(modMessage.source, f'Event Type: {modMessage.event_type} | Vote: {modMessage.vote} {instance_note}', self.name)
+        if self.metrics is not None:
+            self.metrics.count_received(hdr.messagetype.value)
+            self.metrics.observe_queue(self.inputqueue.qsize() + 1)
         self.handle_event(modMessage,hdr)
 
     def handle_event(self, event, hdr):
         """
-        Handles an incoming event based on its type.
+        Handles an incoming event based on its type, once its instance is open.
 
         :param event: The event to handle.
         """
+        if event.instance not in self.instances:
+            if event.instance < self.low_watermark or event.instance in self.finished:
+                return
+            if event.instance >= self.low_watermark + instance_window or event.instance >= self.instance_count:
+                self.deferred.setdefault(event.instance, []).append((event, hdr))
+                return
+            self.open_instance(event.instance)
         if hdr.messagetype == ApplicationLayerMessageTypes.VOTE:
             self.on_vote(event)
         elif hdr.messagetype == ApplicationLayerMessageTypes.ECHO:
@@ -141,6 +270,16 @@ class BCNode(GenericModel):
         msg = GenericMessage(hdr,payload)
         return msg
 
+    def send_envelope(self, destination, msg_type, payload):
+        """
+        Sends a payload, possibly shared with other destinations, to one node in an Envelope.
+
+        :param destination: The node.
+        :param ApplicationLayerMessageTypes msg_type: The message type.
+        :param ModEvent payload: The payload.
+        """
+        self.send_down(Event(self, EventTypes.MFRT, Envelope(msg_type, self.componentinstancenumber, destination.name, payload)))
+
 
     def on_init(self, eventobj: Event):
         """
@@ -148,7 +287,125 @@ class BCNode(GenericModel):
 
         :param Event event: The event instance.
         """
+        if self.metrics is not None:
+            self.metrics.mark_started()
         self.broadcast(ApplicationLayerMessageTypes.VOTE, vote=self.vote)
+        self.fill_window()
+
+    def proposal(self, instance):
+        """
+        Returns the vote of the node in an instance, a random bit unless a front-end such as Batching replaces it.
+
+        :param int instance: Id of the instance.
+        """
+        return random.choice([0, 1])
+
+    def on_decision(self, instance, decision):
+        """
+        Called once the node finished an instance, does nothing unless a front-end such as Batching replaces it.
+
+        :param int instance: Id of the instance.
+        :param decision: The final decision, None on a tie.
+        """
+
+    def extend_instances(self, count):
+        """
+        Raises the number of instances the node runs and opens those the window reaches, from the node's own thread.
+
+        :param int count: The new number of instances.
+        """
+        self.instance_count = max(self.instance_count, count)
+        self.fill_window()
+
+    def open_instance(self, instance):
+        """
+        Creates the state of an instance with the proposal of the node and broadcasts that vote.
+
+        :param int instance: Id of the instance.
+        :return: The ConsensusInstance.
+        """
+        state = self.instances[instance] = ConsensusInstance(instance, self.proposal(instance))
+        self.broadcast(ApplicationLayerMessageTypes.VOTE, vote=state.vote, instance=instance)
+        return state
+
+    def fill_window(self):
+        """
+        Opens every instance of the window that is neither open nor finished and handles the messages that waited
+        for it.
+        """
+        end = min(self.low_watermark + instance_window, self.instance_count)
+        for instance in range(max(1, self.low_watermark), end):
+            if instance in self.instances or instance in self.finished:
+                continue
+            self.open_instance(instance)
+            for event, hdr in self.deferred.pop(instance, ()):
+                self.handle_event(event, hdr)
+        self.start_instance_timer()
+
+    def start_instance_timer(self):
+        """
+        Starts the instance timer for low_watermark in a multi-instance run, unless it already runs for it.
+        """
+        if self.instance_count <= 1 or instance_timeout is None or self.low_watermark >= self.instance_count:
+            if self._expiry is not None:
+                self._expiry.cancel()
+                self._expiry = self._expiry_instance = None
+            return
+        if self._expiry_instance == self.low_watermark:
+            return
+        if self._expiry is not None:
+            self._expiry.cancel()
+        self._expiry_instance = self.low_watermark
+        self._expiry = threading.Timer(instance_timeout, self.send_self,
+                                       [Event(self, _EXPIRE, self.low_watermark)])
+        self._expiry.daemon = True
+        self._expiry.start()
+
+    def on_expire(self, eventobj: Event):
+        """
+        Skips the instance the timer was started for if it still holds the window, with no decision.
+        """
+        if eventobj.eventcontent != self._expiry_instance:
+            return
+        self._expiry = self._expiry_instance = None
+        instance = self.instances.get(eventobj.eventcontent)
+        if eventobj.eventcontent != self.low_watermark or instance is None or instance.flag:
+            self.start_instance_timer()
+            return
+        del self.instances[instance.instance]
+        print(f'{BRIGHT_WHITE}Node : {self.name} skipped instance : {instance.instance}{RESET}\n')
+        instance.flag = True
+        instance.final_decision = None
+        self.skipped_count += 1
+        self.finish(instance)
+
+    def finish(self, instance):
+        """
+        Records the decision of a finished instance, moves the window past it and removes its state once the node
+        sent its own DECIDE.
+
+        :param ConsensusInstance instance: The finished instance.
+        """
+        self.decisions[instance.instance] = instance.final_decision
+        if len(self.decisions) > DECISION_HISTORY:
+            self.decisions.popitem(last=False)
+        self.decided_count += 1
+        self.finished.add(instance.instance)
+        while self.low_watermark in self.finished:
+            self.finished.remove(self.low_watermark)
+            self.low_watermark += 1
+        self.collect(instance)
+        self.on_decision(instance.instance, instance.final_decision)
+        self.fill_window()
+
+    def collect(self, instance):
+        """
+        Removes the state of an instance that is finished and for which the node sent its DECIDE.
+
+        :param ConsensusInstance instance: The instance.
+        """
+        if instance.flag and instance.state == State.DECIDED:
+            self.instances.pop(instance.instance, None)
 
     def on_vote(self, event):
         """
@@ -156,17 +413,17 @@ class BCNode(GenericModel):
 
         :param Event event: The event containing the vote.
         """
-        if self.state == State.DECIDED:
+        if self.instances[event.instance].state == State.DECIDED:
             return
 
         if self.is_byzantine:
             # send different votes to different processes randomly from byzantine node
             vote = random.choice([0, 1])
             #event = ModEvent(ApplicationLayerMessageTypes.ECHO, self, vote=vote)
-            self.broadcast(ApplicationLayerMessageTypes.ECHO, vote=vote)
+            self.broadcast(ApplicationLayerMessageTypes.ECHO, vote=vote, instance=event.instance)
         else:
             # Echo the current node's vote to other processes
-            self.broadcast(ApplicationLayerMessageTypes.ECHO, vote=event.vote)
+            self.broadcast(ApplicationLayerMessageTypes.ECHO, vote=event.vote, instance=event.instance)
 
     def on_echo(self, event):
         """
@@ -177,55 +434,73 @@ class BCNode(GenericModel):
         # Count the echoes come from other nodes and decide if there is a majority
 
         global byzantine_count
-        self.echo_counts[event.vote] += 1
-        for vote, count in self.echo_counts.items():
-            if count > (len(self.nodes) + byzantine_count) / 2:
-                self.decide(vote)
+        instance = self.instances[event.instance]
+        count = instance.echo_tally.add(event.source, event.vote)
+        if count > (len(self.nodes) + byzantine_count) / 2:
+            self.decide(event.vote, instance)
 
     def on_decide(self, event):
-        
-        if self.flag:
+
+        instance = self.instances[event.instance]
+        if instance.flag:
+            return
+        if not instance.decide_tally.add(event.source, event.vote):
             return
-        self.decide_counts[event.vote] += 1
-        self.num_of_decided += 1
+        instance.num_of_decided += 1
         majority_threshold = (len(self.nodes) - 1) // 2 + 1
-        if self.num_of_decided >= majority_threshold:
-            self.flag = True
+        if instance.num_of_decided >= majority_threshold:
+            instance.flag = True
             majority_decision = None
-            if self.decide_counts[1] > self.decide_counts[0]:
+            decide_counts = instance.decide_tally.counts
+            if decide_counts[1] > decide_counts[0]:
                 majority_decision = 1
-            elif self.decide_counts[1] < self.decide_counts[0]:
+            elif decide_counts[1] < decide_counts[0]:
                 majority_decision = 0
-            elif self.decide_counts[1] == self.decide_counts[0]:
+            elif decide_counts[1] == decide_counts[0]:
                 pass
-            print(f'{BRIGHT_WHITE}Node : {self.name} decided on value : {majority_decision}{RESET}\n')
-    
-    def decide(self, vote):
+            instance.final_decision = majority_decision
+            if self.metrics is not None and instance is self.first_instance:
+                self.metrics.mark_decided()
+            instance_note = f' in instance : {instance.instance}' if instance.instance else ''
+            print(f'{BRIGHT_WHITE}Node : {self.name} decided on value : {majority_decision}{instance_note}{RESET}\n')
+            if instance.instance > 0 and majority_decision is not None:
+                # A node whose echoes never reached a majority adopts the decision, so fewer of the nodes still
+                # waiting for its DECIDE depend on the instance timer
+                self.decide(majority_decision, instance)
+            self.finish(instance)
+
+    def decide(self, vote, instance=None):
         """
         Finalizes the decision based on the most common received vote.
 
         :param int vote: The vote that this node has decided upon.
+        :param ConsensusInstance instance: The instance, instance 0 by default.
         """
 
-        if self.state == State.DECIDED:
+        instance = self.first_instance if instance is None else instance
+        if instance.state == State.DECIDED:
             return
-        self.decided_value = vote
-        self.state = State.DECIDED
-        self.broadcast(ApplicationLayerMessageTypes.DECIDE, vote=vote)
+        instance.decided_value = vote
+        instance.state = State.DECIDED
+        self.broadcast(ApplicationLayerMessageTypes.DECIDE, vote=vote, instance=instance.instance)
+        self.collect(instance)
         return
-    
-    def broadcast(self, event_type, vote):
+
+    def broadcast(self, event_type, vote, instance=0):
         """
-        Sends an event to all other nodes.
+        Sends an event to all other nodes. Honest nodes send one ModEvent shared by all destinations, a Byzantine
+        node sends each destination its own random vote.
 
         :param EventType event_type: The type of the event to broadcast.
         :param int vote: The vote to be included in the broadcast, if applicable.
+        :param int instance: The consensus instance of the event.
         """
 
-        for component in self.nodes:
-            if component.name != self.name:
-                if self.is_byzantine:
-                    vote = random.choice([0, 1])
-                event = ModEvent(event_type, self, vote=vote)
-                msg = self.prepare_payload(event_type, component.name,event )
-                self.send_down(Event(self,EventTypes.MFRT,msg))
\ No newline at end of file
+        destinations = [component for component in self.nodes if component.name != self.name]
+        send = lambda destination, event: self.send_envelope(destination, event_type, event)
+        if self.is_byzantine:
+            equivocate(destinations, lambda destination: ModEvent(event_type, self.name, vote=random.choice([0, 1]), instance=instance), send)
+        else:
+            multicast(destinations, ModEvent(event_type, self.name, vote=vote, instance=instance), send)
+        if self.metrics is not None:
+            self.metrics.count_sent(event_type.value, len(self.nodes) - 1)
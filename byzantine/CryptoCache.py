@@ -0,0 +1,125 @@
+import threading
+from collections import OrderedDict
+
+# Number of (signer, value, signature) verification results remembered by each node
+VERIFIED_CACHE_SIZE = 4096
+
+
+class CryptoCache:
+    """
+    Per-node memoization of signing and verification.
+
+    All signature schemes are deterministic, so the signature of a value is computed once and reused. Verifier
+    objects are built once per signer, and verification results are kept in an LRU keyed by (signer, value, signature).
+
+    :param SignatureScheme scheme: The signature scheme of the nodes.
+    :param key: The private key of the node.
+    :param public_key_of: Callable returning the public key of a node id, called once per signer.
+    :param int verified_cache_size: Maximum number of remembered verification results.
+
+    Attributes:
+        sign_hits (int): Number of signatures served from the cache.
+        sign_misses (int): Number of signatures computed.
+        verify_hits (int): Number of verifications served from the cache.
+        verify_misses (int): Number of verifications computed.
+    """
+    def __init__(self, scheme, key, public_key_of, verified_cache_size=VERIFIED_CACHE_SIZE):
+        self.scheme = scheme
+        self.key = key
+        self.public_key_of = public_key_of
+        self.verified_cache_size = verified_cache_size
+        self.sign_hits = 0
+        self.sign_misses = 0
+        self.verify_hits = 0
+        self.verify_misses = 0
+        self._signer = scheme.signer(key)
+        self._signatures = {}
+        self._verifiers = {}
+        self._verified = OrderedDict()
+        self._lock = threading.Lock()
+
+    def sign(self, value):
+        """
+        Returns the signature of value, computing it on first use.
+
+        :param value: The value to sign, str values are UTF-8 encoded.
+        :return: The signature.
+        """
+        signature = self._signatures.get(value)
+        if signature is not None:
+            self.sign_hits += 1
+            return signature
+        self.sign_misses += 1
+        signature = self._signer(value.encode('utf-8') if isinstance(value, str) else value)
+        self._signatures[value] = signature
+        return signature
+
+    def verifier(self, node_id):
+        """
+        Returns the verifier of a signer, building it on first use.
+
+        :param int node_id: Id of the signer.
+        :return: A callable (data, signature) -> bool.
+        """
+        verifier = self._verifiers.get(node_id)
+        if verifier is None:
+            verifier = self.scheme.verifier(self.public_key_of(node_id))
+            self._verifiers[node_id] = verifier
+        return verifier
+
+    def verify(self, node_id, value, signature):
+        """
+        Verifies that signature is the signature of value by node_id.
+
+        :param int node_id: Id of the signer.
+        :param value: The signed value, str values are UTF-8 encoded.
+        :param bytes signature: The signature to verify.
+        :return: True if the signature is valid, False otherwise.
+        """
+        valid = self.lookup(node_id, value, signature)
+        if valid is not None:
+            return valid
+        self.verify_misses += 1
+        valid = self.verifier(node_id)(value.encode('utf-8') if isinstance(value, str) else value, signature)
+        self.remember(node_id, value, signature, valid)
+        return valid
+
+    def lookup(self, node_id, value, signature):
+        """
+        Returns the remembered verification result of a triple without verifying it.
+
+        :return: True, False, or None if the triple is not in the cache.
+        """
+        with self._lock:
+            valid = self._verified.get((node_id, value, signature))
+            if valid is not None:
+                self._verified.move_to_end((node_id, value, signature))
+                self.verify_hits += 1
+            return valid
+
+    def remember(self, node_id, value, signature, valid):
+        """
+        Stores a verification result computed elsewhere, e.g. by a :class:`BatchVerifier`.
+
+        :param int node_id: Id of the signer.
+        :param value: The signed value.
+        :param bytes signature: The verified signature.
+        :param bool valid: The verification result.
+        """
+        with self._lock:
+            self._verified[(node_id, value, signature)] = valid
+            if len(self._verified) > self.verified_cache_size:
+                self._verified.popitem(last=False)
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        :return: A dict of hit and miss counters.
+        """
+        return {
+            'sign_hits': self.sign_hits,
+            'sign_misses': self.sign_misses,
+            'verify_hits': self.verify_hits,
+            'verify_misses': self.verify_misses,
+        }
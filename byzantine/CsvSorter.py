@@ -1,15 +1,152 @@
-import pandas as pd
-
-def sort_and_group_csv(input_filename, output_filename):
-    # Load the data from CSV
-    df = pd.read_csv(input_filename)
-    
-    # Sorting by 'Pulse' and then by 'Source Node'
-    sorted_df = df.sort_values(by=['Source Node', 'Pulse'])
-    
-    # Save the sorted data back to a new CSV file
-    sorted_df.to_csv(output_filename, index=False)
-    print("Data has been sorted and saved to", output_filename)
-
-# Example usage
-sort_and_group_csv('ByzantineAuth.csv', 'SortedByzantineAuth.csv')
+import argparse
+import csv
+import heapq
+import os
+import tempfile
+from collections import Counter
+
+from BinaryTrace import parse_event_message
+
+DEFAULT_COLUMNS = ['Source Node', 'Pulse']
+# Number of rows held in memory while sorting
+DEFAULT_CHUNK_SIZE = 100000
+
+
+class TraceStatistics:
+    """
+    Message counts collected while a trace is streamed through :func:`sort_and_group_csv`.
+
+    Attributes:
+        rows (int): Number of data rows.
+        per_node (Counter): Number of messages per source node.
+        per_delivered_node (Counter): Number of messages per delivered node.
+        per_pulse (Counter): Number of messages per pulse, empty for traces without a Pulse column.
+        per_message_type (Counter): Number of messages per message type, the value for authenticated traces.
+    """
+    def __init__(self):
+        self.rows = 0
+        self.per_node = Counter()
+        self.per_delivered_node = Counter()
+        self.per_pulse = Counter()
+        self.per_message_type = Counter()
+
+    def add(self, row, columns):
+        """
+        Counts one data row.
+
+        :param list row: The CSV row.
+        :param dict columns: Column name to index mapping of the trace.
+        """
+        self.rows += 1
+        self.per_node[row[columns['Source Node']]] += 1
+        if 'Delivered Node' in columns:
+            self.per_delivered_node[row[columns['Delivered Node']]] += 1
+        if 'Pulse' in columns:
+            self.per_pulse[row[columns['Pulse']]] += 1
+        message = row[columns['Message']]
+        parsed = parse_event_message(message)
+        self.per_message_type[parsed[0] if parsed else message] += 1
+
+    def print_summary(self):
+        print(f"Rows: {self.rows}")
+        for title, counter in [("Source node", self.per_node), ("Delivered node", self.per_delivered_node),
+                               ("Pulse", self.per_pulse), ("Message type", self.per_message_type)]:
+            if counter:
+                print(f"{title}:")
+                for key, count in sorted(counter.items(), key=lambda item: _sort_field(item[0])):
+                    print(f"\t{key}: {count}")
+
+
+def _sort_field(field):
+    # Numeric fields sort numerically and before any text field
+    try:
+        return (0, int(field), '')
+    except ValueError:
+        return (1, 0, field)
+
+
+def _write_run(rows, directory):
+    run = tempfile.NamedTemporaryFile(mode='w', newline='', suffix='.csv', dir=directory, delete=False)
+    with run:
+        csv.writer(run).writerows(rows)
+    return run.name
+
+
+def _read_run(filename):
+    with open(filename, newline='') as file:
+        yield from csv.reader(file)
+
+
+def sort_and_group_csv(input_filename, output_filename, columns=None, chunk_size=DEFAULT_CHUNK_SIZE, tmp_dir=None):
+    """
+    Sorts a trace by the given columns with an external merge sort and counts its messages in the same pass.
+
+    At most chunk_size rows are held in memory: sorted runs are spilled to temporary files and merged into the
+    output. The sort is stable, numeric fields are compared as numbers.
+
+    :param str input_filename: The CSV trace to sort.
+    :param str output_filename: The sorted CSV file to write.
+    :param list columns: Names of the columns to sort by, defaults to Source Node and Pulse.
+    :param int chunk_size: Maximum number of rows kept in memory.
+    :param str tmp_dir: Directory of the temporary runs, defaults to the system temporary directory.
+    :return: The :class:`TraceStatistics` of the trace.
+    """
+    columns = columns or DEFAULT_COLUMNS
+    statistics = TraceStatistics()
+    runs = []
+    with open(input_filename, newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        indices = {name: index for index, name in enumerate(header)}
+        missing = [column for column in columns if column not in indices]
+        if missing:
+            raise ValueError(f"{input_filename} has no column {', '.join(missing)}")
+        key_indices = [indices[column] for column in columns]
+
+        def key(row):
+            return tuple(_sort_field(row[index]) for index in key_indices)
+
+        chunk = []
+        try:
+            for row in reader:
+                statistics.add(row, indices)
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    chunk.sort(key=key)
+                    runs.append(_write_run(chunk, tmp_dir))
+                    chunk = []
+            chunk.sort(key=key)
+
+            with open(output_filename, mode='w', newline='') as output:
+                writer = csv.writer(output)
+                writer.writerow(header)
+                if runs:
+                    runs.append(_write_run(chunk, tmp_dir))
+                    chunk = []
+                    writer.writerows(heapq.merge(*[_read_run(run) for run in runs], key=key))
+                else:
+                    writer.writerows(chunk)
+        finally:
+            for run in runs:
+                os.remove(run)
+    return statistics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sort a Byzantine message trace and print its message counts.")
+    parser.add_argument('input', nargs='?', default='ByzantineAuth.csv')
+    parser.add_argument('output', nargs='?', default='SortedByzantineAuth.csv')
+    parser.add_argument('--by', nargs='+', default=DEFAULT_COLUMNS, metavar='COLUMN',
+                        help="columns to sort by (default: %(default)s)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="maximum number of rows held in memory (default: %(default)s)")
+    parser.add_argument('--tmp-dir', default=None, help="directory for temporary sorted runs")
+    args = parser.parse_args()
+
+    statistics = sort_and_group_csv(args.input, args.output, args.by, args.chunk_size, args.tmp_dir)
+    print("Data has been sorted and saved to", args.output)
+    statistics.print_summary()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import argparse
+import heapq
+import random
+import time
+import networkx as nx
+import ByzantineConsensus
+from ByzantineConsensus import State, build_nodes
+
+
+class EngineInbox:
+    """
+    Stand-in for a node's Queue that schedules every put as a delivery event of the engine.
+
+    :param DiscreteEventEngine engine: The engine delivering the events.
+    :param BCNode node: The node owning the inbox.
+    """
+    __slots__ = ('engine', 'node')
+
+    def __init__(self, engine, node):
+        self.engine = engine
+        self.node = node
+
+    def put(self, event):
+        self.engine.schedule(self.node, event)
+
+
+class DiscreteEventEngine:
+    """
+    Single-threaded, deterministic discrete-event driver for ByzantineConsensus.BCNode.
+
+    Messages are (virtual_time, seq, node, event) entries of a priority queue. The engine pops them in order and
+    calls the node's handle_event, so the same on_vote/on_echo/on_decide logic runs without threads or timeouts,
+    and the run ends as soon as no message is in flight. Latencies and all node randomness come from one seeded
+    random.Random, so the same seed always gives the same run.
+
+    :param int seed: Seed of the engine's random generator.
+    :param float min_latency: Minimum message latency in virtual time units.
+    :param float max_latency: Maximum message latency, latencies are uniform in [min_latency, max_latency].
+
+    Attributes:
+        now (float): The current virtual time.
+        events_processed (int): Number of delivered messages.
+    """
+    def __init__(self, seed=0, min_latency=1.0, max_latency=1.0):
+        self.rng = random.Random(seed)
+        self.min_latency = min_latency
+        self.max_latency = max_latency
+        self.now = 0.0
+        self.events_processed = 0
+        self._seq = 0
+        self._heap = []
+
+    def schedule(self, node, event, delay=None):
+        """
+        Schedules the delivery of an event to a node.
+
+        :param BCNode node: The destination node.
+        :param Event event: The event to deliver.
+        :param float delay: Virtual time until delivery, a random latency by default.
+        """
+        if delay is None:
+            if self.min_latency == self.max_latency:
+                delay = self.min_latency
+            else:
+                delay = self.rng.uniform(self.min_latency, self.max_latency)
+        heapq.heappush(self._heap, (self.now + delay, self._seq, node, event))
+        self._seq += 1
+
+    def attach(self, nodes):
+        """
+        Replaces the queues of the nodes with inboxes of this engine.
+
+        :param nodes: The nodes to drive.
+        """
+        for node in nodes:
+            node.queue = EngineInbox(self, node)
+
+    def run(self, nodes, max_events=None):
+        """
+        Starts every node and delivers messages until none is in flight.
+
+        :param list nodes: The nodes to drive, started in this order.
+        :param int max_events: Stop after this many deliveries (optional).
+        :return: The number of delivered messages.
+        """
+        self.attach(nodes)
+        for node in nodes:
+            node.send_init()
+        heap = self._heap
+        while heap:
+            if max_events is not None and self.events_processed >= max_events:
+                break
+            self.now, _, node, event = heapq.heappop(heap)
+            node.handle_event(event)
+            self.events_processed += 1
+        return self.events_processed
+
+
+class SimulationResult:
+    """
+    Outcome of :func:`run_simulation`.
+
+    Attributes:
+        decisions (dict): Decided value of every node id, None for undecided nodes.
+        byzantine_ids (set): Ids of the Byzantine nodes.
+        events (int): Number of delivered messages.
+        virtual_time (float): Virtual time of the last delivery.
+        wall_time (float): Seconds spent in the engine.
+    """
+    def __init__(self, decisions, byzantine_ids, events, virtual_time, wall_time):
+        self.decisions = decisions
+        self.byzantine_ids = byzantine_ids
+        self.events = events
+        self.virtual_time = virtual_time
+        self.wall_time = wall_time
+
+    def honest_decisions(self):
+        return {node_id: value for node_id, value in self.decisions.items() if node_id not in self.byzantine_ids}
+
+    def agreement(self):
+        """
+        Returns True if every honest node decided and all decided the same value.
+        """
+        values = set(self.honest_decisions().values())
+        return len(values) == 1 and None not in values
+
+
+def run_simulation(node_count=None, byzantine_ids=(), seed=0, graph=None, min_latency=1.0, max_latency=1.0,
+                   max_events=None):
+    """
+    Runs one Bracha-style consensus on the discrete-event engine.
+
+    :param int node_count: Number of nodes of a complete graph, ignored if graph is given.
+    :param byzantine_ids: Ids of the Byzantine nodes.
+    :param int seed: Seed of the run.
+    :param nx.Graph graph: The topology (optional).
+    :param float min_latency: Minimum message latency.
+    :param float max_latency: Maximum message latency.
+    :param int max_events: Stop after this many deliveries (optional).
+    :return: The :class:`SimulationResult`.
+    """
+    if graph is None:
+        graph = nx.complete_graph(node_count)
+    byzantine_ids = set(byzantine_ids)
+    ByzantineConsensus.byzantine_count = len(byzantine_ids)
+    engine = DiscreteEventEngine(seed, min_latency, max_latency)
+    nodes = build_nodes(graph, byzantine_ids, engine.rng)
+    start = time.perf_counter()
+    engine.run(list(nodes.values()), max_events)
+    wall_time = time.perf_counter() - start
+    decisions = {node_id: node.decided_value if node.state == State.DECIDED else None
+                 for node_id, node in nodes.items()}
+    return SimulationResult(decisions, byzantine_ids, engine.events_processed, engine.now, wall_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Bracha-style consensus on the discrete-event engine.")
+    parser.add_argument('-n', '--nodes', type=int, default=5)
+    parser.add_argument('-b', '--byzantine', type=int, nargs='*', default=[2], help="ids of the Byzantine nodes")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--min-latency', type=float, default=1.0)
+    parser.add_argument('--max-latency', type=float, default=1.0)
+    args = parser.parse_args()
+
+    result = run_simulation(args.nodes, args.byzantine, args.seed, min_latency=args.min_latency,
+                            max_latency=args.max_latency)
+    print(f"Delivered {result.events} messages in {result.wall_time:.3f}s, virtual time {result.virtual_time:.2f}")
+    print(f"Honest agreement: {result.agreement()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import argparse
+import time
+import numpy as np
+from BinaryTrace import VALUE_CODES, VALUE_NAMES
+
+# Decision codes besides the value codes of BinaryTrace.VALUE_CODES
+UNDECIDED = -1
+NO_MAJORITY = -2
+# Node ids are bits of a uint64 signer set
+MAX_NODES = 64
+
+
+class EIGLevel:
+    """
+    The valid signature chains of one pulse, one array entry per chain.
+
+    A chain is identified by its signer path. Only what the nodes look at is stored: the set of signers as a bitmask,
+    the last signer, who broadcast the chain, and the value the chain carries.
+
+    Attributes:
+        signers (np.ndarray): uint64 bitmask of the signers of every chain.
+        last (np.ndarray): Id of the last signer of every chain.
+        values (np.ndarray): Value code carried by every chain.
+    """
+    __slots__ = ('signers', 'last', 'values')
+
+    def __init__(self, signers, last, values):
+        self.signers = signers
+        self.last = last
+        self.values = values
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def members(self, node_count):
+        """
+        Returns a (chains x nodes) boolean matrix, True where the node signed the chain.
+        """
+        return ((self.signers[:, None] >> np.arange(node_count, dtype=np.uint64)) & np.uint64(1)).astype(bool)
+
+
+class EIGResult:
+    """
+    Outcome of :func:`run_eig`.
+
+    Attributes:
+        values_q (np.ndarray): (nodes x pulses x 2) counts of the REJECT and ACCEPT values every node stored per pulse.
+        final_decisions (np.ndarray): Decision code of every node, UNDECIDED if the node never decided and
+            NO_MAJORITY on a tie, which the object-level node breaks by arrival order.
+        messages (np.ndarray): Number of messages sent per pulse.
+        chains (np.ndarray): Number of valid chains per pulse.
+        byzantine (np.ndarray): Boolean mask of the Byzantine nodes.
+        wall_time (float): Seconds spent computing.
+    """
+    def __init__(self, values_q, final_decisions, messages, chains, byzantine, wall_time):
+        self.values_q = values_q
+        self.final_decisions = final_decisions
+        self.messages = messages
+        self.chains = chains
+        self.byzantine = byzantine
+        self.wall_time = wall_time
+
+    def values_q_of(self, node_id):
+        """
+        Returns the values_q of a node in the form of the object-level node, as value name counts.
+
+        :param int node_id: Id of the node.
+        :return: A dict of pulse to a dict of value name to count.
+        """
+        return {pulse: {VALUE_NAMES[code]: int(count) for code, count in enumerate(counts) if count}
+                for pulse, counts in enumerate(self.values_q[node_id])}
+
+    def decision_of(self, node_id):
+        """
+        Returns the final decision of a node as a value name, None if it did not decide and "TIE" on a tie.
+        """
+        code = int(self.final_decisions[node_id])
+        if code == UNDECIDED:
+            return None
+        if code == NO_MAJORITY:
+            return "TIE"
+        return VALUE_NAMES[code]
+
+
+def _binomial(rng, counts):
+    return rng.binomial(counts, 0.5)
+
+
+def run_eig(num_nodes, k, byzantine_nodes, general=0, seed=None, forgeable=False):
+    """
+    Computes the outcome of ByzantineAuth.BANode's authenticated agreement without sending messages.
+
+    The object-level nodes relay every valid chain of pulse p < k to all other nodes with their signature appended,
+    so pulse p carries one chain per signer path of p + 1 distinct nodes starting at the general. This engine keeps
+    those paths in one array per pulse and derives every node's values_q from counts over them:
+
+    - A chain is valid iff its signers are distinct, so a node relaying a chain it already signed sends nothing new.
+    - A Byzantine node stores and relays a random value. Signatures bind the value, so the relayed chain is valid only
+      if the random value equals the received one. With forgeable=True, which models SimulatedScheme("identity"),
+      every chain stays valid and carries the random value.
+    - decide() keeps the most common value of the last pulse if it was received at least (n - 1) // 2 + 1 times.
+
+    Signatures are not computed, and the chains of the last pulse are only counted, never materialized.
+
+    :param int num_nodes: Number of nodes.
+    :param int k: Number of pulses.
+    :param byzantine_nodes: Ids of the Byzantine nodes.
+    :param int general: Id of the general.
+    :param int seed: Seed of the Byzantine choices (optional).
+    :param bool forgeable: Whether Byzantine nodes can change the value of a chain without invalidating it.
+    :return: The :class:`EIGResult`.
+    """
+    if num_nodes > MAX_NODES:
+        raise ValueError(f"At most {MAX_NODES} nodes are supported, got {num_nodes}")
+    n = num_nodes
+    rng = np.random.default_rng(seed)
+    byzantine = np.zeros(n, dtype=bool)
+    byzantine[list(byzantine_nodes)] = True
+    accept = VALUE_CODES['ACCEPT']
+    general_value = rng.integers(0, 2) if byzantine[general] else accept
+
+    values_q = np.zeros((n, k + 1, 2), dtype=np.int64)
+    messages = np.zeros(k + 1, dtype=np.int64)
+    chains = np.zeros(k + 1, dtype=np.int64)
+    messages[0] = n - 1
+    start = time.perf_counter()
+
+    level = EIGLevel(np.array([1 << general], dtype=np.uint64), np.array([general]), np.array([general_value], dtype=np.int8))
+    # last_counts[x, v]: valid chains of the pulse with last signer x and value v
+    last_counts = np.zeros((n, 2), dtype=np.int64)
+    last_counts[general, general_value] = 1
+    for pulse in range(k + 1):
+        totals = last_counts.sum(axis=0)
+        chains[pulse] = totals.sum()
+        # Every node except the last signer receives a chain, an honest node stores its value
+        values_q[~byzantine, pulse] = totals - last_counts[~byzantine]
+        received = chains[pulse] - last_counts.sum(axis=1)
+        if pulse == k:
+            ones = _binomial(rng, received[byzantine])
+            values_q[byzantine, pulse, 1] = ones
+            values_q[byzantine, pulse, 0] = received[byzantine] - ones
+            break
+        messages[pulse + 1] = chains[pulse] * (n - 1) * (n - 1)
+
+        members = level.members(n)
+        # A Byzantine node that already signed a chain stores a random value and relays an invalid chain
+        signed = members.sum(axis=0) - last_counts.sum(axis=1)
+        ones = _binomial(rng, signed[byzantine])
+        values_q[byzantine, pulse, 1] = ones
+        values_q[byzantine, pulse, 0] = signed[byzantine] - ones
+
+        if pulse + 1 < k:
+            level, child_counts, stored = _expand(rng, level, members, byzantine, forgeable)
+        else:
+            level, child_counts, stored = None, *_count_children(rng, level, members, byzantine, forgeable)
+        values_q[byzantine, pulse] += stored[byzantine]
+        last_counts = child_counts
+
+    final_decisions = np.full(n, UNDECIDED, dtype=np.int8)
+    last_pulse = values_q[:, k]
+    best = last_pulse.max(axis=1)
+    threshold = (n - 1) // 2 + 1
+    decided = best >= threshold
+    final_decisions[decided] = np.where(last_pulse[decided, 1] > last_pulse[decided, 0], 1,
+                                        np.where(last_pulse[decided, 1] < last_pulse[decided, 0], 0, NO_MAJORITY))
+    return EIGResult(values_q, final_decisions, messages, chains, byzantine, time.perf_counter() - start)
+
+
+def _relays(rng, values, relayers, byzantine, forgeable):
+    # The value every relayer stores and relays, and whether the relayed chain is valid
+    flipped = byzantine[relayers] & (rng.random(relayers.shape[0]) < 0.5)
+    relayed = values ^ flipped.astype(np.int8)
+    valid = np.ones(relayers.shape[0], dtype=bool) if forgeable else ~flipped
+    return relayed, valid
+
+
+def _expand(rng, level, members, byzantine, forgeable):
+    """
+    Builds the next pulse's chains, one per chain and relayer that has not signed it.
+
+    :return: The next :class:`EIGLevel`, its (nodes x 2) last signer counts and the (nodes x 2) counts of the values
+        stored by the relayers.
+    """
+    n = byzantine.shape[0]
+    parents, relayers = np.nonzero(~members)
+    relayed, valid = _relays(rng, level.values[parents], relayers, byzantine, forgeable)
+    stored = np.zeros((n, 2), dtype=np.int64)
+    np.add.at(stored, (relayers, relayed), 1)
+    parents, relayers, relayed = parents[valid], relayers[valid], relayed[valid]
+    signers = level.signers[parents] | (np.uint64(1) << relayers.astype(np.uint64))
+    child_counts = np.zeros((n, 2), dtype=np.int64)
+    np.add.at(child_counts, (relayers, relayed), 1)
+    return EIGLevel(signers, relayers, relayed), child_counts, stored
+
+
+def _count_children(rng, level, members, byzantine, forgeable):
+    """
+    Counts the last pulse's chains per relayer and value without building them.
+
+    :return: The (nodes x 2) last signer counts and the (nodes x 2) counts of the values stored by the relayers.
+    """
+    # unsigned[r, v]: chains with value v that node r has not signed, each relayed once by r
+    unsigned = np.stack([(~members & (level.values == value)[:, None]).sum(axis=0) for value in (0, 1)], axis=1)
+    stored = unsigned.copy()
+    child_counts = unsigned.copy()
+    # A Byzantine relayer keeps the value of each chain with probability 1/2 and flips it otherwise
+    kept = _binomial(rng, unsigned[byzantine])
+    flipped = unsigned[byzantine] - kept
+    stored[byzantine] = kept + flipped[:, ::-1]
+    child_counts[byzantine] = stored[byzantine] if forgeable else kept
+    return child_counts, stored
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute the authenticated agreement outcome on an EIG tree.")
+    parser.add_argument('-n', '--nodes', type=int, default=4)
+    parser.add_argument('-k', '--pulses', type=int, default=1)
+    parser.add_argument('-b', '--byzantine', type=int, nargs='*', default=[1], help="ids of the Byzantine nodes")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--forgeable', action='store_true', help="Byzantine nodes can change values undetected")
+    args = parser.parse_args()
+
+    result = run_eig(args.nodes, args.pulses, args.byzantine, seed=args.seed, forgeable=args.forgeable)
+    print(f"{int(result.messages.sum())} messages, {int(result.chains.sum())} valid chains in {result.wall_time:.3f}s")
+    for node_id in range(args.nodes):
+        print(f"Node {node_id} final decision: {result.decision_of(node_id)}")
+
+
+if __name__ == "__main__":
+    main()
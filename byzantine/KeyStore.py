@@ -0,0 +1,198 @@
+import argparse
+import mmap
+import os
+import struct
+import threading
+from multiprocessing import Pool
+from Crypto.Hash import SHAKE256
+from Crypto.PublicKey import RSA
+
+MAGIC = b'BZKS'
+# magic, version, flags, number of keys, key size in bits, seed length, followed by the seed
+HEADER = struct.Struct('<4sBBxxIIH')
+# offset and length of one DER encoded key
+INDEX_ENTRY = struct.Struct('<QI')
+VERSION = 2
+# Flag of a keystore whose keys were derived from the seed stored in it
+SEEDED = 1
+DEFAULT_BITS = 2048
+# Environment variable naming the keystore used by the auth nodes
+KEYSTORE_ENV = 'BYZANTINE_KEYSTORE'
+
+_default_keystore = None
+_default_keystore_lock = threading.Lock()
+
+
+def derive_key(node_id, bits=DEFAULT_BITS, seed=b''):
+    """
+    Deterministically derives the RSA key of a node from a seed.
+
+    The random source of the key generation is a SHAKE256 stream over the seed and the node id, so the same
+    (seed, node_id, bits) always gives the same key.
+
+    :param int node_id: Id of the node.
+    :param int bits: The key size.
+    :param bytes seed: The keystore seed.
+    :return: The RSA key.
+    """
+    stream = SHAKE256.new(seed + struct.pack('<Q', node_id))
+    return RSA.generate(bits, randfunc=stream.read)
+
+
+def _generate_key_der(args):
+    node_id, bits, seed = args
+    key = derive_key(node_id, bits, seed) if seed is not None else RSA.generate(bits)
+    return key.export_key(format='DER')
+
+
+def generate_keystore(filename, count, bits=DEFAULT_BITS, processes=None, seed=None):
+    """
+    Generates count RSA keys on all cores and writes them to a keystore file.
+
+    :param str filename: The keystore file to write.
+    :param int count: Number of keys, key i belongs to node i.
+    :param int bits: The key size.
+    :param int processes: Number of worker processes, defaults to the number of cores.
+    :param bytes seed: Derive the keys from this seed with :func:`derive_key` instead of generating random keys.
+    """
+    with Pool(processes) as pool:
+        keys = pool.map(_generate_key_der, [(node_id, bits, seed) for node_id in range(count)], chunksize=1)
+
+    seed_bytes = seed if seed is not None else b''
+    offset = HEADER.size + len(seed_bytes) + INDEX_ENTRY.size * count
+    index = []
+    for der in keys:
+        index.append(INDEX_ENTRY.pack(offset, len(der)))
+        offset += len(der)
+    temporary = f"{filename}.tmp"
+    with open(temporary, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, SEEDED if seed is not None else 0, count, bits, len(seed_bytes)))
+        file.write(seed_bytes)
+        file.writelines(index)
+        file.writelines(keys)
+    os.replace(temporary, filename)
+
+
+class KeyStore:
+    """
+    Read-only view of a keystore file written by :func:`generate_keystore`.
+
+    The file is memory mapped and a key is only parsed the first time a node asks for it. If the stored keys were
+    derived from a seed, nodes whose id is not in the file get a key derived from that same seed with
+    :func:`derive_key`. A keystore of random keys has no key for them.
+
+    :param str filename: The keystore file.
+    :param bytes seed: Seed of the keys derived for ids beyond the stored keys, the seed stored in the file by default.
+
+    Attributes:
+        seed (bytes): Seed of the keys beyond the stored keys, None if there are no such keys.
+    """
+    def __init__(self, filename, seed=None):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, flags, self.count, self.bits, seed_length = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{filename} is not a version {VERSION} keystore")
+        stored_seed = self._map[HEADER.size:HEADER.size + seed_length] if flags & SEEDED else None
+        self._index = HEADER.size + seed_length
+        self.seed = seed if seed is not None else stored_seed
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def key(self, node_id):
+        """
+        Returns the RSA key of a node.
+
+        :param int node_id: Id of the node.
+        :return: The RSA key.
+        """
+        key = self._keys.get(node_id)
+        if key is not None:
+            return key
+        if 0 <= node_id < self.count:
+            offset, length = INDEX_ENTRY.unpack_from(self._map, self._index + INDEX_ENTRY.size * node_id)
+            key = RSA.import_key(self._map[offset:offset + length])
+        elif self.seed is not None:
+            key = derive_key(node_id, self.bits, self.seed)
+        else:
+            raise ValueError(f"{self.filename} holds {self.count} random keys and none for node {node_id}")
+        with self._lock:
+            return self._keys.setdefault(node_id, key)
+
+    def close(self):
+        """
+        Unmaps and closes the keystore file.
+        """
+        self._map.close()
+        self._file.close()
+
+
+def set_default_keystore(keystore):
+    """
+    Sets the keystore used by :func:`node_key`.
+
+    :param keystore: A :class:`KeyStore`, the path of a keystore file, or None to generate fresh keys.
+    """
+    global _default_keystore
+    if isinstance(keystore, str):
+        keystore = KeyStore(keystore)
+    _default_keystore = keystore
+
+
+def default_keystore():
+    """
+    Returns the keystore used by :func:`node_key`, opening the file named by BYZANTINE_KEYSTORE on first use.
+
+    :return: The default :class:`KeyStore` or None.
+    """
+    global _default_keystore
+    if _default_keystore is None and os.environ.get(KEYSTORE_ENV):
+        with _default_keystore_lock:
+            if _default_keystore is None:
+                _default_keystore = KeyStore(os.environ[KEYSTORE_ENV])
+    return _default_keystore
+
+
+def node_key(node_id, bits=DEFAULT_BITS):
+    """
+    Returns the RSA key of a node, from the default keystore if there is one.
+
+    :param int node_id: Id of the node.
+    :param int bits: Size of the key generated when there is no keystore.
+    :return: The RSA key.
+    """
+    keystore = default_keystore()
+    if keystore is None:
+        return RSA.generate(bits)
+    return keystore.key(node_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate RSA keys for the authenticated Byzantine agreement nodes.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    generate = commands.add_parser('generate', help="generate a keystore file")
+    generate.add_argument('output')
+    generate.add_argument('-n', '--count', type=int, required=True, help="number of keys")
+    generate.add_argument('--bits', type=int, default=DEFAULT_BITS)
+    generate.add_argument('-j', '--processes', type=int, default=None, help="worker processes (default: all cores)")
+    generate.add_argument('--seed', default=None, help="derive the keys deterministically from this seed")
+    info = commands.add_parser('info', help="describe a keystore file")
+    info.add_argument('input')
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        seed = args.seed.encode('utf-8') if args.seed is not None else None
+        generate_keystore(args.output, args.count, args.bits, args.processes, seed)
+        print(f"Generated {args.count} RSA-{args.bits} keys in {args.output}")
+    else:
+        keystore = KeyStore(args.input)
+        print(f"{args.input}: {len(keystore)} RSA-{keystore.bits} keys, {'seeded' if keystore.seed is not None else 'random'}")
+        keystore.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import struct
+from collections import namedtuple
+from BinaryTrace import MESSAGE_TYPE_CODES, MESSAGE_TYPE_NAMES, VALUE_CODES, VALUE_NAMES, NO_VALUE
+from SignatureChain import LINKED, LinkedSignatureChain
+
+VOTE = MESSAGE_TYPE_CODES['VOTE']
+ECHO = MESSAGE_TYPE_CODES['ECHO']
+DECIDE = MESSAGE_TYPE_CODES['DECIDE']
+INIT = MESSAGE_TYPE_CODES['INIT']
+AUTH = MESSAGE_TYPE_CODES['AUTH']
+
+# message type, vote, source node
+CONSENSUS_RECORD = struct.Struct('<BbI')
+# message type, vote, source node, consensus instance
+INSTANCE_RECORD = struct.Struct('<BbII')
+# value, pulse, number of signers
+AUTH_HEADER = struct.Struct('<bHH')
+# signer, signature length, followed by the signature
+AUTH_LINK = struct.Struct('<IH')
+
+
+class ConsensusMessage:
+    """
+    Compact message of the echo consensus: an int-coded message type, the id of the sending node and the vote.
+
+    Messages are immutable by convention, since a broadcast delivers the same object to every destination. They pickle
+    to their fields and :meth:`encode` to a fixed CONSENSUS_RECORD, which needs numeric node ids. Thread based nodes
+    have string names, decoded messages carry the id as an int.
+
+    :param int kind: The message type code, see BinaryTrace.MESSAGE_TYPE_CODES.
+    :param source: Id or name of the sending node.
+    :param int vote: The vote, if any.
+    """
+    __slots__ = ('kind', 'source', 'vote')
+
+    def __init__(self, kind, source, vote=None):
+        self.kind = kind
+        self.source = source
+        self.vote = vote
+
+    @classmethod
+    def from_fields(cls, kind, source, vote=None):
+        """
+        Builds a message of this class from the fields of the base class, bypassing a subclass constructor.
+        """
+        message = cls.__new__(cls)
+        message.kind = kind
+        message.source = source
+        message.vote = vote
+        return message
+
+    @property
+    def message_type(self):
+        """
+        Name of the message type, e.g. "VOTE".
+        """
+        return MESSAGE_TYPE_NAMES[self.kind]
+
+    def encode(self):
+        """
+        :return: The CONSENSUS_RECORD of the message.
+        """
+        return CONSENSUS_RECORD.pack(self.kind, NO_VALUE if self.vote is None else self.vote, int(self.source))
+
+    @classmethod
+    def decode(cls, buffer, offset=0):
+        """
+        Decodes a CONSENSUS_RECORD.
+
+        :param buffer: The bytes holding the record.
+        :param int offset: Offset of the record in buffer.
+        :return: The message.
+        """
+        kind, vote, source = CONSENSUS_RECORD.unpack_from(buffer, offset)
+        return cls.from_fields(kind, source, None if vote == NO_VALUE else vote)
+
+    def __reduce__(self):
+        return (self.__class__.from_fields, (self.kind, self.source, self.vote))
+
+    def __eq__(self, other):
+        return isinstance(other, ConsensusMessage) and \
+            (self.kind, self.source, self.vote) == (other.kind, other.source, other.vote)
+
+    def __hash__(self):
+        return hash((self.kind, self.source, self.vote))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.message_type}, source={self.source}, vote={self.vote})"
+
+
+class InstanceMessage(ConsensusMessage):
+    """
+    ConsensusMessage tagged with the consensus instance it belongs to, for nodes running many instances at once.
+    Encodes to a fixed INSTANCE_RECORD.
+
+    :param int kind: The message type code.
+    :param source: Id or name of the sending node.
+    :param int vote: The vote, if any.
+    :param int instance: Id of the consensus instance.
+    """
+    __slots__ = ('instance',)
+
+    def __init__(self, kind, source, vote=None, instance=0):
+        ConsensusMessage.__init__(self, kind, source, vote)
+        self.instance = instance
+
+    @classmethod
+    def from_fields(cls, kind, source, vote=None, instance=0):
+        message = super().from_fields(kind, source, vote)
+        message.instance = instance
+        return message
+
+    def encode(self):
+        """
+        :return: The INSTANCE_RECORD of the message.
+        """
+        return INSTANCE_RECORD.pack(self.kind, NO_VALUE if self.vote is None else self.vote, int(self.source),
+                                    self.instance)
+
+    @classmethod
+    def decode(cls, buffer, offset=0):
+        """
+        Decodes an INSTANCE_RECORD.
+
+        :param buffer: The bytes holding the record.
+        :param int offset: Offset of the record in buffer.
+        :return: The message.
+        """
+        kind, vote, source, instance = INSTANCE_RECORD.unpack_from(buffer, offset)
+        return cls.from_fields(kind, source, None if vote == NO_VALUE else vote, instance)
+
+    def __reduce__(self):
+        return (self.__class__.from_fields, (self.kind, self.source, self.vote, self.instance))
+
+    def __eq__(self, other):
+        return ConsensusMessage.__eq__(self, other) and self.instance == getattr(other, 'instance', 0)
+
+    def __hash__(self):
+        return hash((self.kind, self.source, self.vote, self.instance))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.message_type}, source={self.source}, vote={self.vote}, " \
+               f"instance={self.instance})"
+
+
+AuthMessage = namedtuple('AuthMessage', ['value', 'pulse', 'signature_chain'])
+AuthMessage.__doc__ = """
+Message of the authenticated agreement: the relayed value, the pulse and the signature chain, a flat list of
+(node_id, signature) pairs or a LinkedSignatureChain. Unpacks like the plain (value, pulse, chain) tuple.
+"""
+
+
+def encode_auth_message(message):
+    """
+    Encodes an auth message as an AUTH_HEADER followed by one AUTH_LINK and signature per signer.
+
+    :param message: An AuthMessage or (value, pulse, signature chain) tuple whose value is "ACCEPT" or "REJECT".
+    :return: The encoded bytes.
+    """
+    value, pulse, signature_chain = message
+    links = list(signature_chain)
+    parts = [AUTH_HEADER.pack(VALUE_CODES[value], pulse, len(links))]
+    for node_id, signature in links:
+        parts.append(AUTH_LINK.pack(node_id, len(signature)))
+        parts.append(signature)
+    return b''.join(parts)
+
+
+def decode_auth_message(buffer, chain_format=None):
+    """
+    Decodes the bytes of :func:`encode_auth_message`.
+
+    :param bytes buffer: The encoded message.
+    :param str chain_format: LINKED to rebuild a LinkedSignatureChain, a flat list otherwise.
+    :return: The AuthMessage.
+    """
+    value, pulse, count = AUTH_HEADER.unpack_from(buffer)
+    value = VALUE_NAMES[value]
+    offset = AUTH_HEADER.size
+    links = []
+    for _ in range(count):
+        node_id, length = AUTH_LINK.unpack_from(buffer, offset)
+        offset += AUTH_LINK.size
+        links.append((node_id, bytes(buffer[offset:offset + length])))
+        offset += length
+    if chain_format == LINKED:
+        chain = LinkedSignatureChain(value)
+        for node_id, signature in links:
+            chain = chain.extend(node_id, signature)
+        return AuthMessage(value, pulse, chain)
+    return AuthMessage(value, pulse, links)
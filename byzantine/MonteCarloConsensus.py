@@ -0,0 +1,178 @@
+import argparse
+import time
+import numpy as np
+
+# Decision codes of the result arrays besides the values 0 and 1
+UNDECIDED = -1
+NO_MAJORITY = -2
+# Elements of a (trials x nodes x nodes x nodes) array per vectorized step, bounds the memory of a step
+CHUNK_ELEMENTS = 1 << 20
+# Delivery delay spread in units of one echo send, fitted to 200 runs of ByzantineConsensusTest.py
+DEFAULT_JITTER = 15.0
+
+
+class MonteCarloResult:
+    """
+    Outcome of :func:`run_trials`, one row per trial and one column per node.
+
+    Attributes:
+        echo_decisions (np.ndarray): decided_value of every node after the echo phase, UNDECIDED if none.
+        final_decisions (np.ndarray): Value printed by on_decide, NO_MAJORITY on a tie, UNDECIDED if too few DECIDEs.
+        byzantine (np.ndarray): Boolean mask of the Byzantine nodes.
+        wall_time (float): Seconds spent simulating.
+    """
+    def __init__(self, echo_decisions, final_decisions, byzantine, wall_time):
+        self.echo_decisions = echo_decisions
+        self.final_decisions = final_decisions
+        self.byzantine = byzantine
+        self.wall_time = wall_time
+
+    @property
+    def trials(self):
+        return self.final_decisions.shape[0]
+
+    def honest(self, decisions=None):
+        """
+        Returns the columns of the honest nodes.
+
+        :param np.ndarray decisions: The decisions to select from, final_decisions by default.
+        """
+        decisions = self.final_decisions if decisions is None else decisions
+        return decisions[:, ~self.byzantine]
+
+    def agreement_rate(self, decisions=None):
+        """
+        Returns the fraction of trials in which every honest node decided the same value.
+        """
+        honest = self.honest(decisions)
+        decided = (honest >= 0).all(axis=1)
+        same = (honest == honest[:, :1]).all(axis=1)
+        return float(np.mean(decided & same))
+
+    def decision_rate(self, decisions=None):
+        """
+        Returns the fraction of honest nodes that decided a value.
+        """
+        return float(np.mean(self.honest(decisions) >= 0))
+
+    def value_distribution(self, decisions=None):
+        """
+        Returns the fraction of honest nodes per decision code.
+
+        :return: A dict with the keys 0, 1, NO_MAJORITY and UNDECIDED.
+        """
+        honest = self.honest(decisions)
+        return {code: float(np.mean(honest == code)) for code in (0, 1, NO_MAJORITY, UNDECIDED)}
+
+
+def _simulate_chunk(rng, trials, byzantine, byzantine_count, jitter):
+    n = byzantine.shape[0]
+    off_diagonal = ~np.eye(n, dtype=bool)
+
+    # VOTE: sent_votes[t, i, k] is the vote node i sends to node k, random per destination for Byzantine senders
+    votes = rng.integers(0, 2, (trials, n), dtype=np.int8)
+    sent_votes = np.where(byzantine[None, :, None], rng.integers(0, 2, (trials, n, n), dtype=np.int8),
+                          votes[:, :, None])
+
+    # ECHO: node s echoes the vote of node i to every other node r. The echoes are sent in one random order shared
+    # by the run and each arrives after a random delay. A receiver counts every sender once per value, so a value is
+    # reached when the echo of the need-th distinct sender of that value arrives.
+    need = int((n + byzantine_count) // 2) + 1
+    keys = np.where(off_diagonal, rng.random((trials, n, n)), np.inf).reshape(trials, -1)
+    sent_at = keys.argsort(axis=1).argsort(axis=1).reshape(trials, n, n)
+    values = np.where(byzantine[None, None, :, None], rng.integers(0, 2, (trials, n, n, n), dtype=np.int8),
+                      sent_votes[:, :, :, None])
+    arrival = sent_at[:, :, :, None] + jitter * rng.random((trials, n, n, n))
+    arrival = np.where(off_diagonal[None, :, :, None] & off_diagonal[None, None, :, :], arrival, np.inf)
+    reached = []
+    for value in (0, 1):
+        first_from_sender = np.where(values == value, arrival, np.inf).min(axis=1)
+        if need > n - 1:
+            reached.append(np.full((trials, n), np.inf))
+        else:
+            reached.append(np.partition(first_from_sender, need - 1, axis=1)[:, need - 1, :])
+    reached_zero, reached_one = reached
+    echo_decisions = np.where(reached_one < reached_zero, 1, np.where(reached_zero < reached_one, 0, UNDECIDED))
+    decided = echo_decisions >= 0
+    decided_at = np.minimum(reached_zero, reached_one)
+
+    # DECIDE: every decided node broadcasts its value, Byzantine ones a random value per destination, and on_decide
+    # takes the majority of the first (n - 1) // 2 + 1 DECIDE messages to arrive
+    count = (n - 1) // 2 + 1
+    delivered = decided[:, :, None] & off_diagonal
+    decide_arrival = np.where(delivered, decided_at[:, :, None] + jitter * rng.random((trials, n, n)), np.inf)
+    first_decides = (decide_arrival.argsort(axis=1).argsort(axis=1) < count) & delivered
+    sent_decides = np.where(byzantine[None, :, None], rng.integers(0, 2, (trials, n, n), dtype=np.int8),
+                            echo_decisions[:, :, None])
+    ones = (sent_decides * first_decides).sum(axis=1)
+    majority = np.where(2 * ones > count, 1, np.where(2 * ones < count, 0, NO_MAJORITY))
+    final_decisions = np.where(delivered.sum(axis=1) >= count, majority, UNDECIDED)
+    return echo_decisions.astype(np.int8), final_decisions.astype(np.int8)
+
+
+def run_trials(node_count, byzantine_ids, trials, byzantine_count=None, seed=None, jitter=DEFAULT_JITTER,
+               chunk_size=None):
+    """
+    Simulates many independent runs of ConveniantByzantineConsensus.BCNode on a complete graph.
+
+    Messages are not simulated one by one. Every node receives the same VOTE, ECHO and DECIDE values as in the
+    object-level run, and their order only matters through two races:
+
+    - on_echo decides the first value echoed by more than (len(nodes) + byzantine_count) / 2 distinct senders.
+    - on_decide takes the majority of the first (len(nodes) - 1) // 2 + 1 DECIDE messages.
+
+    Echoes are sent in one random order per run and a node decides as soon as enough senders echoed a value. Every
+    message arrives after a uniform delay in [0, jitter) echo sends, so nodes see nearly the same messages first
+    with jitter=0, and independently shuffled ones with a large jitter. The model assumes every node echoes all of
+    its votes, i.e. nodes that stop echoing once decided are not modelled.
+
+    :param int node_count: Number of nodes.
+    :param byzantine_ids: Ids of the Byzantine nodes.
+    :param int trials: Number of runs.
+    :param int byzantine_count: The module's byzantine_count used in the echo threshold, the number of Byzantine
+        nodes by default.
+    :param int seed: Seed of the run (optional).
+    :param float jitter: Spread of the message delays.
+    :param int chunk_size: Number of trials simulated per vectorized step, derived from CHUNK_ELEMENTS by default.
+    :return: The :class:`MonteCarloResult`.
+    """
+    byzantine = np.zeros(node_count, dtype=bool)
+    byzantine[list(byzantine_ids)] = True
+    if byzantine_count is None:
+        byzantine_count = int(byzantine.sum())
+    rng = np.random.default_rng(seed)
+    chunk_size = chunk_size or max(1, CHUNK_ELEMENTS // node_count ** 3)
+    echo_decisions = np.empty((trials, node_count), dtype=np.int8)
+    final_decisions = np.empty((trials, node_count), dtype=np.int8)
+    start = time.perf_counter()
+    for first in range(0, trials, chunk_size):
+        last = min(first + chunk_size, trials)
+        echo_decisions[first:last], final_decisions[first:last] = \
+            _simulate_chunk(rng, last - first, byzantine, byzantine_count, jitter)
+    return MonteCarloResult(echo_decisions, final_decisions, byzantine, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monte Carlo outcome statistics of the echo consensus.")
+    parser.add_argument('-n', '--nodes', type=int, default=12)
+    parser.add_argument('-b', '--byzantine', type=int, nargs='*', default=[1, 2, 3, 4],
+                        help="ids of the Byzantine nodes")
+    parser.add_argument('--byzantine-count', type=int, default=None,
+                        help="byzantine_count of the echo threshold, defaults to the number of Byzantine nodes")
+    parser.add_argument('-t', '--trials', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--jitter', type=float, default=DEFAULT_JITTER, help="spread of the message delays")
+    args = parser.parse_args()
+
+    result = run_trials(args.nodes, args.byzantine, args.trials, args.byzantine_count, args.seed, args.jitter)
+    print(f"{result.trials} trials in {result.wall_time:.3f}s")
+    for label, decisions in (("Echo decision", result.echo_decisions), ("Final decision", result.final_decisions)):
+        distribution = result.value_distribution(decisions)
+        print(f"{label}: agreement {result.agreement_rate(decisions):.4f}, "
+              f"decided {result.decision_rate(decisions):.4f}, "
+              f"0: {distribution[0]:.4f}, 1: {distribution[1]:.4f}, "
+              f"no majority: {distribution[NO_MAJORITY]:.4f}, undecided: {distribution[UNDECIDED]:.4f}")
+
+
+if __name__ == "__main__":
+    main()
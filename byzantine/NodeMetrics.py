@@ -0,0 +1,231 @@
+import functools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Environment variable enabling the metrics of nodes built without an explicit enable_metrics() call
+METRICS_ENV = 'BYZANTINE_METRICS'
+# Upper bounds of the handler time histogram buckets in microseconds, one more bucket holds everything slower
+HISTOGRAM_BOUNDS_US = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000)
+_HISTOGRAM_BOUNDS_NS = tuple(bound * 1000 for bound in HISTOGRAM_BOUNDS_US)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram of handler times.
+
+    Attributes:
+        buckets (list): Number of observations per bucket of HISTOGRAM_BOUNDS_US, the last one unbounded.
+        count (int): Number of observations.
+        total_ns (int): Sum of the observed times in nanoseconds.
+        max_ns (int): Longest observed time in nanoseconds.
+    """
+    __slots__ = ('buckets', 'count', 'total_ns', 'max_ns')
+
+    def __init__(self):
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS_US) + 1)
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def observe(self, elapsed_ns):
+        self.buckets[bisect_left(_HISTOGRAM_BOUNDS_NS, elapsed_ns)] += 1
+        self.count += 1
+        self.total_ns += elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean_us': self.total_ns / self.count / 1000 if self.count else None,
+            'max_us': self.max_ns / 1000,
+            'buckets_us': dict(zip([str(bound) for bound in HISTOGRAM_BOUNDS_US] + ['inf'], list(self.buckets))),
+        }
+
+
+class NodeMetrics:
+    """
+    Runtime counters of one node, updated by the node itself.
+
+    :param node_id: Id of the node.
+
+    Attributes:
+        node_id: Id of the node.
+        sent (dict): Number of sent messages per message type name.
+        received (dict): Number of received messages per message type name.
+        queue_high_water (int): Most messages seen waiting in the node's inbox, this one included.
+        handlers (dict): :class:`Histogram` of every timed handler.
+        crypto (CryptoCache): The node's crypto cache whose sign and verify counters are reported, if any.
+        started_at (float): perf_counter() value the node started at.
+        decided_at (float): perf_counter() value the node decided at, None before.
+    """
+    def __init__(self, node_id):
+        self.node_id = node_id
+        self.sent = {}
+        self.received = {}
+        self.queue_high_water = 0
+        self.handlers = {}
+        self.crypto = None
+        self.started_at = time.perf_counter()
+        self.decided_at = None
+
+    def count_sent(self, message_type, count=1):
+        self.sent[message_type] = self.sent.get(message_type, 0) + count
+
+    def count_received(self, message_type):
+        self.received[message_type] = self.received.get(message_type, 0) + 1
+
+    def observe_queue(self, depth):
+        if depth > self.queue_high_water:
+            self.queue_high_water = depth
+
+    def observe_handler(self, name, elapsed_ns):
+        histogram = self.handlers.get(name)
+        if histogram is None:
+            histogram = self.handlers[name] = Histogram()
+        histogram.observe(elapsed_ns)
+
+    def mark_started(self):
+        self.started_at = time.perf_counter()
+
+    def mark_decided(self):
+        if self.decided_at is None:
+            self.decided_at = time.perf_counter()
+
+    @property
+    def time_to_decision(self):
+        """
+        Seconds from start to decision, None if the node did not decide yet.
+        """
+        return None if self.decided_at is None else self.decided_at - self.started_at
+
+    def snapshot(self):
+        """
+        Returns a JSON-serializable copy of the counters, safe to take while the node runs.
+        """
+        snapshot = {
+            'sent': dict(self.sent),
+            'received': dict(self.received),
+            'queue_high_water': self.queue_high_water,
+            'handlers': {name: histogram.snapshot() for name, histogram in list(self.handlers.items())},
+            'time_to_decision': self.time_to_decision,
+        }
+        if self.crypto is not None:
+            snapshot['signature_ops'] = self.crypto.stats()
+        return snapshot
+
+
+class MetricsRegistry:
+    """
+    Process-wide collection of the :class:`NodeMetrics` of every node.
+
+    Nodes ask for their metrics on construction. While the registry is disabled they get None and skip all
+    bookkeeping, so the registry has to be enabled before the nodes are built.
+
+    :param bool enabled: Whether nodes built from now on are measured, BYZANTINE_METRICS by default.
+    """
+    def __init__(self, enabled=None):
+        if enabled is None:
+            enabled = os.environ.get(METRICS_ENV, '') not in ('', '0')
+        self.enabled = enabled
+        self._nodes = {}
+        self._lock = threading.Lock()
+
+    def node_metrics(self, node_id):
+        """
+        Returns new metrics for a node, replacing earlier ones of the same id, or None if disabled.
+        """
+        if not self.enabled:
+            return None
+        metrics = NodeMetrics(node_id)
+        with self._lock:
+            self._nodes[node_id] = metrics
+        return metrics
+
+    def get(self, node_id):
+        """
+        Returns the metrics of a node, None if it is not measured.
+        """
+        return self._nodes.get(node_id)
+
+    def snapshot(self):
+        """
+        Returns the snapshots of all nodes and their totals.
+
+        :return: A dict with the keys "nodes", a dict of node id to :meth:`NodeMetrics.snapshot`, and "totals".
+        """
+        with self._lock:
+            nodes = list(self._nodes.items())
+        snapshots = {str(node_id): metrics.snapshot() for node_id, metrics in nodes}
+        totals = {'sent': {}, 'received': {}, 'queue_high_water': 0, 'decided': 0}
+        for snapshot in snapshots.values():
+            for direction in ('sent', 'received'):
+                for message_type, count in snapshot[direction].items():
+                    totals[direction][message_type] = totals[direction].get(message_type, 0) + count
+            totals['queue_high_water'] = max(totals['queue_high_water'], snapshot['queue_high_water'])
+            totals['decided'] += snapshot['time_to_decision'] is not None
+        return {'nodes': snapshots, 'totals': totals}
+
+    def to_json(self, filename):
+        """
+        Writes :meth:`snapshot` to a JSON file.
+        """
+        with open(filename, 'w') as file:
+            json.dump(self.snapshot(), file, indent=2)
+
+    def reset(self):
+        """
+        Forgets the metrics of all nodes.
+        """
+        with self._lock:
+            self._nodes = {}
+
+
+registry = MetricsRegistry()
+
+
+def enable_metrics(enabled=True):
+    """
+    Switches the metrics of nodes built from now on on or off.
+    """
+    registry.enabled = enabled
+
+
+def node_metrics(node_id):
+    """
+    Returns the metrics of a new node from the shared registry, None if metrics are disabled.
+    """
+    return registry.node_metrics(node_id)
+
+
+def time_handlers(node, names):
+    """
+    Replaces handler methods of a measured node with wrappers recording their run time in the node's metrics.
+
+    The wrappers are instance attributes, so nodes without metrics keep calling the plain methods. The time includes
+    handlers of other nodes called synchronously, if the backend delivers messages that way.
+
+    :param node: A node with a metrics attribute.
+    :param names: Names of the handler methods.
+    """
+    metrics = node.metrics
+    if metrics is None:
+        return
+    for name in names:
+        setattr(node, name, _timed(getattr(node, name), name, metrics))
+
+
+def _timed(handler, name, metrics):
+    clock = time.perf_counter_ns
+
+    @functools.wraps(handler)
+    def timed(*args, **kwargs):
+        start = clock()
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            metrics.observe_handler(name, clock() - start)
+    return timed
@@ -0,0 +1,243 @@
+import atexit
+import cProfile
+import functools
+import json
+import os
+import pstats
+import threading
+import time
+
+# Environment variable selecting the profiling mode of nodes built without an explicit enable_profiling() call
+PROFILE_ENV = 'BYZANTINE_PROFILE'
+# Environment variable naming the directory profiles are written to when the process exits
+PROFILE_DIR_ENV = 'BYZANTINE_PROFILE_DIR'
+TIMING = 'timing'
+CPROFILE = 'cprofile'
+PROFILE_MODES = (TIMING, CPROFILE)
+DEFAULT_PROFILE_DIR = 'profiles'
+# Deepest call stack written to the collapsed-stack file
+MAX_STACK_DEPTH = 64
+
+
+def _function_label(function):
+    filename, line, name = function
+    if filename == '~':
+        return name.strip('<>')
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def _collapse(stats, prefix, lines):
+    """
+    Appends the collapsed stacks of a pstats.Stats to lines, weighted in microseconds.
+
+    cProfile only keeps caller -> callee edges, so the time a function spends below a caller is split over its
+    callees in proportion to their cumulative time on that edge.
+    """
+    callees = {}
+    roots = []
+    for function, (_, _, _, _, callers) in stats.stats.items():
+        if not callers:
+            roots.append(function)
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((function, edge[3]))
+
+    def expand(function, weight, stack, depth):
+        total, own = stats.stats[function][3], stats.stats[function][2]
+        if total <= 0 or weight <= 0:
+            return
+        scale = weight / total
+        stack = stack + [_function_label(function)]
+        own_us = int(round(own * scale * 1e6))
+        if own_us:
+            lines[';'.join(stack)] = lines.get(';'.join(stack), 0) + own_us
+        if depth >= MAX_STACK_DEPTH:
+            return
+        for callee, cumulative in callees.get(function, ()):
+            if callee != function:
+                expand(callee, cumulative * scale, stack, depth + 1)
+
+    for root in roots:
+        if 'disable' in root[2] and root[0] == '~':
+            continue
+        expand(root, stats.stats[root][3], prefix, 1)
+
+
+class DispatchProfiler:
+    """
+    Profiles the dispatch of messages to nodes and attributes the cost per node and message type.
+
+    Every dispatch is timed with perf_counter_ns. In the cprofile mode it also runs under a cProfile.Profile per node,
+    message type and thread, which :meth:`write` merges into one pstats file per node and a collapsed-stack file
+    for flamegraph tools. A dispatch reached from within another one on the same thread, as when a backend delivers
+    synchronously, is counted as part of the outer one.
+
+    :param str mode: TIMING, CPROFILE or None to profile nothing, BYZANTINE_PROFILE by default.
+    :param str output_dir: Directory of :meth:`write`, BYZANTINE_PROFILE_DIR or DEFAULT_PROFILE_DIR by default.
+
+    Attributes:
+        mode (str): The profiling mode of nodes built from now on, None if off.
+        output_dir (str): Default directory of :meth:`write`.
+        costs (dict): [calls, nanoseconds] per (node id, message type).
+    """
+    def __init__(self, mode=None, output_dir=None):
+        if mode is None:
+            mode = os.environ.get(PROFILE_ENV) or None
+        if mode is not None and mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profiling mode {mode}, expected one of {PROFILE_MODES}")
+        self.mode = mode
+        self.output_dir = output_dir or os.environ.get(PROFILE_DIR_ENV, DEFAULT_PROFILE_DIR)
+        self.costs = {}
+        self._profiles = {}
+        self._lock = threading.Lock()
+        self._active = threading.local()
+
+    def wrap(self, node_id, handler, message_type_of):
+        """
+        Returns handler wrapped to profile every call.
+
+        :param node_id: Id of the node owning the handler.
+        :param handler: The bound dispatch method.
+        :param message_type_of: Callable taking the handler's arguments and returning the message type name.
+        """
+        clock = time.perf_counter_ns
+        costs, active, cprofile = self.costs, self._active, self.mode == CPROFILE
+
+        @functools.wraps(handler)
+        def profiled(*args, **kwargs):
+            if getattr(active, 'dispatching', False):
+                return handler(*args, **kwargs)
+            key = (node_id, message_type_of(*args, **kwargs))
+            profile = self._profile(key) if cprofile else None
+            active.dispatching = True
+            start = clock()
+            try:
+                if profile is None:
+                    return handler(*args, **kwargs)
+                return profile.runcall(handler, *args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                active.dispatching = False
+                cost = costs.get(key)
+                if cost is None:
+                    with self._lock:
+                        cost = costs.setdefault(key, [0, 0])
+                cost[0] += 1
+                cost[1] += elapsed
+        return profiled
+
+    def _profile(self, key):
+        profile_key = key + (threading.get_ident(),)
+        profile = self._profiles.get(profile_key)
+        if profile is None:
+            with self._lock:
+                profile = self._profiles.setdefault(profile_key, cProfile.Profile())
+        return profile
+
+    def table(self):
+        """
+        Returns the dispatch costs, most expensive first.
+
+        :return: A list of dicts with the keys node, message_type, calls, total_ms and mean_us.
+        """
+        rows = [{'node': node_id, 'message_type': message_type, 'calls': calls, 'total_ms': elapsed / 1e6,
+                 'mean_us': elapsed / calls / 1000}
+                for (node_id, message_type), (calls, elapsed) in list(self.costs.items()) if calls]
+        return sorted(rows, key=lambda row: row['total_ms'], reverse=True)
+
+    def node_stats(self):
+        """
+        Returns the merged pstats.Stats of every node and message type of the cprofile mode.
+
+        :return: A dict of (node id, message type) to pstats.Stats.
+        """
+        with self._lock:
+            profiles = list(self._profiles.items())
+        merged = {}
+        for (node_id, message_type, _), profile in profiles:
+            key = (node_id, message_type)
+            if key in merged:
+                merged[key].add(profile)
+            else:
+                merged[key] = pstats.Stats(profile)
+        return merged
+
+    def write(self, output_dir=None):
+        """
+        Writes the dispatch costs to costs.json and, in the cprofile mode, node-<id>.pstats per node and the merged
+        collapsed stacks of all nodes to dispatch.collapsed, rooted at node-<id>;<message type>.
+
+        :param str output_dir: The directory, output_dir by default.
+        :return: The directory written to.
+        """
+        output_dir = output_dir or self.output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, 'costs.json'), 'w') as file:
+            json.dump(self.table(), file, indent=2, default=str)
+        per_node = {}
+        lines = {}
+        for (node_id, message_type), stats in self.node_stats().items():
+            _collapse(stats, [f"node-{node_id}", str(message_type)], lines)
+            if node_id in per_node:
+                per_node[node_id].add(stats)
+            else:
+                per_node[node_id] = stats
+        for node_id, stats in per_node.items():
+            stats.dump_stats(os.path.join(output_dir, f"node-{node_id}.pstats"))
+        if lines:
+            with open(os.path.join(output_dir, 'dispatch.collapsed'), 'w') as file:
+                for stack, weight in sorted(lines.items()):
+                    file.write(f"{stack} {weight}\n")
+        return output_dir
+
+    def reset(self):
+        """
+        Forgets all costs and profiles.
+        """
+        with self._lock:
+            self.costs.clear()
+            self._profiles = {}
+
+
+profiler = DispatchProfiler()
+if profiler.mode is not None:
+    atexit.register(profiler.write)
+
+
+def enable_profiling(mode=CPROFILE, output_dir=None):
+    """
+    Profiles the dispatch of nodes built from now on. Unlike BYZANTINE_PROFILE, this does not write the profiles at
+    exit, call profiler.write() once the run is over.
+
+    :param str mode: TIMING or CPROFILE.
+    :param str output_dir: Default directory of DispatchProfiler.write (optional).
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profiling mode {mode}, expected one of {PROFILE_MODES}")
+    profiler.mode = mode
+    if output_dir:
+        profiler.output_dir = output_dir
+
+
+def disable_profiling():
+    """
+    Stops profiling nodes built from now on.
+    """
+    profiler.mode = None
+
+
+def profile_dispatch(node, node_id, name, message_type_of):
+    """
+    Replaces the dispatch method of a node with a profiled wrapper if profiling is on.
+
+    The wrapper is an instance attribute, so nodes built while profiling is off keep calling the plain method.
+
+    :param node: The node.
+    :param node_id: Id of the node in the profiles.
+    :param str name: Name of the dispatch method.
+    :param message_type_of: Callable taking the method's arguments and returning the message type name.
+    :return: True if the method was wrapped.
+    """
+    if profiler.mode is None:
+        return False
+    setattr(node, name, profiler.wrap(node_id, getattr(node, name), message_type_of))
+    return True
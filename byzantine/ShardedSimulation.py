@@ -0,0 +1,371 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import random
+import struct
+import time
+from collections import deque
+import networkx as nx
+import ByzantineConsensus
+from ByzantineConsensus import BCNode, Event, State
+from BinaryTrace import NO_VALUE, MESSAGE_TYPE_NAMES, BinaryTraceWriter, read_binary_trace
+from Messages import CONSENSUS_RECORD
+
+# Messages.CONSENSUS_RECORD followed by the destination node
+WIRE_RECORD = struct.Struct(CONSENSUS_RECORD.format + 'I')
+# Encoded events buffered per destination shard before a batch is put on its queue
+SHARD_BATCH_SIZE = 4096
+# Seconds between two termination probe waves
+PROBE_INTERVAL = 0.01
+
+_NO_VOTE = NO_VALUE
+_PROBE = 'probe'
+_STOP = 'stop'
+
+
+def partition_graph(graph, shards):
+    """
+    Splits the nodes of a graph into shards of nearly equal size.
+
+    Nodes are taken in breadth-first order, so neighbours tend to land in the same shard on sparse topologies.
+
+    :param nx.Graph graph: The topology.
+    :param int shards: Number of shards.
+    :return: A list of node id lists, one per shard.
+    """
+    order = []
+    seen = set()
+    for root in sorted(graph.nodes):
+        if root in seen:
+            continue
+        seen.add(root)
+        frontier = deque([root])
+        while frontier:
+            node_id = frontier.popleft()
+            order.append(node_id)
+            for neighbour in sorted(graph.neighbors(node_id)):
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    frontier.append(neighbour)
+    size = -(-len(order) // shards)
+    return [order[start:start + size] for start in range(0, len(order), size)]
+
+
+class LocalInbox:
+    """
+    Stand-in for the Queue of a node hosted by a shard, puts are queued on the shard's delivery queue.
+    """
+    __slots__ = ('shard', 'node')
+
+    def __init__(self, shard, node):
+        self.shard = shard
+        self.node = node
+
+    def put(self, event):
+        self.shard.pending.append((self.node, event))
+
+
+class RemoteInbox:
+    """
+    Stand-in for the Queue of a node hosted by another shard, puts are encoded into that shard's outgoing batch.
+    """
+    __slots__ = ('shard', 'node_id', 'target')
+
+    def __init__(self, shard, node_id, target):
+        self.shard = shard
+        self.node_id = node_id
+        self.target = target
+
+    def put(self, event):
+        vote = _NO_VOTE if event.vote is None else event.vote
+        self.shard.send(self.target, WIRE_RECORD.pack(event.kind, vote, int(event.source), self.node_id))
+
+
+class RemoteNode:
+    """
+    Proxy of a node hosted by another shard, with the name and queue attributes BCNode uses of its peers.
+    """
+    __slots__ = ('name', 'queue')
+
+    def __init__(self, node_id, inbox):
+        self.name = str(node_id)
+        self.queue = inbox
+
+
+class Shard:
+    """
+    The part of a sharded simulation run by one worker process.
+
+    Local events are delivered from an in-process queue. Events for remote nodes are encoded as fixed-size records,
+    batched per destination shard and put on that shard's multiprocessing queue. Every worker counts the batches it
+    sent and received, which the coordinator uses to detect termination.
+
+    :param int index: Index of the shard.
+    :param list node_ids: Ids of the nodes hosted by the shard.
+    :param dict adjacency: Neighbour ids of every hosted node.
+    :param dict owner: Shard index of every node id.
+    :param set byzantine_ids: Ids of the Byzantine nodes.
+    :param int seed: Seed of the run.
+    :param list queues: Inbound queue of every shard.
+    :param str trace_filename: Binary trace of the deliveries of this shard (optional).
+
+    Attributes:
+        events (int): Number of delivered events.
+        batches_sent (int): Number of batches put on other shards' queues.
+        batches_received (int): Number of batches taken from this shard's queue.
+    """
+    def __init__(self, index, node_ids, adjacency, owner, byzantine_ids, seed, queues, trace_filename=None):
+        self.index = index
+        self.owner = owner
+        self.queues = queues
+        self.pending = deque()
+        self.outgoing = {}
+        self.events = 0
+        self.batches_sent = 0
+        self.batches_received = 0
+        self.trace = BinaryTraceWriter(trace_filename) if trace_filename else None
+        rng = random.Random(seed * 65536 + index)
+        self.nodes = {node_id: BCNode(node_id, None, is_byzantine=(node_id in byzantine_ids), rng=rng)
+                      for node_id in node_ids}
+        self.proxies = {}
+        for node_id, node in self.nodes.items():
+            node.queue = LocalInbox(self, node)
+            node.nodes = {neighbour: self.peer(neighbour) for neighbour in adjacency[node_id]}
+            node.nodes[node_id] = node
+
+    def peer(self, node_id):
+        """
+        Returns the local node or the proxy of a remote node.
+        """
+        node = self.nodes.get(node_id)
+        if node is not None:
+            return node
+        proxy = self.proxies.get(node_id)
+        if proxy is None:
+            proxy = RemoteNode(node_id, RemoteInbox(self, node_id, self.owner[node_id]))
+            self.proxies[node_id] = proxy
+        return proxy
+
+    def send(self, target, record):
+        batch = self.outgoing.get(target)
+        if batch is None:
+            batch = self.outgoing[target] = bytearray()
+        batch += record
+        if len(batch) >= SHARD_BATCH_SIZE * WIRE_RECORD.size:
+            self.flush(target)
+
+    def flush(self, target=None):
+        """
+        Puts the outgoing batch of a shard, or of every shard, on its queue.
+        """
+        targets = [target] if target is not None else list(self.outgoing)
+        for target in targets:
+            batch = self.outgoing.pop(target, None)
+            if batch:
+                self.queues[target].put(bytes(batch))
+                self.batches_sent += 1
+
+    def receive(self, batch):
+        """
+        Decodes a batch of remote events into the delivery queue.
+        """
+        self.batches_received += 1
+        for kind, vote, source, destination in WIRE_RECORD.iter_unpack(batch):
+            event = Event.from_fields(kind, source, None if vote == _NO_VOTE else vote)
+            self.pending.append((self.nodes[destination], event))
+
+    def drain(self):
+        """
+        Delivers queued events until none is left, then flushes the outgoing batches.
+        """
+        pending = self.pending
+        trace = self.trace
+        while pending:
+            node, event = pending.popleft()
+            if trace is not None:
+                trace.write(event.message_type, event.source, node.name, event.vote)
+            node.handle_event(event)
+            self.events += 1
+        self.flush()
+
+    def run(self, control):
+        """
+        Serves the shard's queue until the coordinator stops it.
+
+        :param control: Queue of the replies to the coordinator.
+        """
+        inbox = self.queues[self.index]
+        for node in self.nodes.values():
+            node.send_init()
+        self.drain()
+        while True:
+            item = inbox.get()
+            if isinstance(item, bytes):
+                self.receive(item)
+                self.drain()
+            elif item[0] == _PROBE:
+                control.put((_PROBE, item[1], self.index, self.batches_sent, self.batches_received))
+            else:
+                break
+        if self.trace is not None:
+            self.trace.close()
+        decisions = {node_id: node.decided_value if node.state == State.DECIDED else None
+                     for node_id, node in self.nodes.items()}
+        control.put((_STOP, self.index, decisions, self.events))
+
+
+def _run_shard(index, node_ids, adjacency, owner, byzantine_ids, seed, queues, control, trace_filename):
+    ByzantineConsensus.byzantine_count = len(byzantine_ids)
+    ByzantineConsensus.node_count = len(owner)
+    Shard(index, node_ids, adjacency, owner, byzantine_ids, seed, queues, trace_filename).run(control)
+
+
+def _reply(control, workers):
+    while True:
+        try:
+            return control.get(timeout=1)
+        except queue.Empty:
+            failed = [worker.name for worker in workers if worker.exitcode not in (None, 0)]
+            if failed:
+                for worker in workers:
+                    worker.terminate()
+                raise RuntimeError(f"Shard workers {failed} failed")
+
+
+def merge_traces(filenames, output_filename, compression=None):
+    """
+    Concatenates binary traces into one and removes the inputs.
+
+    :param list filenames: The traces to merge.
+    :param str output_filename: The merged trace.
+    :param str compression: None, "gzip" or "lzma".
+    :return: The number of records written.
+    """
+    with BinaryTraceWriter(output_filename, compression) as writer:
+        for filename in filenames:
+            for record in read_binary_trace(filename):
+                writer.write(MESSAGE_TYPE_NAMES[record.message_type], record.source, record.delivered, record.value,
+                             record.pulse, record.signers, record.instance)
+            os.remove(filename)
+        return writer.records
+
+
+class ShardedResult:
+    """
+    Outcome of :func:`run_sharded`.
+
+    Attributes:
+        decisions (dict): Decided value of every node id, None for undecided nodes.
+        byzantine_ids (set): Ids of the Byzantine nodes.
+        events (int): Number of delivered events over all shards.
+        shards (int): Number of worker processes.
+        probes (int): Number of termination probe waves.
+        wall_time (float): Seconds from starting the workers to collecting their results.
+    """
+    def __init__(self, decisions, byzantine_ids, events, shards, probes, wall_time):
+        self.decisions = decisions
+        self.byzantine_ids = byzantine_ids
+        self.events = events
+        self.shards = shards
+        self.probes = probes
+        self.wall_time = wall_time
+
+    def honest_decisions(self):
+        return {node_id: value for node_id, value in self.decisions.items() if node_id not in self.byzantine_ids}
+
+    def agreement(self):
+        """
+        Returns True if every honest node decided and all decided the same value.
+        """
+        values = set(self.honest_decisions().values())
+        return len(values) == 1 and None not in values
+
+
+def run_sharded(node_count=None, byzantine_ids=(), shards=None, seed=0, graph=None, trace_filename=None,
+                trace_compression=None):
+    """
+    Runs one Bracha-style consensus with the nodes split across worker processes.
+
+    Termination uses the four-counter method: the coordinator probes every shard for its sent and received batch
+    counts, and the run is over once two consecutive probe waves report the same, balanced totals.
+
+    :param int node_count: Number of nodes of a complete graph, ignored if graph is given.
+    :param byzantine_ids: Ids of the Byzantine nodes.
+    :param int shards: Number of worker processes, defaults to the number of cores.
+    :param int seed: Seed of the run.
+    :param nx.Graph graph: The topology (optional).
+    :param str trace_filename: Binary trace of all deliveries, merged from the shards' traces (optional).
+    :param str trace_compression: None, "gzip" or "lzma".
+    :return: The :class:`ShardedResult`.
+    """
+    if graph is None:
+        graph = nx.complete_graph(node_count)
+    byzantine_ids = set(byzantine_ids)
+    parts = partition_graph(graph, min(shards or os.cpu_count() or 1, graph.number_of_nodes()))
+    owner = {node_id: index for index, part in enumerate(parts) for node_id in part}
+    queues = [multiprocessing.Queue() for _ in parts]
+    control = multiprocessing.Queue()
+    shard_traces = [f"{trace_filename}.shard{index}" if trace_filename else None for index in range(len(parts))]
+
+    start = time.perf_counter()
+    workers = []
+    for index, part in enumerate(parts):
+        adjacency = {node_id: list(graph.neighbors(node_id)) for node_id in part}
+        worker = multiprocessing.Process(target=_run_shard, args=(index, part, adjacency, owner, byzantine_ids, seed,
+                                                                  queues, control, shard_traces[index]))
+        worker.start()
+        workers.append(worker)
+
+    wave = 0
+    previous = None
+    while True:
+        wave += 1
+        for inbox in queues:
+            inbox.put((_PROBE, wave))
+        sent = received = replies = 0
+        while replies < len(parts):
+            _, reply_wave, _, shard_sent, shard_received = _reply(control, workers)
+            if reply_wave == wave:
+                sent += shard_sent
+                received += shard_received
+                replies += 1
+        if sent == received and previous == (sent, received):
+            break
+        previous = (sent, received)
+        time.sleep(PROBE_INTERVAL)
+
+    for inbox in queues:
+        inbox.put((_STOP,))
+    decisions = {}
+    events = 0
+    for _ in parts:
+        _, _, shard_decisions, shard_events = _reply(control, workers)
+        decisions.update(shard_decisions)
+        events += shard_events
+    for worker in workers:
+        worker.join()
+    wall_time = time.perf_counter() - start
+
+    if trace_filename:
+        merge_traces(shard_traces, trace_filename, trace_compression)
+    return ShardedResult(decisions, byzantine_ids, events, len(parts), wave, wall_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Bracha-style consensus with the nodes split across processes.")
+    parser.add_argument('-n', '--nodes', type=int, default=5)
+    parser.add_argument('-b', '--byzantine', type=int, nargs='*', default=[2], help="ids of the Byzantine nodes")
+    parser.add_argument('-s', '--shards', type=int, default=None, help="number of worker processes")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--trace', default=None, help="binary trace file of all deliveries")
+    args = parser.parse_args()
+
+    result = run_sharded(args.nodes, args.byzantine, args.shards, args.seed, trace_filename=args.trace)
+    print(f"Delivered {result.events} events on {result.shards} shards in {result.wall_time:.3f}s "
+          f"({result.probes} termination probes)")
+    print(f"Honest agreement: {result.agreement()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import hashlib
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+FLAT = 'flat'
+LINKED = 'linked'
+CHAIN_FORMATS = (FLAT, LINKED)
+# Environment variable selecting the default chain format of the auth nodes
+CHAIN_FORMAT_ENV = 'BYZANTINE_CHAIN_FORMAT'
+# Number of verified chain prefixes remembered by each node
+VERIFIED_PREFIX_CACHE_SIZE = 65536
+
+
+def default_chain_format():
+    """
+    Returns the chain format named by BYZANTINE_CHAIN_FORMAT, "flat" if unset.
+    """
+    chain_format = os.environ.get(CHAIN_FORMAT_ENV, FLAT)
+    if chain_format not in CHAIN_FORMATS:
+        raise ValueError(f"Unknown chain format {chain_format}, expected one of {CHAIN_FORMATS}")
+    return chain_format
+
+
+def value_digest(value):
+    """
+    Returns the digest of the empty chain of a value, the data signed by the first signer.
+
+    :param str value: The agreed value.
+    :return: The SHA256 digest.
+    """
+    return hashlib.sha256(b'value:' + value.encode('utf-8')).digest()
+
+
+def link_digest(prefix_digest, node_id, signature):
+    """
+    Returns the digest of a chain extended by one link, the data signed by the next signer.
+
+    :param bytes prefix_digest: Digest of the chain before the link.
+    :param int node_id: Id of the signer of the link.
+    :param bytes signature: Signature of the link over prefix_digest.
+    :return: The SHA256 digest.
+    """
+    return hashlib.sha256(prefix_digest + struct.pack('<Q', node_id) + signature).digest()
+
+
+class LinkedSignatureChain:
+    """
+    Immutable hash-linked signature chain in which every signer signs the digest of the chain before it.
+
+    A chain is its last link with a reference to its prefix, so extending a chain is O(1) and never copies the
+    prefix, which stays shared with every other chain that extends it. Iterating yields (node_id, signature) pairs
+    from the first signer to the last, like the flat list format.
+
+    :param str value: The agreed value, for the empty chain.
+    :param LinkedSignatureChain parent: The prefix of the chain, use :meth:`extend` instead.
+    :param int node_id: Signer of the last link.
+    :param bytes signature: Signature of the last link over the parent digest.
+    """
+    __slots__ = ('value', 'parent', 'node_id', 'signature', 'digest', 'length')
+
+    def __init__(self, value, parent=None, node_id=None, signature=None):
+        self.value = value
+        self.parent = parent
+        self.node_id = node_id
+        self.signature = signature
+        if parent is None:
+            self.digest = value_digest(value)
+            self.length = 0
+        else:
+            self.digest = link_digest(parent.digest, node_id, signature)
+            self.length = parent.length + 1
+
+    def extend(self, node_id, signature):
+        """
+        Returns the chain extended by one link.
+
+        :param int node_id: Id of the new signer.
+        :param bytes signature: Signature of the new signer over this chain's digest.
+        :return: The extended chain.
+        """
+        return LinkedSignatureChain(self.value, self, node_id, signature)
+
+    def links(self):
+        """
+        Returns the chain's links from the first signer to the last.
+
+        :return: A list of (node_id, signature) pairs.
+        """
+        links = []
+        chain = self
+        while chain.parent is not None:
+            links.append((chain.node_id, chain.signature))
+            chain = chain.parent
+        links.reverse()
+        return links
+
+    def __iter__(self):
+        return iter(self.links())
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length > 0
+
+    def __getitem__(self, index):
+        if index == -1 and self.parent is not None:
+            return (self.node_id, self.signature)
+        return self.links()[index]
+
+
+class ChainVerifier:
+    """
+    Validates hash-linked signature chains incrementally.
+
+    The digest of every validated chain is remembered together with its signer set. An extended chain is validated
+    by recomputing its prefix digests, which only hashes, and verifying just the links after the longest remembered
+    prefix, so a chain that extends an already validated one costs a single signature check.
+
+    :param CryptoCache crypto: The node's signature cache, used to verify links.
+    :param int cache_size: Maximum number of remembered prefixes.
+
+    Attributes:
+        links_verified (int): Number of links whose signature was checked.
+        links_skipped (int): Number of links covered by a remembered prefix.
+    """
+    def __init__(self, crypto, cache_size=VERIFIED_PREFIX_CACHE_SIZE):
+        self.crypto = crypto
+        self.cache_size = cache_size
+        self.links_verified = 0
+        self.links_skipped = 0
+        self._prefixes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, digest, signers):
+        with self._lock:
+            self._prefixes[digest] = signers
+            if len(self._prefixes) > self.cache_size:
+                self._prefixes.popitem(last=False)
+
+    def validate(self, value, chain):
+        """
+        Checks that chain is a hash-linked chain over value with distinct signers and valid signatures.
+
+        :param str value: The value of the message carrying the chain.
+        :param LinkedSignatureChain chain: The chain to validate.
+        :return: True if the chain is valid, False otherwise.
+        """
+        links = chain.links()
+        digests = [value_digest(value)]
+        for node_id, signature in links:
+            digests.append(link_digest(digests[-1], node_id, signature))
+
+        start, signers = 0, frozenset()
+        with self._lock:
+            for length in range(len(links), 0, -1):
+                known = self._prefixes.get(digests[length])
+                if known is not None:
+                    start, signers = length, known
+                    self._prefixes.move_to_end(digests[length])
+                    break
+        self.links_skipped += start
+
+        for index in range(start, len(links)):
+            node_id, signature = links[index]
+            if node_id in signers:
+                return False
+            self.links_verified += 1
+            if not self.crypto.verify(node_id, digests[index], signature):
+                return False
+            signers = signers | {node_id}
+            self._remember(digests[index + 1], signers)
+        return True
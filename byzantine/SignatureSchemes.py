@@ -0,0 +1,250 @@
+import hashlib
+import hmac
+import os
+import struct
+from abc import ABC, abstractmethod
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import ECC, RSA
+from Crypto.Signature import eddsa, pkcs1_15
+from KeyStore import DEFAULT_BITS, node_key
+
+# Environment variable selecting the default scheme, e.g. "rsa", "rsa-3072", "ed25519" or "simulated"
+SCHEME_ENV = 'BYZANTINE_SIGNATURE_SCHEME'
+DEFAULT_SCHEME = 'rsa'
+
+_default_scheme = None
+
+
+class SignatureScheme(ABC):
+    """
+    Interface of the signature schemes used by the authenticated agreement nodes.
+
+    Signing and verification are split into :meth:`signer` and :meth:`verifier` factories so that callers can
+    build the per-key objects once and reuse them. All schemes are deterministic: signing the same data with the
+    same key always gives the same signature. A scheme that lacks one of the abstract methods cannot be created.
+
+    Attributes:
+        name (str): Name of the scheme in :data:`SCHEMES`.
+        signature_size (int): Size of a signature in bytes.
+    """
+    name = None
+    signature_size = None
+
+    @abstractmethod
+    def generate_key(self, node_id):
+        """
+        Returns the private key of a node.
+
+        :param int node_id: Id of the node.
+        """
+
+    @abstractmethod
+    def public_key(self, key):
+        """
+        Returns the public part of a private key.
+        """
+
+    @abstractmethod
+    def signer(self, key):
+        """
+        Returns a callable that signs bytes with key.
+        """
+
+    @abstractmethod
+    def verifier(self, public_key):
+        """
+        Returns a callable (data, signature) -> bool that verifies signatures of public_key.
+        """
+
+    @abstractmethod
+    def export_public_key(self, public_key):
+        """
+        Serializes a public key to bytes, e.g. to send it to another process.
+        """
+
+    @abstractmethod
+    def import_public_key(self, data):
+        """
+        Inverse of :meth:`export_public_key`.
+        """
+
+    def sign(self, key, data):
+        """
+        Signs data with key.
+
+        :param key: The private key.
+        :param bytes data: The data to sign.
+        :return: The signature.
+        """
+        return self.signer(key)(data)
+
+    def verify(self, public_key, data, signature):
+        """
+        Verifies a signature.
+
+        :param public_key: The public key of the signer.
+        :param bytes data: The signed data.
+        :param bytes signature: The signature.
+        :return: True if the signature is valid, False otherwise.
+        """
+        return self.verifier(public_key)(data, signature)
+
+
+class RSAScheme(SignatureScheme):
+    """
+    RSA with PKCS#1 v1.5 padding over SHA256, the original scheme of the auth nodes.
+
+    :param int bits: The key size, keys come from the default keystore when one is configured, which must hold keys of
+        this size.
+    """
+    name = 'rsa'
+
+    def __init__(self, bits=DEFAULT_BITS):
+        self.bits = bits
+        self.signature_size = bits // 8
+
+    def generate_key(self, node_id):
+        key = node_key(node_id, self.bits)
+        if key.size_in_bits() != self.bits:
+            raise ValueError(f"The keystore key of node {node_id} has {key.size_in_bits()} bits, "
+                             f"the scheme expects {self.bits}")
+        return key
+
+    def public_key(self, key):
+        return key.publickey()
+
+    def signer(self, key):
+        signer = pkcs1_15.new(key)
+        return lambda data: signer.sign(SHA256.new(data))
+
+    def verifier(self, public_key):
+        verifier = pkcs1_15.new(public_key)
+
+        def verify(data, signature):
+            try:
+                verifier.verify(SHA256.new(data), signature)
+                return True
+            except ValueError:
+                return False
+        return verify
+
+    def export_public_key(self, public_key):
+        return public_key.export_key(format='DER')
+
+    def import_public_key(self, data):
+        return RSA.import_key(data)
+
+
+class Ed25519Scheme(SignatureScheme):
+    """
+    Ed25519 (RFC 8032) signatures, 64 bytes each and much cheaper to create than RSA-2048 ones.
+    """
+    name = 'ed25519'
+    signature_size = 64
+
+    def generate_key(self, node_id):
+        return ECC.generate(curve='Ed25519')
+
+    def public_key(self, key):
+        return key.public_key()
+
+    def signer(self, key):
+        return eddsa.new(key, 'rfc8032').sign
+
+    def verifier(self, public_key):
+        verifier = eddsa.new(public_key, 'rfc8032')
+
+        def verify(data, signature):
+            try:
+                verifier.verify(data, signature)
+                return True
+            except ValueError:
+                return False
+        return verify
+
+    def export_public_key(self, public_key):
+        return public_key.export_key(format='DER')
+
+    def import_public_key(self, data):
+        return ECC.import_key(data)
+
+
+class SimulatedScheme(SignatureScheme):
+    """
+    Insecure stand-in for signatures, for large-scale algorithm experiments where crypto cost is irrelevant.
+
+    With tag="hmac" a signature is a keyed BLAKE2b tag of the data under a secret derived from the node id, and the
+    "public key" is that same secret. With tag="identity" a signature is just the packed signer id, it does not
+    depend on the data at all.
+
+    :param str tag: "hmac" or "identity".
+    """
+    name = 'simulated'
+
+    def __init__(self, tag='hmac'):
+        if tag not in ('hmac', 'identity'):
+            raise ValueError(f"Unknown simulated tag {tag}, expected hmac or identity")
+        self.tag = tag
+        self.signature_size = 16 if tag == 'hmac' else 4
+
+    def generate_key(self, node_id):
+        if self.tag == 'identity':
+            return struct.pack('<I', node_id)
+        return hashlib.blake2b(struct.pack('<Q', node_id), person=b'simulated-key').digest()
+
+    def public_key(self, key):
+        return key
+
+    def signer(self, key):
+        if self.tag == 'identity':
+            return lambda data: key
+        return lambda data: hashlib.blake2b(data, key=key, digest_size=16).digest()
+
+    def verifier(self, public_key):
+        sign = self.signer(public_key)
+        return lambda data, signature: hmac.compare_digest(sign(data), signature)
+
+    def export_public_key(self, public_key):
+        return public_key
+
+    def import_public_key(self, data):
+        return data
+
+
+SCHEMES = {
+    'rsa': RSAScheme,
+    'ed25519': Ed25519Scheme,
+    'simulated': SimulatedScheme,
+}
+
+
+def get_scheme(name=None, **options):
+    """
+    Builds a signature scheme.
+
+    :param str name: A key of :data:`SCHEMES`, "rsa-<bits>" for RSA with another key size, or None for the default
+        scheme named by BYZANTINE_SIGNATURE_SCHEME (RSA-2048 if unset).
+    :param options: Keyword arguments of the scheme class.
+    :return: The :class:`SignatureScheme`.
+    """
+    global _default_scheme
+    if name is None and not options:
+        if _default_scheme is None:
+            _default_scheme = get_scheme(os.environ.get(SCHEME_ENV, DEFAULT_SCHEME))
+        return _default_scheme
+    name = name or os.environ.get(SCHEME_ENV, DEFAULT_SCHEME)
+    if name.startswith('rsa-'):
+        name, options['bits'] = 'rsa', int(name[len('rsa-'):])
+    if name not in SCHEMES:
+        raise ValueError(f"Unknown signature scheme {name}, expected one of {list(SCHEMES)}")
+    return SCHEMES[name](**options)
+
+
+def set_default_scheme(scheme):
+    """
+    Sets the scheme returned by get_scheme() without arguments.
+
+    :param scheme: A :class:`SignatureScheme`, a scheme name, or None to read BYZANTINE_SIGNATURE_SCHEME again.
+    """
+    global _default_scheme
+    _default_scheme = get_scheme(scheme) if isinstance(scheme, str) else scheme
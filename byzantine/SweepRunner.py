@@ -0,0 +1,328 @@
+import argparse
+import csv
+import math
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import traceback
+from collections import namedtuple
+import networkx as nx
+
+PROTOCOLS = ('consensus', 'auth')
+TOPOLOGIES = ('complete', 'ring', 'star', 'random')
+RESULT_COLUMNS = ['cell_id', 'protocol', 'nodes', 'byzantine', 'general', 'k', 'topology', 'seed', 'status',
+                  'decided', 'honest_decided', 'agreement', 'decision', 'time_to_decision', 'wall_time', 'messages',
+                  'peak_rss_kb', 'error']
+# Seconds between two checks of the nodes' decisions
+POLL_INTERVAL = 0.01
+# A run without decisions ends once no message was traced for this many seconds
+QUIET_PERIOD = 3.0
+# Seconds a worker gets beyond the cell timeout to report before it is killed
+KILL_GRACE = 5.0
+
+SweepCell = namedtuple('SweepCell', ['protocol', 'nodes', 'byzantine', 'general', 'k', 'topology', 'seed'])
+SweepCell.__doc__ = """
+One run of a sweep. byzantine is a tuple of node ids, general and k are None for the consensus protocol.
+"""
+
+
+def cell_id(cell):
+    """
+    Returns the key of a cell in the results table.
+    """
+    byzantine = '-'.join(str(node_id) for node_id in cell.byzantine)
+    return (f"{cell.protocol}:n{cell.nodes}:b{byzantine}:g{'' if cell.general is None else cell.general}"
+            f":k{'' if cell.k is None else cell.k}:{cell.topology}:s{cell.seed}")
+
+
+def parse_byzantine(text):
+    """
+    Parses a Byzantine grid entry, a count like "3" or comma separated ids like "1,2,4".
+
+    :return: An int count or a tuple of ids.
+    """
+    if ',' in text:
+        return tuple(int(part) for part in text.split(',') if part)
+    return int(text)
+
+
+def expand_grid(protocols, node_counts, byzantine, generals=(0,), ks=(None,), topologies=('complete',), seeds=(0,)):
+    """
+    Returns every valid cell of a parameter grid.
+
+    A Byzantine count c selects the c lowest ids other than the general, like the hand-edited drivers did. A k of
+    None runs the auth protocol with as many pulses as Byzantine nodes, at least one. Cells whose ids do not fit
+    the node count are left out.
+
+    :param protocols: Protocols of :data:`PROTOCOLS`.
+    :param node_counts: Node counts.
+    :param byzantine: Byzantine counts or tuples of ids.
+    :param generals: Ids of the general, auth protocol only.
+    :param ks: Numbers of pulses, auth protocol only.
+    :param topologies: Families of :data:`TOPOLOGIES`.
+    :param seeds: Seeds.
+    :return: A list of :class:`SweepCell`.
+    """
+    cells = []
+    seen = set()
+    for protocol in protocols:
+        for nodes in node_counts:
+            for entry in byzantine:
+                for general in (generals if protocol == 'auth' else (None,)):
+                    if isinstance(entry, int):
+                        candidates = [node_id for node_id in range(nodes) if node_id != general]
+                        if entry > len(candidates):
+                            continue
+                        ids = tuple(candidates[:entry])
+                    else:
+                        ids = tuple(sorted(entry))
+                    if any(node_id >= nodes for node_id in ids) or (general is not None and general >= nodes):
+                        continue
+                    for k in (ks if protocol == 'auth' else (None,)):
+                        if protocol == 'auth' and k is None:
+                            k = max(1, len(ids))
+                        for topology in topologies:
+                            for seed in seeds:
+                                cell = SweepCell(protocol, nodes, ids, general, k, topology, seed)
+                                if cell not in seen:
+                                    seen.add(cell)
+                                    cells.append(cell)
+    return cells
+
+
+def build_graph(topology, nodes, seed=0):
+    """
+    Builds a connected graph of a topology family.
+
+    :param str topology: A family of :data:`TOPOLOGIES`.
+    :param int nodes: Number of nodes.
+    :param int seed: Seed of the random family.
+    :return: The nx.Graph.
+    """
+    if topology == 'complete':
+        return nx.complete_graph(nodes)
+    if topology == 'ring':
+        return nx.cycle_graph(nodes)
+    if topology == 'star':
+        return nx.star_graph(nodes - 1)
+    if topology == 'random':
+        probability = min(1.0, 2 * math.log(max(nodes, 2)) / nodes)
+        rng = random.Random(seed)
+        while True:
+            graph = nx.gnp_random_graph(nodes, probability, seed=rng.randrange(1 << 30))
+            if nx.is_connected(graph):
+                return graph
+    raise ValueError(f"Unknown topology {topology}, expected one of {TOPOLOGIES}")
+
+
+def _wait_for_decisions(nodes, is_decided, sink, timeout):
+    start = time.perf_counter()
+    last_rows, last_progress = -1, start
+    while True:
+        now = time.perf_counter()
+        if all(is_decided(node) for node in nodes):
+            return now - start
+        rows = sink.rows_written
+        if rows != last_rows:
+            last_rows, last_progress = rows, now
+        if now - start >= timeout or now - last_progress >= QUIET_PERIOD:
+            return None
+        time.sleep(POLL_INTERVAL)
+
+
+def run_cell(cell, timeout):
+    """
+    Runs one cell on the AHC driver of its protocol in the current process.
+
+    The driver modules keep their topology in globals, so this must run in a fresh process. The traces are written
+    to the current directory.
+
+    :param SweepCell cell: The cell to run.
+    :param float timeout: Seconds to wait for every node to decide.
+    :return: A dict of the result columns.
+    """
+    random.seed(cell.seed)
+    graph = build_graph(cell.topology, cell.nodes, cell.seed)
+    if cell.protocol == 'consensus':
+        import ConveniantByzantineConsensus
+        import ByzantineConsensusTest as driver
+        ConveniantByzantineConsensus.byzantine_count = len(cell.byzantine)
+        trace_filename = ConveniantByzantineConsensus.TRACE_FILENAME
+        driver.setup_csv_logger(trace_filename)
+        nodes = driver.setup_experiment(graph, cell.byzantine)
+
+        def is_decided(node):
+            return node.flag
+
+        def decision(node):
+            return node.final_decision
+    else:
+        import ConveniantByzantineAuth
+        import ByzantineAuthTest as driver
+        trace_filename = ConveniantByzantineAuth.TRACE_FILENAME
+        driver.setup_csv_logger(trace_filename)
+        # The general only sends, the agreement is among the other nodes
+        nodes = [node for node in driver.setup_experiment(graph, cell.byzantine, cell.general, cell.k)
+                 if not node.is_general]
+
+        def is_decided(node):
+            return node.is_decided
+
+        def decision(node):
+            return node.final_decision
+
+    from TraceSink import get_trace_sink
+    sink = get_trace_sink(trace_filename)
+    start = time.perf_counter()
+    driver._topology.start()
+    time_to_decision = _wait_for_decisions(nodes, is_decided, sink, timeout)
+    wall_time = time.perf_counter() - start
+    driver.end_experiment(trace_filename)
+
+    honest = [node for node in nodes if not node.is_byzantine]
+    honest_values = {decision(node) for node in honest if is_decided(node)}
+    honest_decided = sum(1 for node in honest if is_decided(node))
+    return {
+        'status': 'ok',
+        'decided': sum(1 for node in nodes if is_decided(node)),
+        'honest_decided': honest_decided,
+        'agreement': int(honest_decided == len(honest) and len(honest_values) == 1 and None not in honest_values),
+        'decision': honest_values.pop() if len(honest_values) == 1 else '',
+        'time_to_decision': '' if time_to_decision is None else f"{time_to_decision:.4f}",
+        'wall_time': f"{wall_time:.4f}",
+        'messages': sink.rows_written,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def _cell_worker(cell, timeout, directory, connection):
+    os.chdir(directory)
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        result = run_cell(cell, timeout)
+    except Exception:
+        result = {'status': 'error', 'error': traceback.format_exc(limit=3).strip().splitlines()[-1]}
+    connection.send(result)
+    connection.close()
+    # AHC component threads are not daemons and never stop on their own, os._exit skips the atexit hooks
+    from TraceSink import close_trace_sinks
+    close_trace_sinks()
+    os._exit(0)
+
+
+def load_results(filename):
+    """
+    Reads the rows of an existing results table.
+
+    :return: A dict of cell id to row, empty if the file does not exist.
+    """
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, newline='') as file:
+        return {row['cell_id']: row for row in csv.DictReader(file)}
+
+
+def _row(cell, result):
+    row = {column: '' for column in RESULT_COLUMNS}
+    row.update({
+        'cell_id': cell_id(cell),
+        'protocol': cell.protocol,
+        'nodes': cell.nodes,
+        'byzantine': ' '.join(str(node_id) for node_id in cell.byzantine),
+        'general': '' if cell.general is None else cell.general,
+        'k': '' if cell.k is None else cell.k,
+        'topology': cell.topology,
+        'seed': cell.seed,
+    })
+    row.update(result)
+    return row
+
+
+def run_sweep(cells, output, jobs=None, timeout=60.0, retry_failed=False):
+    """
+    Runs the cells of a sweep in isolated worker processes and appends one row per cell to a CSV table.
+
+    Cells already in the table are skipped, so an interrupted sweep resumes where it stopped. A worker that does not
+    report within timeout + KILL_GRACE seconds is killed and its cell recorded with status "timeout". Every worker
+    writes its traces to a temporary directory that is removed once the worker is gone.
+
+    :param list cells: The :class:`SweepCell` list, see :func:`expand_grid`.
+    :param str output: The results table.
+    :param int jobs: Number of concurrent workers, defaults to the number of cores.
+    :param float timeout: Seconds each run may take to decide.
+    :param bool retry_failed: Run cells again whose recorded status is not "ok".
+    :return: The number of cells run.
+    """
+    done = load_results(output)
+    pending = [cell for cell in cells
+               if cell_id(cell) not in done or (retry_failed and done[cell_id(cell)]['status'] != 'ok')]
+    jobs = jobs or os.cpu_count() or 1
+    context = multiprocessing.get_context('spawn')
+    new_file = not os.path.exists(output) or os.path.getsize(output) == 0
+    with open(output, 'a', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=RESULT_COLUMNS)
+        if new_file:
+            writer.writeheader()
+        running = {}
+        queue = list(reversed(pending))
+        while queue or running:
+            while queue and len(running) < jobs:
+                cell = queue.pop()
+                directory = tempfile.TemporaryDirectory(prefix='sweep-')
+                receiver, sender = context.Pipe(duplex=False)
+                worker = context.Process(target=_cell_worker, args=(cell, timeout, directory.name, sender),
+                                         daemon=True)
+                worker.start()
+                sender.close()
+                running[cell] = (worker, receiver, directory, time.perf_counter())
+            for cell, (worker, receiver, directory, started) in list(running.items()):
+                result = None
+                if receiver.poll():
+                    try:
+                        result = receiver.recv()
+                    except EOFError:
+                        result = {'status': 'error', 'error': f"worker exited with code {worker.exitcode}"}
+                elif time.perf_counter() - started > timeout + KILL_GRACE:
+                    result = {'status': 'timeout'}
+                if result is None:
+                    continue
+                worker.kill()
+                worker.join()
+                receiver.close()
+                directory.cleanup()
+                del running[cell]
+                writer.writerow(_row(cell, result))
+                file.flush()
+                print(f"{cell_id(cell)}: {result['status']}")
+            time.sleep(POLL_INTERVAL)
+    return len(pending)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a parameter sweep of the AHC consensus drivers.")
+    parser.add_argument('--protocol', nargs='+', choices=PROTOCOLS, default=['consensus'])
+    parser.add_argument('-n', '--nodes', type=int, nargs='+', default=[8])
+    parser.add_argument('-b', '--byzantine', type=parse_byzantine, nargs='+', default=[1],
+                        help="Byzantine counts, or comma separated ids like 1,2,4")
+    parser.add_argument('-g', '--general', type=int, nargs='+', default=[0])
+    parser.add_argument('-k', '--pulses', type=int, nargs='+', default=[None])
+    parser.add_argument('--topology', nargs='+', choices=TOPOLOGIES, default=['complete'])
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0])
+    parser.add_argument('-j', '--jobs', type=int, default=None)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--retry-failed', action='store_true')
+    parser.add_argument('-o', '--output', default='sweep_results.csv')
+    args = parser.parse_args()
+
+    cells = expand_grid(args.protocol, args.nodes, args.byzantine, args.general, args.pulses, args.topology,
+                        args.seeds)
+    count = run_sweep(cells, args.output, args.jobs, args.timeout, args.retry_failed)
+    print(f"Ran {count} of {len(cells)} cells, results in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
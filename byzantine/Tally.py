@@ -0,0 +1,85 @@
+import threading
+
+
+class SenderIndex:
+    """
+    Dense bit positions of sender ids, shared by the tallies of a run so every tally only holds bits.
+    """
+    def __init__(self):
+        self._positions = {}
+        self._lock = threading.Lock()
+
+    def position(self, sender):
+        """
+        Returns the bit position of a sender, assigning the next free one to a new sender.
+        """
+        position = self._positions.get(sender)
+        if position is None:
+            with self._lock:
+                position = self._positions.setdefault(sender, len(self._positions))
+        return position
+
+    def __len__(self):
+        return len(self._positions)
+
+
+sender_index = SenderIndex()
+
+
+class SenderTally:
+    """
+    Records which senders sent which value, counting every sender at most once per value.
+
+    Every value has a bitset with one bit per sender position and a running count, so recording a message and
+    checking the count against a threshold are O(1), duplicates from the same sender cost no more than a bit test,
+    and tracking n senders takes n / 8 bytes per value.
+
+    :param int values: Number of values, the values are 0 to values - 1.
+    :param int senders: Number of senders to reserve bits for, the bitsets grow beyond it.
+    :param SenderIndex index: Positions of the sender ids, the shared sender_index by default.
+
+    Attributes:
+        counts (list): Number of senders per value.
+    """
+    __slots__ = ('bits', 'counts', 'index')
+
+    def __init__(self, values=2, senders=0, index=None):
+        self.bits = [bytearray((senders + 7) >> 3) for _ in range(values)]
+        self.counts = [0] * values
+        self.index = index if index is not None else sender_index
+
+    def add(self, sender, value):
+        """
+        Records that a sender sent a value.
+
+        :param sender: Id of the sender.
+        :param int value: The value.
+        :return: The number of senders of the value, 0 if this sender was already counted for it.
+        """
+        position = self.index.position(sender)
+        bits = self.bits[value]
+        byte = position >> 3
+        if byte >= len(bits):
+            bits.extend(bytes(byte + 1 - len(bits)))
+        mask = 1 << (position & 7)
+        if bits[byte] & mask:
+            return 0
+        bits[byte] |= mask
+        count = self.counts[value] + 1
+        self.counts[value] = count
+        return count
+
+    def has(self, sender, value):
+        """
+        Returns whether a sender was counted for a value.
+        """
+        position = self.index.position(sender)
+        bits = self.bits[value]
+        return (position >> 3) < len(bits) and bool(bits[position >> 3] & (1 << (position & 7)))
+
+    @property
+    def total(self):
+        """
+        Number of counted (sender, value) pairs.
+        """
+        return sum(self.counts)
@@ -0,0 +1,109 @@
+import threading
+
+QUIESCENT = 'quiescent'
+DECIDED = 'decided'
+STOPPED = 'stopped'
+
+
+class TerminationDetector:
+    """
+    Global termination detection for threaded nodes by counting the messages in flight.
+
+    Nodes report every message before they put it into an inbox and every message they finished handling. Each
+    attached node also holds one start token until it has sent its initial messages, so the count can only drop to
+    zero once every node started and no message is queued or being handled: the system is quiescent. Since a
+    handler reports what it sends before it reports itself processed, the count never drops to zero early.
+
+    The run also ends once all deciders decided. Either way the detector stops every node and wakes :meth:`wait`.
+
+    :param bool stop_when_decided: End the run as soon as all deciders decided instead of waiting for quiescence.
+    :param on_terminate: Callable receiving the reason once the run ended (optional).
+
+    Attributes:
+        in_flight (int): Messages sent and not handled yet, plus the start tokens of the nodes.
+        processed (int): Number of handled messages.
+        reason (str): QUIESCENT, DECIDED or STOPPED once the run ended, None before.
+    """
+    def __init__(self, stop_when_decided=True, on_terminate=None):
+        self.stop_when_decided = stop_when_decided
+        self.on_terminate = on_terminate
+        self.in_flight = 0
+        self.processed = 0
+        self.reason = None
+        self.nodes = []
+        self._undecided = set()
+        self._lock = threading.Lock()
+        self._terminated = threading.Event()
+
+    def attach(self, nodes, deciders=None):
+        """
+        Makes the detector track a set of nodes before they are started.
+
+        :param nodes: The nodes, each with a detector attribute and a stop() method.
+        :param deciders: The nodes whose decisions end the run, the non-Byzantine ones by default.
+        """
+        nodes = list(nodes)
+        if deciders is None:
+            deciders = [node for node in nodes if not node.is_byzantine]
+        with self._lock:
+            self.nodes.extend(nodes)
+            self.in_flight += len(nodes)
+            self._undecided.update(id(node) for node in deciders)
+        for node in nodes:
+            node.detector = self
+
+    def message_sent(self, count=1):
+        """
+        Counts messages about to be put into inboxes. Must be called before the puts.
+        """
+        with self._lock:
+            self.in_flight += count
+
+    def message_processed(self):
+        """
+        Counts a handled message, or a node's start token once it sent its initial messages.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            self.processed += 1
+            quiescent = self.in_flight == 0
+        if quiescent:
+            self.terminate(QUIESCENT)
+
+    def node_decided(self, node):
+        """
+        Counts the decision of a node.
+        """
+        with self._lock:
+            self._undecided.discard(id(node))
+            all_decided = not self._undecided
+        if all_decided and self.stop_when_decided:
+            self.terminate(DECIDED)
+
+    @property
+    def terminated(self):
+        return self._terminated.is_set()
+
+    def terminate(self, reason=STOPPED):
+        """
+        Ends the run once: records the reason, stops every node and wakes the waiting driver.
+        """
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+        for node in self.nodes:
+            node.stop()
+        self._terminated.set()
+        if self.on_terminate is not None:
+            self.on_terminate(reason)
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the run ended.
+
+        :param float timeout: Seconds to wait at most (optional).
+        :return: The reason the run ended, None on timeout.
+        """
+        self._terminated.wait(timeout)
+        return self.reason
@@ -0,0 +1,134 @@
+import atexit
+import csv
+import threading
+from collections import deque
+
+# Default number of queued rows that triggers an early flush
+TRACE_FLUSH_SIZE = 1024
+# Default number of seconds between two periodic flushes
+TRACE_FLUSH_INTERVAL = 0.5
+
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+
+class CsvTraceSink:
+    """
+    Buffered CSV trace writer shared by all nodes that log to the same file.
+
+    Rows are appended to an in-memory queue by :meth:`write`, which never touches the file, and a background
+    writer thread drains the queue in batches. The file is opened once and kept open until :meth:`close`.
+
+    :param str filename: Path of the CSV file, rows are appended to it.
+    :param int flush_size: Number of queued rows that wakes the writer before the interval elapses.
+    :param float flush_interval: Maximum number of seconds a row stays queued before it is written.
+
+    Attributes:
+        rows_written (int): Number of rows written to the file so far.
+        flushes (int): Number of batches the writer thread has written.
+    """
+    def __init__(self, filename, flush_size=None, flush_interval=None):
+        self.filename = filename
+        self.flush_size = flush_size if flush_size is not None else TRACE_FLUSH_SIZE
+        self.flush_interval = flush_interval if flush_interval is not None else TRACE_FLUSH_INTERVAL
+        self.rows_written = 0
+        self.flushes = 0
+        self._rows = deque()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._file = open(filename, mode='a', newline='')
+        self._writer = csv.writer(self._file)
+        self._thread = threading.Thread(target=self._run, name=f"CsvTraceSink({filename})", daemon=True)
+        self._thread.start()
+
+    def write(self, row):
+        """
+        Queues a row for writing, unless the sink is closed. Safe to call from any thread, never blocks on I/O.
+
+        :param list row: The CSV row to append.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._rows.append(row)
+        if len(self._rows) >= self.flush_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Asks the writer thread to write every queued row as soon as possible.
+        """
+        self._wakeup.set()
+
+    def close(self):
+        """
+        Writes every queued row, stops the writer thread and closes the file.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wakeup.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._drain()
+        self._file.close()
+
+    def _drain(self):
+        batch = []
+        while self._rows:
+            batch.append(self._rows.popleft())
+        if batch:
+            self._writer.writerows(batch)
+            self._file.flush()
+            self.rows_written += len(batch)
+            self.flushes += 1
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._drain()
+
+
+def get_trace_sink(filename, flush_size=None, flush_interval=None):
+    """
+    Returns the shared sink of a trace file, creating it on first use.
+
+    :param str filename: Path of the CSV file.
+    :param int flush_size: Flush size used if the sink is created by this call.
+    :param float flush_interval: Flush interval used if the sink is created by this call.
+    :return: The sink writing to filename.
+    """
+    sink = _sinks.get(filename)
+    if sink is None:
+        with _sinks_lock:
+            sink = _sinks.get(filename)
+            if sink is None:
+                sink = CsvTraceSink(filename, flush_size, flush_interval)
+                _sinks[filename] = sink
+    return sink
+
+
+def close_trace_sink(filename):
+    """
+    Flushes and closes the sink of a trace file if it is open.
+
+    :param str filename: Path of the CSV file.
+    """
+    with _sinks_lock:
+        sink = _sinks.pop(filename, None)
+    if sink is not None:
+        sink.close()
+
+
+def close_trace_sinks():
+    """
+    Flushes and closes every open trace sink.
+    """
+    for filename in list(_sinks.keys()):
+        close_trace_sink(filename)
+
+
+atexit.register(close_trace_sinks)